@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class TasksConfig(AppConfig):
     name = 'tasks'
+
+    def ready(self):
+        """ connect the signal receivers of the tasks app. """
+
+        from . import signals  # noqa: F401
@@ -0,0 +1,280 @@
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional, without it the files are only gzipped.
+    brotli = None
+
+# the files worth compressing, the images and fonts are compressed already.
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.html', '.txt', '.json', '.xml', '.ico', '.eot', '.ttf', '.otf')
+
+# the compressed files kept next to the collected ones, in the order they're
+# preferred: Content-Encoding and suffix.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# a compressed file is kept only if it's smaller than this share of the file.
+MIN_COMPRESSION_RATIO = 0.95
+
+# how long the browsers keep the files with a hash in their name, a year.
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# how long they keep the other ones before asking again if they changed.
+MUTABLE_MAX_AGE = 60
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def compress_file(path):
+    """
+    write the gzip and, if brotli is installed, the brotli compressed
+    copies of a file next to it, path.gz and path.br . returns the paths
+    of the written copies. a copy not smaller than the file is removed.
+    """
+
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    compressors = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        compressors.append(('.br', lambda data: brotli.compress(data, quality=11)))
+
+    written = []
+    for suffix, compress in compressors:
+        compressed = compress(content)
+        if len(compressed) < len(content) * MIN_COMPRESSION_RATIO:
+            with open(path + suffix + '.tmp', 'wb') as f:
+                f.write(compressed)
+            os.replace(path + suffix + '.tmp', path + suffix)
+            written.append(path + suffix)
+        elif os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    the static files collected with a hash of their content in their name,
+    like ManifestStaticFilesStorage, and compressed. collectstatic writes
+    the gzip and brotli copies of the hashed files next to them, the
+    serve view sends them to the browsers accepting them. the hashed
+    files never change, the copies are only written once. until
+    collectstatic has written the manifest, the files are used with
+    their plain names, like with the default storage.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest_found = self.exists(self.manifest_name)
+
+    def stored_name(self, name):
+        if not self.manifest_found:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+
+        for name in sorted(set(self.hashed_files.values())):
+            path = self.path(name)
+            if not name.endswith(COMPRESSED_EXTENSIONS) or not os.path.isfile(path):
+                continue
+            if any(os.path.exists(path + suffix) for _, suffix in ENCODINGS):
+                continue
+            for compressed in compress_file(path):
+                yield name, name + compressed[len(path):], True
+
+
+_hashed_names = (None, frozenset())
+
+
+def is_hashed(name):
+    """
+    returns True if a static file has the hash of its content in its
+    name, from the manifest of the storage.
+    """
+
+    global _hashed_names
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', None)
+    if _hashed_names[0] is not hashed_files:
+        _hashed_names = (hashed_files, frozenset(hashed_files.values()) if hashed_files else frozenset())
+
+    return name in _hashed_names[1]
+
+
+def accepted_encodings(request):
+    """
+    returns the content codings of the Accept-Encoding header, without
+    the ones refused with q=0.
+    """
+
+    encodings = set()
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = coding.strip().partition(';')
+        if coding and params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            encodings.add(coding.lower())
+
+    return encodings
+
+
+def byte_range(request, size, etag):
+    """
+    returns the (first, last) byte of the Range header of the request, or
+    None to send the whole file: without a range, with more than one or
+    with an If-Range of another version of the file. raises ValueError if
+    the range is outside the file.
+    """
+
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag:
+        return None
+
+    match = RANGE_RE.match(header.strip())
+    if match is None or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if first == '':
+        # the last bytes of the file.
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+
+    if first >= size or first > last:
+        raise ValueError("the range is outside the file")
+
+    return first, last
+
+
+class FileRange:
+    """
+    a part of an open file, read by FileResponse or by the file wrapper
+    of the wsgi server. it has the fileno and position of the file, so
+    the servers using sendfile send it from the kernel.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+@require_safe
+def serve(request, path, document_root=None):
+    """
+    serve a static file collected in document_root, the STATIC_ROOT. the
+    files with a hash in their name are cached by the browsers for a year
+    without asking again, the other ones are revalidated with their etag.
+    the browsers accepting brotli or gzip get the compressed copy written
+    by collectstatic, the single range requests get the part of the file
+    they ask for. the file is sent with the file wrapper of the wsgi
+    server, with sendfile when it supports it. with the
+    TASKS_STATIC_ACCEL_REDIRECT setting, the url prefix of an internal
+    nginx location of the same directory, nginx sends the file and the
+    worker is free right away.
+    """
+
+    name = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(document_root or settings.STATIC_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404("'{}' is outside of the static files".format(path))
+    if not os.path.isfile(fullpath):
+        raise Http404("'{}' does not exist".format(path))
+
+    # the ranges are parts of the uncompressed file.
+    encoding, suffix = None, ''
+    if not request.META.get('HTTP_RANGE'):
+        accepted = accepted_encodings(request)
+        for coding, coding_suffix in ENCODINGS:
+            if coding in accepted and os.path.isfile(fullpath + coding_suffix):
+                encoding, suffix = coding, coding_suffix
+                break
+
+    stat = os.stat(fullpath)
+    # every encoding of the file has its own etag.
+    etag = quote_etag('{:x}-{:x}{}'.format(int(stat.st_mtime), stat.st_size, '-' + encoding if encoding else ''))
+    content_type, _ = mimetypes.guess_type(fullpath)
+
+    headers = {
+        'Cache-Control': 'public, max-age={}, immutable'.format(IMMUTABLE_MAX_AGE) if is_hashed(name)
+                         else 'public, max-age={}'.format(MUTABLE_MAX_AGE),
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Vary': 'Accept-Encoding',
+        'Accept-Ranges': 'bytes',
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is not None:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    if getattr(settings, 'TASKS_STATIC_ACCEL_REDIRECT', None):
+        # nginx sends the file, the ranges too.
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = settings.TASKS_STATIC_ACCEL_REDIRECT.rstrip('/') + '/' + name + suffix
+    else:
+        file = open(fullpath + suffix, 'rb')
+        size = os.fstat(file.fileno()).st_size
+        try:
+            part = byte_range(request, size, etag)
+        except ValueError:
+            file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+
+        if part is None:
+            response = FileResponse(file)
+            response['Content-Length'] = size
+        else:
+            first, last = part
+            file.seek(first)
+            response = FileResponse(FileRange(file, last - first + 1), status=206)
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(first, last, size)
+            response['Content-Length'] = last - first + 1
+
+    # set after FileResponse, it guesses the type of a .gz as a gzip file.
+    response['Content-Type'] = content_type or 'application/octet-stream'
+    if encoding is not None:
+        response['Content-Encoding'] = encoding
+    for header, value in headers.items():
+        response[header] = value
+
+    return response
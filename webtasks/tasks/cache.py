@@ -0,0 +1,256 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template import loader
+from django.utils.safestring import mark_safe
+from datetime import datetime, timezone
+from .metrics import record_cache
+from .models import Task
+from .routers import reading_from_replica, replica_aliases, sticky_seconds
+import hashlib
+import json
+import math
+import time
+import uuid
+
+# how long the details of a task are kept in the cache, in seconds.
+# they are removed before that when the task or its owner change.
+TASK_DETAILS_TIMEOUT = getattr(settings, 'TASKS_DETAILS_CACHE_TIMEOUT', 60 * 60)
+
+TASK_DETAILS_KEY = 'tasks:details:{}'
+OWNER_VERSION_KEY = 'tasks:owner:{}:version'
+INDEX_SUMMARY_KEY = 'tasks:index:summary'
+
+# how long a rendered row of the tasks page is kept in the cache, in
+# seconds, at most until the status of the task changes.
+TASK_ROW_TIMEOUT = getattr(settings, 'TASKS_ROW_CACHE_TIMEOUT', 60 * 60)
+
+# change the v1 when the row template changes, the rows rendered with
+# the old one are never read again.
+TASK_ROW_KEY = 'tasks:row:v1:{}:{}:{}'
+
+# left in the cache in place of invalidated details or summary while
+# the replicas can still have the old rows, see store.
+INVALIDATED = {'invalidated': True}
+
+
+def store(key, value, timeout):
+    """
+    cache a value read from the database. a value read from a replica
+    doesn't replace one invalidated lately, the replica could be behind
+    the write that invalidated it.
+    """
+
+    if reading_from_replica():
+        cache.add(key, value, timeout)
+    else:
+        cache.set(key, value, timeout)
+
+
+def invalidate(key):
+    """
+    remove a value from the cache. with replicas it's replaced by
+    INVALIDATED until they have the write, TASKS_REPLICA_STICKY_SECONDS.
+    """
+
+    if replica_aliases():
+        cache.set(key, INVALIDATED, sticky_seconds())
+    else:
+        cache.delete(key)
+
+
+def invalidate_many(keys):
+    """
+    remove many values from the cache at once, like invalidate.
+    """
+
+    if replica_aliases():
+        cache.set_many({key: INVALIDATED for key in keys}, sticky_seconds())
+    else:
+        cache.delete_many(keys)
+
+
+def details_etag(data):
+    """
+    a strong etag of the details of a task, the hash of their json
+    representation. the same details always give the same etag.
+    """
+
+    content = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return '"{}"'.format(hashlib.sha1(content.encode('utf-8')).hexdigest())
+
+
+def get_owner_version(owner_id):
+    """
+    the version of the owner's row, changed every time the owner is
+    saved or deleted. a missing version, never set or evicted, is 
+    replaced by a new one, so no cached details match it anymore.
+    """
+
+    key = OWNER_VERSION_KEY.format(owner_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+
+    return version
+
+
+def get_task_details(task_id):
+    """
+    return the cached details of a task, a dict with the serialized
+    data, the etag and the time they were cached, or None if they
+    are not cached or the owner changed since.
+    """
+
+    details = cache.get(TASK_DETAILS_KEY.format(task_id))
+    if details is not None and details.get('invalidated'):
+        details = None
+    elif details is not None and details['owner_version'] != get_owner_version(details['owner_id']):
+        invalidate(TASK_DETAILS_KEY.format(task_id))
+        details = None
+
+    record_cache('details', details is not None)
+    return details
+
+
+def set_task_details(task, data):
+    """
+    cache the serialized details of a task with their etag. the time
+    they are cached is their last modification time, any change of
+    the task or its owner before that removes them from the cache.
+    """
+
+    details = {
+        'data': data,
+        'etag': details_etag(data),
+        'last_modified': int(time.time()),
+        'owner_id': task.owner_id,
+        'owner_version': get_owner_version(task.owner_id),
+    }
+    store(TASK_DETAILS_KEY.format(task.id), details, TASK_DETAILS_TIMEOUT)
+
+    return details
+
+
+def invalidate_task_details(task_id):
+    """
+    remove the details of a task from the cache.
+    """
+
+    invalidate(TASK_DETAILS_KEY.format(task_id))
+
+
+def invalidate_many_task_details(task_ids):
+    """
+    remove the details of many tasks from the cache at once.
+    """
+
+    invalidate_many([TASK_DETAILS_KEY.format(task_id) for task_id in task_ids])
+
+
+def invalidate_owner_details(owner_id):
+    """
+    a new version of the owner makes the cached details of all its
+    tasks invalid, without looking for the tasks.
+    """
+
+    cache.set(OWNER_VERSION_KEY.format(owner_id), uuid.uuid4().hex, None)
+
+
+def get_index_summary(now=None):
+    """
+    return the summary of the tasks shown on the index page from the
+    cache. it's computed and cached again when it's missing or when a
+    task started or ended since it was computed, so a cached summary
+    is never stale. it expires from the cache at the next start or end
+    of a task, and is removed when a task is saved or deleted.
+    """
+
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    summary = cache.get(INDEX_SUMMARY_KEY)
+    hit = summary is not None and not summary.get('invalidated') and (
+        summary['valid_until'] is None or summary['valid_until'] > now)
+    record_cache('index_summary', hit)
+    if hit:
+        return summary
+
+    summary = Task.objects.summary(now=now)
+    if summary['valid_until'] is None:
+        store(INDEX_SUMMARY_KEY, summary, None)
+    elif summary['valid_until'] > now:
+        store(INDEX_SUMMARY_KEY, summary, math.ceil((summary['valid_until'] - now).total_seconds()))
+
+    return summary
+
+
+def invalidate_index_summary():
+    """
+    remove the summary of the tasks from the cache.
+    """
+
+    invalidate(INDEX_SUMMARY_KEY)
+
+
+def row_version(task):
+    """
+    the version of the row of a task, a hash of the columns the row
+    shows. a change of the task, saved or by the widening of its span,
+    gives the row a new version, so it's never read stale.
+    """
+
+    content = '|'.join(str(value) for value in (
+        task.name, task.start.isoformat(), task.end.isoformat(), task.parent_task_id, task.status))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def row_key(task):
+    """
+    the cache key of the row of a task: its id, the version of the row
+    and the end of the status validity window, the time the status
+    shown changes.
+    """
+
+    valid_until = task.status_valid_until
+    return TASK_ROW_KEY.format(
+        task.id, row_version(task), int(valid_until.timestamp()) if valid_until is not None else 'never')
+
+
+def render_task_rows(tasks, template_name='task_row.html', now=None):
+    """
+    returns the html rows of the given tasks, the unchanged ones from
+    the cache. the statuses of the tasks should be primed, see
+    prime_statuses, or reading them queries. the missing rows are
+    rendered and cached until their status changes. the key of a row
+    changes with the row, they're never invalidated.
+    """
+
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    tasks = list(tasks)
+    keys = [row_key(task) for task in tasks]
+    cached = cache.get_many(keys)
+
+    template = None
+    rows = []
+    missing = {}
+    for task, key in zip(tasks, keys):
+        row = cached.get(key)
+        record_cache('rows', row is not None)
+        if row is None:
+            template = template or loader.get_template(template_name)
+            row = template.render({'task': task})
+
+            timeout = TASK_ROW_TIMEOUT
+            if task.status_valid_until is not None:
+                timeout = min(timeout, math.ceil((task.status_valid_until - now).total_seconds()))
+            if timeout > 0:
+                missing.setdefault(timeout, {})[key] = row
+        rows.append(mark_safe(row))
+
+    for timeout, timeout_rows in missing.items():
+        cache.set_many(timeout_rows, timeout)
+
+    return rows
@@ -0,0 +1,59 @@
+from datetime import datetime
+import json
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional, without it the standard json module is used.
+    orjson = None
+
+
+def _default(value):
+    """
+    encode the datetimes like the rest framework does, iso 8601 with Z
+    for utc.
+    """
+
+    if isinstance(value, datetime):
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    raise TypeError("Type is not JSON serializable: {}".format(type(value).__name__))
+
+
+_encoder = json.JSONEncoder(separators=(',', ':'), default=_default)
+
+
+def dumps(value):
+    """
+    returns the value encoded as json bytes, with orjson if installed.
+    """
+
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_UTC_Z)
+
+    return _encoder.encode(value).encode()
+
+
+def stream_json_array(items, chunk_size=1000):
+    """
+    yields the json array of the items a chunk at a time, so a large
+    array is never encoded or kept in memory at once.
+    """
+
+    yield b'['
+    chunk = []
+    first = True
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield (b'' if first else b',') + dumps(chunk)[1:-1]
+            chunk = []
+            first = False
+
+    if chunk:
+        yield (b'' if first else b',') + dumps(chunk)[1:-1]
+
+    yield b']'
@@ -0,0 +1,289 @@
+from collections import deque
+from django.conf import settings
+from django.utils import timezone
+from itertools import islice
+from .timeline import get_timeline
+import heapq
+import json
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger("task")
+
+# the number of last events kept for the streams behind and for the
+# browsers reconnecting with the id of the last event they got.
+LIVE_EVENT_BUFFER = getattr(settings, 'TASKS_LIVE_EVENT_BUFFER', 10000)
+
+# the milliseconds a browser waits before reconnecting a closed stream.
+LIVE_RETRY_MS = 3000
+
+
+class LiveStatus(object):
+    """
+    publishes the changes of the status of the tasks for the open status
+    streams. the next time the status of every task changes is kept in a
+    min-heap, read from the timeline index, so the changes of the parent
+    tasks rolled up from their subtasks are there too. the streams wait
+    on a condition until the first of these times or until a task is
+    saved, the first one to wake up pops the due tasks and publishes the
+    ones whose status changed. between two changes only the keepalives
+    of the streams run. the events are numbered and the last ones kept,
+    a stream reads the events after the last one it sent.
+    """
+
+    def __init__(self, buffer_size=LIVE_EVENT_BUFFER):
+        self.condition = threading.Condition()
+        # the events of another process or of a restarted one are told
+        # apart by this token in their ids.
+        self.token = uuid.uuid4().hex[:8]
+        self.timeline = None
+        self.heap = []
+        self.scheduled = {}
+        self.statuses = {}
+        self.saved = {}
+        self.events = deque(maxlen=buffer_size)
+        self.last_id = 0
+
+    def publish(self, task_id, status, previous, at, reason):
+        self.last_id += 1
+        self.events.append((self.last_id, {
+            'id': task_id,
+            'status': status,
+            'previous': previous,
+            'at': at.isoformat(),
+            'reason': reason,
+        }))
+
+    def schedule(self, task_id, change):
+        """
+        push the next change of a task on the heap. the entries of its
+        earlier changes are left on the heap and skipped when popped.
+        """
+
+        if change is None:
+            self.scheduled.pop(task_id, None)
+        elif self.scheduled.get(task_id) != change:
+            self.scheduled[task_id] = change
+            heapq.heappush(self.heap, (change, task_id))
+
+    def sync(self, timeline, now):
+        """
+        read the status and the next change of every task from a new
+        timeline index, built again from the database. the tasks whose
+        status changed in the meantime, like the ones saved by other
+        processes, are published.
+        """
+
+        with timeline.lock:
+            task_ids = list(timeline.timelines)
+            timeline.take_changed_ids()
+
+        statuses = {}
+        self.heap = []
+        self.scheduled = {}
+        for task_id in task_ids:
+            statuses[task_id], change = timeline.next_change(task_id, now)
+            if change is not None:
+                self.heap.append((change, task_id))
+                self.scheduled[task_id] = change
+        heapq.heapify(self.heap)
+
+        if self.timeline is not None:
+            for task_id in sorted(statuses.keys() | self.statuses.keys()):
+                status, previous = statuses.get(task_id), self.statuses.get(task_id)
+                if status != previous:
+                    self.publish(task_id, status, previous, now, 'sync')
+
+        self.timeline = timeline
+        self.statuses = statuses
+        logger.debug("live status of %s tasks synced, %s changes scheduled", len(statuses), len(self.heap))
+
+    def refresh(self, task_id, at, reason):
+        """
+        read the status of a task right after the given time and publish
+        it if it changed, or anyway if the task was saved or deleted.
+        """
+
+        status, change = self.timeline.next_change(task_id, at)
+        previous = self.statuses.pop(task_id, None)
+        if status is not None:
+            self.statuses[task_id] = status
+        self.schedule(task_id, change)
+
+        if status != previous or reason in ('save', 'delete'):
+            self.publish(task_id, status, previous, at, reason)
+
+    def advance(self, timeline):
+        """
+        publish the changes of the saved tasks and the due changes of the
+        heap. called with the condition acquired, the waiting streams are
+        woken up if anything is published.
+        """
+
+        now = timezone.now()
+        last_id = self.last_id
+
+        if timeline is not self.timeline:
+            self.sync(timeline, now)
+        saved, self.saved = self.saved, {}
+        changed_ids = timeline.take_changed_ids() - saved.keys()
+        for task_id in sorted(saved):
+            self.refresh(task_id, now, saved[task_id])
+        for task_id in sorted(changed_ids):
+            # the parent tasks of the saved tasks.
+            self.refresh(task_id, now, 'rollup')
+
+        while self.heap and self.heap[0][0] <= now:
+            change, task_id = heapq.heappop(self.heap)
+            if self.scheduled.get(task_id) == change:
+                self.refresh(task_id, change, 'time')
+
+        if self.last_id != last_id:
+            self.condition.notify_all()
+
+    def notify(self, task_id, reason='save'):
+        """
+        a task was saved or deleted, its change is published right away
+        to the waiting streams.
+        """
+
+        with self.condition:
+            self.saved[task_id] = reason
+            self.condition.notify_all()
+
+    def events_after(self, event_id):
+        """
+        returns the kept events after the given event id, None if some of
+        them aren't kept anymore.
+        """
+
+        if not self.events or event_id >= self.last_id:
+            return []
+        first_id = self.events[0][0]
+        if event_id < first_id - 1:
+            return None
+        return list(islice(self.events, event_id - first_id + 1, None))
+
+    def resume_id(self, last_event_id=None):
+        """
+        returns the id of the last event a stream already got, from the
+        Last-Event-ID header of a reconnecting browser, or the id of the
+        last published event for a new stream. None if the events after
+        it can't be resumed.
+        """
+
+        timeline = get_timeline()
+        with self.condition:
+            self.advance(timeline)
+            if last_event_id is None:
+                return self.last_id
+
+            token, _, event_id = last_event_id.partition('-')
+            if token != self.token or not event_id.isdigit() or self.events_after(int(event_id)) is None:
+                return None
+            return int(event_id)
+
+    def wait(self, event_id, timeout):
+        """
+        returns the events after the given event id, waiting at most
+        timeout seconds for one. the wait ends at the next scheduled
+        change of the heap or when a task is saved. None if some of the
+        events after the given id aren't kept anymore.
+        """
+
+        deadline = time.monotonic() + timeout
+        while True:
+            # built again out of the condition when it's expired, the
+            # database isn't queried while the other streams wait.
+            timeline = get_timeline()
+            with self.condition:
+                self.advance(timeline)
+                if self.last_id > event_id:
+                    return self.events_after(event_id)
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                if self.heap:
+                    remaining = min(remaining, max((self.heap[0][0] - timezone.now()).total_seconds(), 0))
+                if not self.saved:
+                    self.condition.wait(remaining)
+
+    def event_id(self, event_id):
+        return '{}-{}'.format(self.token, event_id)
+
+
+_live_status = None
+_live_status_lock = threading.Lock()
+
+
+def get_live_status():
+    """
+    returns the live status of this process, created for the first
+    stream.
+    """
+
+    global _live_status
+    with _live_status_lock:
+        if _live_status is None:
+            _live_status = LiveStatus()
+        return _live_status
+
+
+def notify_saved(task_id, reason='save'):
+    """
+    publish the change of a saved or deleted task, if a stream was opened
+    in this process.
+    """
+
+    if _live_status is not None:
+        _live_status.notify(task_id, reason)
+
+
+def status_events(last_event_id=None, task_ids=None):
+    """
+    the server-sent events of the changes of the status of the tasks, or
+    of the tasks with the given ids only. every event is a json object:
+    {"id": 5, "status": "Running", "previous": "Scheduled",
+    "at": "2019-08-01T10:00:00+00:00", "reason": "time"}. the reason is
+    time for a start or an end, rollup for a parent task whose subtasks
+    changed, save or delete for a saved or deleted task and sync for a
+    change read from the database, made by another process. a reset event
+    tells the browser to read all the statuses again, the events it
+    missed aren't kept anymore. the stream sends a comment every
+    TASKS_LIVE_KEEPALIVE seconds and ends after TASKS_LIVE_STREAM_SECONDS,
+    the browser reconnects with the id of the last event it got.
+    """
+
+    live = get_live_status()
+    keepalive = getattr(settings, 'TASKS_LIVE_KEEPALIVE', 15)
+    deadline = time.monotonic() + getattr(settings, 'TASKS_LIVE_STREAM_SECONDS', 10 * 60)
+
+    event_id = live.resume_id(last_event_id)
+    yield 'retry: {}\n\n'.format(LIVE_RETRY_MS)
+
+    while True:
+        if event_id is None:
+            event_id = live.resume_id()
+            yield 'id: {}\nevent: reset\ndata: {{}}\n\n'.format(live.event_id(event_id))
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+
+        events = live.wait(event_id, min(keepalive, remaining))
+        if events is None:
+            event_id = None
+            continue
+        if not events:
+            yield ': keepalive\n\n'
+            continue
+
+        chunks = []
+        for event_id, event in events:
+            if task_ids is None or event['id'] in task_ids:
+                chunks.append('id: {}\nevent: status\ndata: {}\n\n'.format(live.event_id(event_id), json.dumps(event)))
+        if chunks:
+            yield ''.join(chunks)
@@ -0,0 +1,122 @@
+from django.utils.module_loading import import_string
+from logging.handlers import QueueHandler, QueueListener
+import copy
+import logging
+import os
+import queue
+import random
+
+# the most records waiting to be written, the next ones are dropped.
+LOG_QUEUE_SIZE = 10000
+
+
+class QueuedHandler(QueueHandler):
+    """
+    a handler putting the records on a queue, written by another handler
+    from a thread of its own, so the requests don't wait for the disk.
+    it's configured in the LOGGING setting with the class and arguments
+    of the handler writing the records:
+    'file': {
+        '()': 'tasks.log.QueuedHandler',
+        'handler_class': 'logging.handlers.RotatingFileHandler',
+        'filename': 'debug.log',
+        'formatter': 'standard',
+    }
+    only the message is merged with its arguments in the logging thread,
+    the arguments can't change once queued. the rest of the formatting
+    and the writing happen in the thread of the queue. when the queue is
+    full the records are dropped and their number logged later.
+    """
+
+    def __init__(self, handler_class, queue_size=LOG_QUEUE_SIZE, **kwargs):
+        super().__init__(queue.Queue(queue_size))
+        self.handler = import_string(handler_class)(**kwargs)
+        self.listener = None
+        self.pid = None
+        self.dropped = 0
+        self.start()
+
+    def start(self):
+        """
+        start the thread writing the records. a forked process has no
+        thread and a new queue, it's started again on its first record.
+        """
+
+        if self.pid is not None:
+            self.queue = queue.Queue(self.queue.maxsize)
+        self.pid = os.getpid()
+        self.listener = QueueListener(self.queue, self.handler, respect_handler_level=True)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        # the records are formatted by the writing handler.
+        self.handler.setFormatter(fmt)
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.pid != os.getpid():
+            self.start()
+
+        if self.dropped:
+            try:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': record.name,
+                    'levelno': logging.WARNING,
+                    'levelname': logging.getLevelName(logging.WARNING),
+                    'msg': "{} log records dropped, the log queue was full".format(self.dropped),
+                }))
+                self.dropped = 0
+            except queue.Full:
+                pass
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """
+        wait until the queued records are written.
+        """
+
+        if self.listener is not None and self.pid == os.getpid():
+            self.queue.join()
+        self.handler.flush()
+
+    def close(self):
+        """
+        write the queued records and stop the thread, called when the
+        process exits.
+        """
+
+        if self.listener is not None and self.pid == os.getpid():
+            self.queue.join()
+            self.listener.stop()
+        self.listener = None
+        self.handler.close()
+        super().close()
+
+
+class SampledFilter(logging.Filter):
+    """
+    keeps a random sample of the records up to the given level, the rate
+    is the share of them kept, like 0.01. the records of a higher level
+    are all kept. set on the loggers of the code run on every request.
+    """
+
+    def __init__(self, rate=1.0, level=logging.DEBUG):
+        super().__init__()
+        self.rate = rate
+        self.level = level if isinstance(level, int) else logging.getLevelName(level)
+
+    def filter(self, record):
+        return record.levelno > self.level or random.random() < self.rate
@@ -0,0 +1,191 @@
+from datetime import datetime, timedelta, timezone
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from tasks.models import Task
+from tasks.synthetic import SHAPES, default_origin, generate_tasks, insert_tasks
+from tasks.timeline import reset_timeline
+from tasks.views import TaskDetailsView
+import django
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+# the number of users owning the generated tasks.
+BENCHMARK_OWNERS = 100
+
+
+def percentile(values, percent):
+    """
+    returns the value below which the given percent of the values are,
+    the nearest one of the sorted values.
+    """
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    """
+    measure the pages, the API and the save of subtasks on generated
+    datasets of the given sizes and tree shapes. the datasets are
+    generated from the seed, so the same arguments measure the same
+    tasks between releases. everything runs on a test database created
+    for the benchmark, the configured database isn't touched. the
+    results are written as json: for every dataset and target the
+    latency percentiles in milliseconds, the number of queries and the
+    peak memory allocated in KB, traced in a separate run as tracing
+    slows the calls down.
+    """
+
+    help = "benchmark the pages and the API on generated datasets"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10000], help="the number of tasks of the datasets, like 10000 100000 1000000")
+        parser.add_argument('--shapes', nargs='+', choices=sorted(SHAPES), default=['wide', 'deep', 'mixed'], help="the shapes of the task trees")
+        parser.add_argument('--seed', type=int, default=0, help="the seed of the generated datasets")
+        parser.add_argument('--repeat', type=int, default=50, help="the number of calls measured per target")
+        parser.add_argument('--output', help="the json file of the results, by default written to stdout")
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat should be at least 1: {}".format(options['repeat']))
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        try:
+            results = [
+                self.run_dataset(size, shape, seed=options['seed'], repeat=options['repeat'])
+                for size in options['sizes']
+                for shape in options['shapes']
+            ]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = json.dumps({
+            'created': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'seed': options['seed'],
+            'results': results,
+        }, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report)
+            self.stdout.write("results written to {}".format(options['output']))
+        else:
+            self.stdout.write(report)
+
+    def run_dataset(self, size, shape, seed=0, repeat=50):
+        """
+        generate a dataset, replacing all the tasks, and measure every
+        target on it. returns the results of the dataset.
+        """
+
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM {}".format(connection.ops.quote_name(Task._meta.db_table)))
+
+        User.objects.bulk_create(
+            User(username='benchmark{}'.format(i)) for i in range(BENCHMARK_OWNERS - User.objects.count())
+        )
+        owner_ids = sorted(User.objects.values_list('id', flat=True))[:BENCHMARK_OWNERS]
+
+        started = time.perf_counter()
+        insert_tasks(generate_tasks(size, owner_ids, shape=shape, seed=seed, origin=default_origin()))
+        insert_seconds = time.perf_counter() - started
+
+        cache.clear()
+        reset_timeline()
+        started = time.perf_counter()
+        Task.objects.refresh_expired_statuses()
+        refresh_seconds = time.perf_counter() - started
+
+        rng = random.Random(seed)
+        task_ids = list(Task.objects.order_by().values_list('id', flat=True))
+        parents = list(
+            Task.objects.filter(sub_task__isnull=False).order_by().distinct().values_list('id', 'owner_id', 'start', 'end')
+        ) or list(Task.objects.order_by().values_list('id', 'owner_id', 'start', 'end')[:1])
+        client = Client()
+
+        def get(url):
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError("{} returned {}".format(url, response.status_code))
+            if response.streaming:
+                b''.join(response.streaming_content)
+
+        def save_subtask(i):
+            parent_id, owner_id, start, end = rng.choice(parents)
+            Task(
+                name="benchmark {}".format(i), owner_id=owner_id, parent_task_id=parent_id,
+                start=start - timedelta(minutes=1), end=end + timedelta(minutes=1),
+            ).save()
+
+        targets = [
+            # the index summary and the task details are cached, they're
+            # measured uncached.
+            self.measure('index', lambda i: get(reverse('index')), repeat, prepare=cache.clear),
+            self.measure('task_list', lambda i: get(reverse('tasks')), repeat),
+            self.measure('task_details', lambda i: get(reverse(TaskDetailsView.name, args=[rng.choice(task_ids)])), repeat, prepare=cache.clear),
+            self.measure('task_save', save_subtask, repeat),
+        ]
+
+        self.stderr.write("{} tasks {}: inserted in {:.1f}s, statuses in {:.1f}s".format(
+            size, shape, insert_seconds, refresh_seconds))
+
+        return {
+            'size': size,
+            'shape': shape,
+            'insert_seconds': round(insert_seconds, 3),
+            'refresh_statuses_seconds': round(refresh_seconds, 3),
+            'targets': targets,
+        }
+
+    def measure(self, name, call, repeat, prepare=None):
+        """
+        call a target repeat times and returns its latency percentiles,
+        number of queries and peak memory.
+        """
+
+        timings = []
+        queries = []
+        for i in range(repeat + 1):
+            if prepare is not None:
+                prepare()
+
+            if i == repeat:
+                # the last call only traces the memory.
+                tracemalloc.start()
+                call(i)
+                _, peak_memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                break
+
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                call(i)
+                timings.append(time.perf_counter() - started)
+            queries.append(len(captured))
+
+        return {
+            'target': name,
+            'repeat': repeat,
+            'p50_ms': round(percentile(timings, 50) * 1000, 3),
+            'p90_ms': round(percentile(timings, 90) * 1000, 3),
+            'p99_ms': round(percentile(timings, 99) * 1000, 3),
+            'max_ms': round(max(timings) * 1000, 3),
+            'mean_queries': round(sum(queries) / len(queries), 2),
+            'max_queries': max(queries),
+            'peak_memory_kb': peak_memory // 1024,
+        }
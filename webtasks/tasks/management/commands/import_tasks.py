@@ -0,0 +1,197 @@
+from array import array
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from tasks.cache import invalidate_index_summary
+from tasks.models import Task
+from tasks.spans import widen_ancestor_spans
+from tasks.timeline import parse_as_of, reset_timeline
+import csv
+import json
+import os
+import time
+
+
+class Command(BaseCommand):
+    """
+    import tasks from csv or jsonl files of any size. the files are read
+    a row at a time and the tasks inserted in batches, without save.
+    every row has the columns: id, name, owner, priority, start, end
+    and parent. the id is only used as reference by the parent column
+    of other rows, of any of the files, before or after. the owner is a
+    username, the start and end iso 8601 datetimes. the tasks get new
+    ids, assigned here so the parents are resolved without a query.
+    the spans of the parent tasks are widened at the end with one
+    statement. everything is imported in one transaction. the status
+    of the imported tasks is computed and stored at the end, so the 
+    summary counts them right away.
+    """
+
+    help = "import tasks from csv or jsonl files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help="the csv (.csv) or jsonl (.jsonl, .ndjson) files")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="the format of the files, by default from their extension")
+        parser.add_argument('--batch-size', type=int, default=5000, help="the number of tasks inserted at once")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        self.batch_size = options['batch_size']
+        self.owners = dict(User.objects.values_list('username', 'id'))
+        self.priorities = {key for key, _ in Task.PRIORITIES}
+        self.name_length = Task._meta.get_field('name').max_length
+
+        with transaction.atomic():
+            self.first_id = (Task.objects.aggregate(last_id=Max('id'))['last_id'] or 0) + 1
+            self.next_id = self.first_id
+            # the ids of the references, and the ones used as parent
+            # but not imported yet.
+            self.references = {}
+            self.pending = set()
+            # the parent of every imported task, by id - first_id.
+            self.parents = array('q')
+            self.batch = []
+
+            for path in options['files']:
+                for line, row in self.read(path, options['format']):
+                    try:
+                        self.add_task(row)
+                    except (KeyError, ValueError) as e:
+                        raise CommandError("{}:{}: {}".format(path, line, e))
+
+            self.insert_batch()
+
+            if self.pending:
+                raise CommandError("parent tasks not found: {}".format(", ".join(sorted(self.pending)[:10])))
+            self.check_cycles()
+
+            total = self.next_id - self.first_id
+            widened = widen_ancestor_spans("{} >= %s".format(connection.ops.quote_name('id')), [self.first_id])
+
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Task]):
+                    cursor.execute(sql)
+
+            Task.objects.refresh_expired_statuses()
+
+        invalidate_index_summary()
+        reset_timeline()
+
+        self.stdout.write("imported {} tasks, widened {} parent tasks in {:.1f}s".format(
+            total, widened, time.monotonic() - started))
+
+    def read(self, path, file_format):
+        """
+        yield the (line number, row dict) of a file, a row at a time.
+        """
+
+        if file_format is None:
+            extension = os.path.splitext(path)[1].lower()
+            file_format = 'csv' if extension == '.csv' else 'jsonl'
+
+        with open(path, newline='', encoding='utf-8') as f:
+            if file_format == 'csv':
+                reader = csv.DictReader(f)
+                for row in reader:
+                    yield reader.line_num, row
+            else:
+                for line, text in enumerate(f, 1):
+                    if text.strip():
+                        try:
+                            yield line, json.loads(text)
+                        except ValueError as e:
+                            raise CommandError("{}:{}: {}".format(path, line, e))
+
+    def task_id(self, reference):
+        """
+        returns the id of the task with the given reference, a new id
+        the first time the reference is seen.
+        """
+
+        if reference not in self.references:
+            self.references[reference] = self.next_id
+            self.next_id += 1
+            self.parents.append(0)
+
+        return self.references[reference]
+
+    def add_task(self, row):
+        """
+        add the task of a row to the batch, insert the batch when full.
+        """
+
+        reference = str(row.get('id') or '').strip()
+        if reference:
+            if reference in self.references and reference not in self.pending:
+                raise ValueError("duplicated id {}".format(reference))
+            task_id = self.task_id(reference)
+            self.pending.discard(reference)
+        else:
+            task_id = self.next_id
+            self.next_id += 1
+            self.parents.append(0)
+
+        name = str(row.get('name') or '').strip()
+        if not name or len(name) > self.name_length:
+            raise ValueError("the name should have 1 to {} characters".format(self.name_length))
+
+        owner = str(row.get('owner') or '').strip()
+        if owner not in self.owners:
+            raise ValueError("unknown owner {}".format(owner))
+
+        priority = str(row.get('priority') or 'L').strip()
+        if priority not in self.priorities:
+            raise ValueError("unknown priority {}".format(priority))
+
+        parent = str(row.get('parent') or '').strip()
+        parent_id = None
+        if parent:
+            if parent not in self.references:
+                self.pending.add(parent)
+            parent_id = self.task_id(parent)
+            self.parents[task_id - self.first_id] = parent_id
+
+        self.batch.append(Task(
+            id=task_id,
+            name=name,
+            owner_id=self.owners[owner],
+            priority=priority,
+            start=parse_as_of(row.get('start'), name='start'),
+            end=parse_as_of(row.get('end'), name='end'),
+            parent_task_id=parent_id,
+        ))
+
+        if len(self.batch) >= self.batch_size:
+            self.insert_batch()
+
+    def insert_batch(self):
+        """
+        insert the tasks of the batch. the number of rows per insert is
+        left to the database backend, it's limited on sqlite.
+        """
+
+        if self.batch:
+            Task.objects.bulk_create(self.batch)
+            self.batch = []
+
+    def check_cycles(self):
+        """
+        raise a CommandError if a task is its own ancestor. every task is
+        walked up once, the tasks known to reach a root are not walked
+        again.
+        """
+
+        # 0 not walked yet, 1 on the current walk, 2 reaches a root.
+        state = array('b', bytes(len(self.parents)))
+        for i in range(len(self.parents)):
+            walk = []
+            while i >= 0 and state[i] == 0:
+                state[i] = 1
+                walk.append(i)
+                i = self.parents[i] - self.first_id
+            if i >= 0 and state[i] == 1:
+                raise CommandError("the parent tasks of task {} form a cycle".format(i + self.first_id))
+            for j in walk:
+                state[j] = 2
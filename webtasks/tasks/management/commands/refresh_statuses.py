@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from tasks.models import Task
+
+
+class Command(BaseCommand):
+    """
+    compute and store the status of the tasks which stored status has
+    expired. meant to run periodically, like from cron.
+    """
+
+    help = "refresh the stored status of the tasks which status has expired"
+
+    def handle(self, *args, **options):
+        total = Task.objects.refresh_expired_statuses()
+        self.stdout.write("refreshed the status of {} tasks".format(total))
@@ -0,0 +1,124 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from itertools import islice
+from tasks.cache import invalidate_index_summary
+from tasks.models import Task
+from tasks.synthetic import (
+    SHAPES, USERNAME, USERNAME_PATTERN, USERNAME_PREFIX, default_origin, generate_tasks, generate_users, indexes_dropped,
+    insert_tasks, insert_users,
+)
+from tasks.timeline import parse_as_of, reset_timeline
+import time
+
+
+class Command(BaseCommand):
+    """
+    create users and task trees for load tests and staging, without
+    save. the same arguments always create the same rows: the users
+    seed0000000, seed0000001... own the tasks with the ids from
+    --first-id. the subtasks are generated inside their parent tasks,
+    so no span is widened. the rows are committed every --commit-every
+    tasks, on sqlite the indexes of the tasks are dropped and created
+    again in each transaction. running the command again resumes an
+    interrupted run from its last committed tree. the status of the
+    tasks is computed and stored at the end, so the summary counts 
+    them right away.
+    """
+
+    help = "create users and task trees generated from a seed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=100000, help="the number of tasks")
+        parser.add_argument('--users', type=int, default=1000, help="the number of users owning the tasks")
+        parser.add_argument('--shape', choices=sorted(SHAPES), default='mixed', help="the shape of the task trees")
+        parser.add_argument('--seed', type=int, default=0, help="the seed of the generated tasks")
+        parser.add_argument('--origin', help="the ISO 8601 datetime the tasks are spread around, by default the start of today")
+        parser.add_argument('--first-id', type=int, default=1, help="the id of the first task")
+        parser.add_argument('--commit-every', type=int, default=1000000, help="the number of tasks inserted per transaction")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        try:
+            origin = parse_as_of(options['origin'], name='origin') if options['origin'] else default_origin()
+        except ValueError as e:
+            raise CommandError(e)
+
+        users = self.seed_users(options['users'])
+        owner_ids = list(
+            User.objects.filter(username__in=[USERNAME.format(i) for i in range(options['users'])])
+            .order_by('username').values_list('id', flat=True)
+        )
+
+        first_id = options['first_id']
+        end_id = first_id + options['tasks']
+        resume_id = self.resume_id(first_id, end_id)
+
+        rows = generate_tasks(
+            end_id - resume_id, owner_ids, shape=options['shape'], seed=options['seed'],
+            origin=origin, first_id=resume_id,
+        )
+        tasks = 0
+        for _ in range(resume_id, end_id, options['commit_every']):
+            with transaction.atomic(), indexes_dropped(Task):
+                tasks += insert_tasks(islice(rows, options['commit_every']))
+            self.stderr.write("{} tasks inserted".format(resume_id - first_id + tasks))
+
+        refreshed = Task.objects.refresh_expired_statuses()
+        self.stderr.write("{} statuses stored".format(refreshed))
+
+        invalidate_index_summary()
+        reset_timeline()
+
+        seconds = time.monotonic() - started
+        self.stdout.write("created {} users and {} tasks in {:.1f}s, {:.0f} rows per second".format(
+            users, tasks, seconds, (users + tasks) / seconds if seconds else 0))
+
+    def seed_users(self, total):
+        """
+        create the users not created yet. returns the number of created
+        users.
+        """
+
+        last = User.objects.filter(username__regex=USERNAME_PATTERN).aggregate(last=Max('username'))['last']
+        first = int(last[len(USERNAME_PREFIX):]) + 1 if last else 0
+        if first >= total:
+            return 0
+
+        with transaction.atomic():
+            return insert_users(generate_users(total - first, first=first))
+
+    def resume_id(self, first_id, end_id):
+        """
+        returns the id of the first task to create. the tasks of the
+        last tree of an interrupted run are deleted, the tree is created
+        again from its root task. raises a CommandError if tasks not
+        created by the command have ids in the range.
+        """
+
+        seeded = Task.objects.filter(id__gte=first_id, id__lt=end_id)
+        last_id = seeded.aggregate(last_id=Max('id'))['last_id']
+        if last_id is None:
+            return first_id
+
+        first = seeded.filter(id=first_id).values_list('name', 'parent_task_id').first()
+        if first != ('task {}'.format(first_id), None):
+            raise CommandError("tasks {} to {} already exist, use another --first-id".format(first_id, end_id - 1))
+
+        if last_id == end_id - 1:
+            return end_id
+
+        root_id = seeded.filter(parent_task__isnull=True).aggregate(root_id=Max('id'))['root_id']
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM {} WHERE {} >= %s AND {} < %s".format(
+                    connection.ops.quote_name(Task._meta.db_table),
+                    connection.ops.quote_name('id'), connection.ops.quote_name('id'),
+                ),
+                [root_id, end_id],
+            )
+        self.stderr.write("resuming from task {}".format(root_id))
+
+        return root_id
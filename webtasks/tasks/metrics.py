@@ -0,0 +1,216 @@
+from bisect import bisect_left
+from collections import Counter
+from django.conf import settings
+import json
+import os
+import threading
+import time
+import weakref
+
+# the upper bounds of the buckets of the latency histogram, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# the metrics are counted per thread without lock, in a counter of
+# (metric, label values...) keys registered once per thread. they're
+# added up when scraped. the counters of the ended threads are queued
+# in _ended_threads, then added to _finished_counters and dropped.
+_local = threading.local()
+_thread_counters = []
+_ended_threads = []
+_finished_counters = Counter()
+_register_lock = threading.Lock()
+_flushed_at = 0.0
+
+METRICS = (
+    ('tasks_http_request_duration_seconds', 'histogram', ('view',), "the latency of the requests by url name"),
+    ('tasks_db_queries_total', 'counter', ('view',), "the queries run by the requests by url name"),
+    ('tasks_cache_requests_total', 'counter', ('cache', 'result'), "the cache lookups by cache and result"),
+)
+
+
+def thread_counters():
+    """
+    returns the counter of the metrics of the current thread.
+    """
+
+    counters = getattr(_local, 'counters', None)
+    if counters is None:
+        counters = _local.counters = Counter()
+        # the token lives as long as the thread. it's finalized by the
+        # garbage collector, maybe with the lock held, only append.
+        _local.token = ThreadToken()
+        weakref.finalize(_local.token, _ended_threads.append, counters)
+        with _register_lock:
+            fold_ended_threads()
+            _thread_counters.append(counters)
+
+    return counters
+
+
+class ThreadToken:
+    """ kept in the thread local data, removed when the thread ends. """
+
+
+def fold_ended_threads():
+    """
+    add the counters of the ended threads to the finished ones and drop
+    them, so the threads of a server starting one per request don't
+    pile up. called with the lock held.
+    """
+
+    while _ended_threads:
+        counters = _ended_threads.pop()
+        _finished_counters.update(counters)
+        _thread_counters.remove(counters)
+
+
+def record_request(view, seconds, queries):
+    """
+    count a request of the view, its latency and its queries.
+    """
+
+    counters = thread_counters()
+    counters[('tasks_http_request_duration_seconds_bucket', view, bisect_left(LATENCY_BUCKETS, seconds))] += 1
+    counters[('tasks_http_request_duration_seconds_sum', view)] += seconds
+    counters[('tasks_http_request_duration_seconds_count', view)] += 1
+    counters[('tasks_db_queries_total', view)] += queries
+    flush_if_due()
+
+
+def record_cache(cache_name, hit):
+    """
+    count a lookup of the cache, hit or miss.
+    """
+
+    thread_counters()[('tasks_cache_requests_total', cache_name, 'hit' if hit else 'miss')] += 1
+
+
+def process_totals():
+    """
+    returns the metrics of all the threads of the process. the counters
+    are copied, a copy of a dict is atomic.
+    """
+
+    with _register_lock:
+        fold_ended_threads()
+        totals = _finished_counters.copy()
+        for counters in _thread_counters:
+            totals.update(counters.copy())
+
+    return totals
+
+
+def metrics_path(pid):
+    return os.path.join(settings.TASKS_METRICS_DIR, 'metrics-{}.json'.format(pid))
+
+
+def flush():
+    """
+    write the metrics of the process to its file in the directory of
+    the TASKS_METRICS_DIR setting, read by the other processes when
+    they're scraped. the file is replaced at once, never read half
+    written.
+    """
+
+    global _flushed_at
+    _flushed_at = time.monotonic()
+
+    if not getattr(settings, 'TASKS_METRICS_DIR', None):
+        return
+
+    os.makedirs(settings.TASKS_METRICS_DIR, exist_ok=True)
+    path = metrics_path(os.getpid())
+    with open(path + '.tmp', 'w') as f:
+        json.dump([[list(key), value] for key, value in process_totals().items()], f)
+    os.replace(path + '.tmp', path)
+
+
+def flush_if_due():
+    """
+    flush the metrics of the process every TASKS_METRICS_FLUSH_INTERVAL
+    seconds, checked after every request.
+    """
+
+    if time.monotonic() - _flushed_at >= getattr(settings, 'TASKS_METRICS_FLUSH_INTERVAL', 5):
+        flush()
+
+
+def collect():
+    """
+    returns the metrics of the process added to the last flushed ones
+    of the other processes. the files of the stopped processes are
+    kept, so the counters don't go back.
+    """
+
+    totals = process_totals()
+    directory = getattr(settings, 'TASKS_METRICS_DIR', None)
+    if not directory or not os.path.isdir(directory):
+        return totals
+
+    own = os.path.basename(metrics_path(os.getpid()))
+    for name in os.listdir(directory):
+        if name == own or not name.startswith('metrics-') or not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                rows = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for key, value in rows:
+            totals[tuple(key)] += value
+
+    return totals
+
+
+def label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(names, values):
+    return '{' + ','.join('{}="{}"'.format(name, label_value(value)) for name, value in zip(names, values)) + '}'
+
+
+def render_metrics():
+    """
+    returns the metrics of all the processes and the number of tasks
+    per status in the prometheus text format.
+    """
+
+    from .cache import get_index_summary
+
+    totals = collect()
+    lines = []
+
+    for metric, kind, label_names, description in METRICS:
+        lines.append('# HELP {} {}'.format(metric, description))
+        lines.append('# TYPE {} {}'.format(metric, kind))
+
+        if kind != 'histogram':
+            for key in sorted(key for key in totals if key[0] == metric):
+                lines.append('{}{} {}'.format(metric, labels(label_names, key[1:]), totals[key]))
+            continue
+
+        views = sorted({key[1] for key in totals if key[0] == metric + '_count'})
+        for view in views:
+            cumulative = 0
+            for i, bound in enumerate(LATENCY_BUCKETS + ('+Inf',)):
+                cumulative += totals[(metric + '_bucket', view, i)]
+                lines.append('{}_bucket{} {}'.format(metric, labels(('view', 'le'), (view, bound)), cumulative))
+            lines.append('{}_sum{} {}'.format(metric, labels(label_names, (view,)), totals[(metric + '_sum', view)]))
+            lines.append('{}_count{} {}'.format(metric, labels(label_names, (view,)), totals[(metric + '_count', view)]))
+
+    lines.append('# HELP tasks_cache_hit_ratio the share of the cache lookups found in the cache')
+    lines.append('# TYPE tasks_cache_hit_ratio gauge')
+    for cache_name in sorted({key[1] for key in totals if key[0] == 'tasks_cache_requests_total'}):
+        hits = totals[('tasks_cache_requests_total', cache_name, 'hit')]
+        lookups = hits + totals[('tasks_cache_requests_total', cache_name, 'miss')]
+        lines.append('tasks_cache_hit_ratio{} {}'.format(labels(('cache',), (cache_name,)), hits / lookups))
+
+    lines.append('# HELP tasks_tasks the number of tasks by status')
+    lines.append('# TYPE tasks_tasks gauge')
+    # a task exactly on its start or end has no status, None.
+    total_status = get_index_summary()['total_status']
+    for status in sorted(total_status, key=lambda status: (status is None, status or '')):
+        lines.append('tasks_tasks{} {}'.format(labels(('status',), (status or 'None',)), total_status[status]))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,146 @@
+from django.conf import settings
+from .metrics import record_request
+from .routers import read_from_primary, read_from_replica, sticky_seconds, written
+from .timing import current_timings, record_timings
+import logging
+import time
+
+logger = logging.getLogger('task.timing')
+
+
+def query_budget(view_name):
+    """
+    returns the most queries a request of the view should run, from the
+    TASKS_QUERY_BUDGETS setting by view name, or TASKS_QUERY_BUDGET for
+    all the views. None if the view has no budget.
+    """
+
+    budgets = getattr(settings, 'TASKS_QUERY_BUDGETS', {})
+    return budgets.get(view_name, getattr(settings, 'TASKS_QUERY_BUDGET', None))
+
+
+class ServerTimingMiddleware:
+    """
+    record the number of queries, the time spent in the database, in
+    rendering templates and in the python code of every request. they're
+    sent in the Server-Timing header, shown by the network panel of the
+    browsers, and logged on one line of key=value pairs. a request
+    running more queries than the budget of its view is logged as a
+    warning. the work done while streaming a response, after its headers
+    are sent, isn't recorded. meant to be the first middleware, to time
+    the other ones too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_timings() as timings:
+            response = self.get_response(request)
+
+        total = timings.total
+        response['Server-Timing'] = ', '.join([
+            'db;dur={:.2f};desc="{} queries"'.format(timings.db * 1000, timings.queries),
+            'tpl;dur={:.2f}'.format(timings.template * 1000),
+            'view;dur={:.2f}'.format(timings.view * 1000),
+            'total;dur={:.2f}'.format(total * 1000),
+        ])
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match is not None else None
+        logger.info(
+            "request method=%s path=%s view=%s status=%s queries=%s db_ms=%.2f template_ms=%.2f view_ms=%.2f total_ms=%.2f",
+            request.method, request.path, view_name, response.status_code, timings.queries,
+            timings.db * 1000, timings.template * 1000, timings.view * 1000, total * 1000,
+        )
+
+        budget = query_budget(view_name)
+        if budget is not None and timings.queries > budget:
+            logger.warning("request path=%s view=%s ran %s queries, over its budget of %s",
+                request.path, view_name, timings.queries, budget)
+
+        return response
+
+
+def view_label(request):
+    """
+    returns the url name of the view of a request for the metrics, all
+    the admin views are 'admin'.
+    """
+
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    if 'admin' in match.namespaces:
+        return 'admin'
+
+    return match.url_name or match.view_name
+
+
+class MetricsMiddleware:
+    """
+    count every request by the url name of its view, with its latency
+    and queries, for the metrics endpoint. the queries are the ones
+    recorded by the ServerTimingMiddleware when it's used, otherwise
+    they're recorded here.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        timings = current_timings()
+
+        if timings is None:
+            with record_timings() as timings:
+                response = self.get_response(request)
+            queries = timings.queries
+        else:
+            queries = timings.queries
+            response = self.get_response(request)
+            queries = timings.queries - queries
+
+        record_request(view_label(request), time.perf_counter() - started, queries)
+        return response
+
+
+# the cookie of the users who wrote lately, they read from the primary.
+PRIMARY_COOKIE = 'tasks_primary'
+
+
+def reads_from_replica(view_func):
+    """
+    returns True if the view is marked as reading only, the function or
+    the class of a class based view.
+    """
+
+    view_class = getattr(view_func, 'view_class', None)
+    return getattr(view_func, 'reads_from_replica', False) or getattr(view_class, 'reads_from_replica', False)
+
+
+class ReadReplicaMiddleware:
+    """
+    send the reads of the GET requests of the views reading only to a
+    replica, see tasks.routers. after a request writing, like a change
+    in the admin, a cookie sends the reads of the user to the primary for
+    TASKS_REPLICA_STICKY_SECONDS, so they see their changes before the
+    replicas get them. the replica is kept until the response is sent,
+    the streamed ones too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        read_from_primary()
+        response = self.get_response(request)
+
+        if written() and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(PRIMARY_COOKIE, '1', max_age=sticky_seconds(), httponly=True, samesite='Lax')
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method in ('GET', 'HEAD') and PRIMARY_COOKIE not in request.COOKIES and reads_from_replica(view_func):
+            read_from_replica()
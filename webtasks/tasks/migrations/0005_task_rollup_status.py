@@ -0,0 +1,23 @@
+# Generated by Django 2.2.3 on 2026-10-18 19:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0004_auto_20190724_0910'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='rollup_status',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='the stored status of the task and its subtasks', max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='status_valid_until',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, help_text='the time the stored status changes, empty if it never changes', null=True),
+        ),
+    ]
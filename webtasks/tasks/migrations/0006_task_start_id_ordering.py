@@ -0,0 +1,21 @@
+# Generated by Django 2.2.3 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0005_task_rollup_status'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='task',
+            options={'ordering': ('start', 'id'), 'verbose_name_plural': 'Task'},
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['start', 'id'], name='task_start_id_idx'),
+        ),
+    ]
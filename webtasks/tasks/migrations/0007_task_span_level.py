@@ -0,0 +1,41 @@
+# Generated by Django 2.2.3 on 2026-10-18 19:36
+
+from datetime import timedelta
+from django.db import migrations, models
+
+
+def set_span_levels(apps, schema_editor):
+    """
+    set the span level of the existing tasks, a chunk at a time.
+    """
+
+    Task = apps.get_model('tasks', 'Task')
+    chunk = []
+    for task in Task.objects.only('id', 'start', 'end').iterator(chunk_size=2000):
+        task.span_level = (abs(task.end - task.start) // timedelta(seconds=1)).bit_length()
+        chunk.append(task)
+        if len(chunk) == 2000:
+            Task.objects.bulk_update(chunk, ['span_level'])
+            chunk = []
+
+    Task.objects.bulk_update(chunk, ['span_level'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0006_task_start_id_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='span_level',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, help_text='the number of bits of the duration in seconds, to find the tasks active in a window', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['span_level', 'start'], name='task_span_level_start_idx'),
+        ),
+        migrations.RunPython(set_span_levels, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 2.2.3 on 2026-10-18 19:50
+
+from collections import defaultdict
+from django.db import migrations, models
+
+
+def set_paths(apps, schema_editor):
+    """
+    set the path of the existing tasks from the root tasks down, a
+    chunk at a time.
+    """
+
+    Task = apps.get_model('tasks', 'Task')
+    children = defaultdict(list)
+    for task_id, parent_task_id in Task.objects.values_list('id', 'parent_task_id').iterator(chunk_size=2000):
+        children[parent_task_id].append(task_id)
+
+    chunk = []
+    pending = [(task_id, '/') for task_id in children[None]]
+    while pending:
+        task_id, parent_path = pending.pop()
+        path = '{}{}/'.format(parent_path, task_id)
+        pending.extend((sub_id, path) for sub_id in children[task_id])
+        chunk.append(Task(id=task_id, path=path))
+        if len(chunk) == 2000:
+            Task.objects.bulk_update(chunk, ['path'])
+            chunk = []
+
+    Task.objects.bulk_update(chunk, ['path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0007_task_span_level'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='the ids of the root task down to this task, to find the subtasks on any depth', max_length=1000, null=True),
+        ),
+        migrations.RunPython(set_paths, migrations.RunPython.noop),
+    ]
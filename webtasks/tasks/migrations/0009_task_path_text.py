@@ -0,0 +1,18 @@
+# Generated by Django 2.2.3 on 2026-10-18 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0008_task_path'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='task',
+            name='path',
+            field=models.TextField(blank=True, db_index=True, editable=False, help_text='the ids of the root task down to this task, to find the subtasks on any depth', null=True),
+        ),
+    ]
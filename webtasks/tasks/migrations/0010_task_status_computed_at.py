@@ -0,0 +1,18 @@
+# Generated by Django 2.2.3 on 2026-10-18 20:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0009_task_path_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='status_computed_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text="the time the stored status was computed at, it's valid from then on", null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from datetime import datetime, timezone
+from django.db import migrations
+from tasks.status import compute_status_windows
+
+
+def fill_statuses(apps, schema_editor):
+    """
+    compute the status of the existing tasks from all the tasks at once
+    and store it, a chunk at a time, so the summary counts the stored
+    statuses from the start.
+    """
+
+    Task = apps.get_model('tasks', 'Task')
+    now = datetime.now(timezone.utc)
+    rows = Task.objects.values_list('id', 'parent_task_id', 'start', 'end').iterator(chunk_size=2000)
+    windows = compute_status_windows(rows, now=now)
+
+    chunk = []
+    for task_id, (status, valid_until) in windows.items():
+        chunk.append(Task(id=task_id, rollup_status=status, status_valid_until=valid_until, status_computed_at=now))
+        if len(chunk) == 2000:
+            Task.objects.bulk_update(chunk, ['rollup_status', 'status_valid_until', 'status_computed_at'])
+            chunk = []
+
+    Task.objects.bulk_update(chunk, ['rollup_status', 'status_valid_until', 'status_computed_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0010_task_status_computed_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_statuses, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,256 @@
-from django.db import models
-from django.db.models import Max, Min
+from django.db import models, transaction
+from django.db.models import (
+    Avg, Case, Count, DurationField, ExpressionWrapper, F, IntegerField, Max,
+    Min, Q, Value, When,
+)
 from datetime import datetime, timedelta, timezone
 from django.contrib.auth.models import User
+from .status import (
+    MAX_IDS_PER_QUERY, STATUS_TYPE, compute_status_windows, fetch_subtrees,
+    leaf_status, refresh_ancestor_statuses, refresh_statuses,
+    status_expression, store_status_windows, subtree_statuses,
+)
+from .paths import (
+    fill_paths, move_path, path_depth, path_root_id, subtree_ids, subtree_q,
+)
+from .spans import defer_span_update, widen_parent_spans
+from .timeline import status_at as timeline_status_at
 import logging
 
 logger = logging.getLogger("task")
+# the logger of the code run for every task on every request, sampled
+# by the LOGGING setting.
+hot_logger = logging.getLogger("task.hot")
+
+# the upper limits of the duration buckets of the tasks summary. the
+# last bucket holds the tasks longer than the last limit.
+DURATION_BUCKETS = [
+    (timedelta(hours=1), '1 hour'),
+    (timedelta(days=1), '1 day'),
+    (timedelta(weeks=1), '1 week'),
+    (timedelta(days=30), '30 days'),
+]
+
+
+# the span level of a task is the number of bits of its duration in
+# seconds, a task of level L lasts less than 2 ** L seconds. the longest
+# possible duration, from year 1 to 9999, has 39 bits.
+MAX_SPAN_LEVEL = 39
+
+
+def span_level(start, end):
+    """
+    returns the span level of a task with the given start and end.
+    """
+
+    return (abs(end - start) // timedelta(seconds=1)).bit_length()
+
+
+class TaskQuerySet(models.QuerySet):
+    """
+    queryset of the Task model with the status computed in the database.
+    """
+
+    def with_status(self, now=None):
+        """
+        annotate every task with its status, so the tasks can be 
+        filtered or grouped by status without loading them, example:
+        Task.objects.with_status().filter(status='Running')
+        Task.objects.with_status().values('status').annotate(Count('id')).order_by('status')
+        the order_by is needed when grouping, otherwise the start of the
+        default ordering is grouped on too. the status is the stored one
+        while it's valid at now, rolled up from all the subtasks on any
+        depth, otherwise it's rolled up in the query, see 
+        status_expression. no query is run until the queryset is read.
+        """
+
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        return self.annotate(status=status_expression(now))
+
+    def summary(self, now=None):
+        """
+        returns a summary of the tasks computed only with aggregates in
+        the database, so no task is loaded whatever the number of tasks:
+        total_tasks, total_subtasks, total_status a dict with the number
+        of tasks per status, durations a dict with the shortest, average
+        and longest duration in minutes and duration_buckets a list of
+        (label, number of tasks) tuples. the statuses are counted from
+        the stored ones valid at now, see with_status, no status is 
+        computed in python. the migrations, the import_tasks and
+        seed_tasks commands store them up front and refresh_statuses
+        keeps them fresh. valid_until is the next start or end of a task
+        after now, the first time the statuses counted can change, None
+        if no task starts or ends after now.
+        """
+
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        tasks = self.order_by().annotate(
+            span=ExpressionWrapper(F('end') - F('start'), output_field=DurationField()),
+        )
+
+        totals = tasks.aggregate(
+            total_tasks=Count('id'),
+            total_subtasks=Count('parent_task'),
+            shortest=Min('span'),
+            average=Avg('span'),
+            longest=Max('span'),
+            next_start=Min('start', filter=Q(start__gte=now)),
+            next_end=Min('end', filter=Q(end__gte=now)),
+        )
+        boundaries = [totals[key] for key in ('next_start', 'next_end') if totals[key] is not None]
+
+        total_status = {
+            row['status']: row['total']
+            for row in self.with_status(now=now).values('status').annotate(total=Count('id')).order_by('status')
+        }
+
+        buckets = tasks.annotate(
+            bucket=Case(
+                *[When(span__lt=limit, then=Value(i)) for i, (limit, _) in enumerate(DURATION_BUCKETS)],
+                default=Value(len(DURATION_BUCKETS)),
+                output_field=IntegerField(),
+            ),
+        ).values('bucket').annotate(total=Count('id')).order_by('bucket')
+        bucket_totals = {row['bucket']: row['total'] for row in buckets}
+
+        labels = ['< {}'.format(label) for _, label in DURATION_BUCKETS]
+        labels.append('>= {}'.format(DURATION_BUCKETS[-1][1]))
+
+        return {
+            'total_tasks': totals['total_tasks'],
+            'total_subtasks': totals['total_subtasks'],
+            'total_status': total_status,
+            'durations': {
+                key: int(totals[key].total_seconds() / 60) if totals[key] is not None else None
+                for key in ('shortest', 'average', 'longest')
+            },
+            'duration_buckets': [(label, bucket_totals.get(i, 0)) for i, label in enumerate(labels)],
+            'valid_until': min(boundaries) if boundaries else None,
+        }
+
+    def active_between(self, start, end):
+        """
+        filter the tasks active at any time between start and end, the
+        tasks starting before end and ending after start. the tasks of
+        one span level start less than 2 ** level seconds before they 
+        end, so each level is a range of the (span_level, start) index
+        and the tasks started long before the window are never read.
+        """
+
+        window = Q(span_level__isnull=True, start__lte=end)
+        for level in range(MAX_SPAN_LEVEL + 1):
+            try:
+                started = Q(start__gt=start - timedelta(seconds=2 ** level))
+            except OverflowError:
+                # the level reaches before the first possible date.
+                started = Q()
+            window |= Q(started, span_level=level, start__lte=end)
+
+        return self.filter(window, end__gte=start)
+
+    def update_span_levels(self):
+        """
+        compute the span level of the tasks in the database, for the
+        tasks which start or end was changed by an update. the level is
+        found by a binary search over the powers of two, nested CASEs,
+        so the duration is compared a few times only. returns the number
+        of updated tasks.
+        """
+
+        def levels(low, high):
+            # the level is between low included and high excluded.
+            if high - low == 1:
+                return Value(low)
+
+            # the level is below middle if the duration is shorter than
+            # 2 ** (middle - 1) seconds.
+            middle = (low + high) // 2
+            return Case(
+                When(
+                    span__lt=timedelta(seconds=2 ** (middle - 1)),
+                    span__gt=-timedelta(seconds=2 ** (middle - 1)),
+                    then=levels(low, middle),
+                ),
+                default=levels(middle, high),
+                output_field=IntegerField(),
+            )
+
+        return self.annotate(
+            span=ExpressionWrapper(F('end') - F('start'), output_field=DurationField()),
+        ).update(span_level=levels(0, MAX_SPAN_LEVEL + 1))
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        set the span level and the path of the tasks created without
+        save. the ids of the tasks aren't known before the insert, the
+        paths are set after it with one update. no signal is sent, the
+        cached summary of the tasks is removed here once committed.
+        """
+
+        from .cache import invalidate_index_summary
+
+        objs = list(objs)
+        for task in objs:
+            task.span_level = span_level(task.start, task.end)
+            task.path = None
+
+        created = super().bulk_create(objs, *args, **kwargs)
+        fill_paths()
+        transaction.on_commit(invalidate_index_summary)
+
+        return created
+
+    def update(self, **kwargs):
+        """
+        update the tasks without save. the cached summary of the tasks is
+        removed once committed if their start, end or parent task change,
+        the columns it's computed from.
+        """
+
+        from .cache import invalidate_index_summary
+
+        updated = super().update(**kwargs)
+        if {'start', 'end', 'parent_task', 'parent_task_id'} & set(kwargs):
+            transaction.on_commit(invalidate_index_summary)
+
+        return updated
+
+    def refresh_expired_statuses(self, now=None):
+        """
+        compute and store the status of the tasks which stored status
+        has expired or was never computed. both columns are indexed, so
+        only the tasks that are due are read. the subtrees of the top 
+        most expired tasks are fetched once, a chunk at a time, and the
+        statuses of all the expired tasks in them stored, so a whole 
+        imported tree is read once. the tasks left are on a cycle of 
+        parent tasks. returns the number of refreshed tasks.
+        """
+
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        tasks = self.order_by()
+        expired = dict(tasks.filter(status_valid_until__lte=now).values_list('id', 'parent_task_id'))
+        expired.update(tasks.filter(rollup_status__isnull=True).values_list('id', 'parent_task_id'))
+        tops = sorted(task_id for task_id, parent_id in expired.items() if parent_id not in expired)
+
+        refreshed = set()
+        for i in range(0, len(tops), MAX_IDS_PER_QUERY):
+            windows = compute_status_windows(fetch_subtrees(tops[i:i + MAX_IDS_PER_QUERY]), now=now)
+            windows = {task_id: window for task_id, window in windows.items() if task_id in expired}
+            store_status_windows(windows, now)
+            refreshed.update(windows)
+
+        left = sorted(set(expired) - refreshed)
+        for i in range(0, len(left), MAX_IDS_PER_QUERY):
+            refresh_statuses(left[i:i + MAX_IDS_PER_QUERY], now=now)
+
+        logger.debug("refreshed the status of %s tasks, %s on cycles", len(expired), len(left))
+        return len(expired)
 
 
 class Task(models.Model):
@@ -39,13 +285,7 @@ class Task(models.Model):
         ('H', 'High'),
     )
 
-    STATUS_TYPE = [
-            'Scheduled',
-            'Running',
-            'Complete',
-            'Multi-Runs',
-            'Idle',
-        ]
+    STATUS_TYPE = STATUS_TYPE
 
 
     priority = models.CharField(
@@ -73,6 +313,8 @@ class Task(models.Model):
     )
 
 
+    objects = TaskQuerySet.as_manager()
+
     parent_task = models.ForeignKey(
         'Task',
         on_delete=models.CASCADE,
@@ -82,6 +324,45 @@ class Task(models.Model):
         related_name='sub_task',
         help_text="the parent task of this sub task",
     )
+
+    span_level = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="the number of bits of the duration in seconds, to find the tasks active in a window",
+    )
+
+    path = models.TextField(
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text="the ids of the root task down to this task, to find the subtasks on any depth",
+    )
+
+    rollup_status = models.CharField(
+        max_length=10,
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text="the stored status of the task and its subtasks",
+    )
+
+    status_valid_until = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text="the time the stored status changes, empty if it never changes",
+    )
+
+    status_computed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="the time the stored status was computed at, it's valid from then on",
+    )
    
     
     # the task status property
@@ -99,74 +380,89 @@ class Task(models.Model):
         d- Multi-Runs if more than one child is running.
         e- Idle if one or more tasks are complete and one or more 
            tasks are scheduled but nothing is running at the moment.
+        the status is stored in rollup_status together with the time
+        it changes, status_valid_until. until that time the stored 
+        status is returned without any query, after that it's computed
+        again and stored. if the status was already set on the object,
+        like by with_status, it's returned as is.
+        """
+
+        if hasattr(self, '_computed_status'):
+            return self._computed_status
+
+        current_date = datetime.now(timezone.utc)
+
+        if self.pk is None:
+            return leaf_status(self.start, self.end, current_date)
+
+        if not self.status_is_valid(current_date):
+            self.refresh_status(now=current_date)
 
+        return self.rollup_status
+
+
+    def _set_status(self, value):
+        """
+        set an already computed status on the object. used by the 
+        status engine to compute the status of many tasks at once.
         """
 
-        total_subtasks = Task.objects.filter(parent_task__id=self.id).count()
-        logger.debug("total_subtasks: {} for parent_id {}".format(total_subtasks, self.id))
-        #return total_subtasks
+        self._computed_status = value
+
+
+    def status_is_valid(self, now):
+        """
+        returns True if the stored status is computed, not after the
+        given time, and not expired at the given time.
+        """
+
+        return self.rollup_status is not None and (
+            self.status_computed_at is not None and self.status_computed_at <= now) and (
+            self.status_valid_until is None or self.status_valid_until > now)
+
 
-        # logger.debug("task id: {} has {} sub tasks".format(self.id, total_subtasks))
-        # logger.debug("taskid: {} - start: {} - end: {}".format(self.id, self.start, self.end))
+    def refresh_status(self, now=None):
+        """
+        compute the status of the task from its subtasks and store it,
+        unless it's read from a replica.
+        """
 
-        #if the task has subtasks, call get_task_with_subtask_status.
-        # otherwise, call get_status
-        if total_subtasks > 0:
-            return self.get_task_with_subtask_status()
+        if now is None:
+            now = datetime.now(timezone.utc)
 
-        else:
-            return self.get_status(start_date=self.start, end_date=self.end)
+        self.rollup_status, self.status_valid_until = refresh_statuses([self.id], now=now)[self.id]
+        self.status_computed_at = now
+        hot_logger.debug("taskid: %s - status: %s - valid until: %s", self.id, self.rollup_status, self.status_valid_until)
             
 
     def get_task_with_subtask_status(self):
         """ 
-        reads the status of each subtask. add them in a dict with the 
-        name of the status as key and total occurance as value. 
-        example: {'Complete': 2, 'Running': 5, 'Scheduled': 3}
+        fetch the task with all its subtasks in one query and compute
+        their statuses bottom-up. the status of a task without 
+        subtasks is based on its start and end date. the status of a
+        task with subtasks is based on the statuses of its subtasks:
         if Running > 1 then the status will be Multi-Runs.
         if Completed >= 1 and Scheduled >= 1 and Running == 0 then the
         status will be Idle
-        if the dict contains one key, the status will be that key.  
+        if all the subtasks have the same status, it will be that 
+        status. otherwise it will be Scheduled.
         """
 
-        
-        logger.debug("has more than one subtask")
-        subtasks = Task.objects.filter(parent_task__id=self.id)
+        statuses = subtree_statuses([self.id])
+        hot_logger.debug("taskid: %s - subtree statuses: %s", self.id, len(statuses))
 
-        logger.debug("substasks: {}".format(subtasks))
+        return statuses.get(self.id)
 
-        # create a tmp list to store the status of the subtasks.
-        status_tmp = []
-        for sub in subtasks:
-            # loop through the subtasks and append their status to the
-            # status_tmp list.
-            status_tmp.append(sub.status)
-            logger.debug("subtaskid: {} - status: {}".format(sub.id, sub.status))
 
-        # create a dict of the statuses in the status_tmp list
-        subtasks_status = {k:status_tmp.count(k) for k in status_tmp}
-        logger.debug("subtasks statuses: {}".format(subtasks_status))
-
-        
-        if subtasks_status.get('Running', 0) > 1 :
-            # if more than 1 tasks are running, return Running
-            return self.STATUS_TYPE[3]
-        
-        elif subtasks_status.get(self.STATUS_TYPE[2], 0) > 0 and subtasks_status.get(self.STATUS_TYPE[0], 0) > 0 and subtasks_status.get(self.STATUS_TYPE[1], 0) == 0:
-            # if there are one or more Complete subtask
-            # AND one or more subtasks Scheduled
-            # AND there are no Running tasks, then the status is Idle
-            return self.STATUS_TYPE[4]
+    def status_at(self, as_of):
+        """
+        returns the status of the task and its subtasks at any time,
+        past or future, from the timeline index of all the tasks.
+        """
 
-        elif len(subtasks_status.keys()) == 1:
-            # if all the subtasks have the same status, use it 
-            return list(subtasks_status.keys())[0]
-        else:
-            # at the moment use a defualt value like Scheduled
-            return self.STATUS_TYPE[0]
+        return timeline_status_at(self.id, as_of)
 
 
-            
     def _duration(self):
         """
         return the minutes of the duration of the task from start
@@ -176,40 +472,54 @@ class Task(models.Model):
         # get the timedelta object and convert it to seconds  
         diff_delta = (self.end - self.start).total_seconds()
         duration_min = diff_delta / 60 # divide the sec by 60 to get the minutes        
-        #logger.debug("starttime: {} - endtime: {} => minutes: {}".format(self.start, self.end, diff_delta))
+        #logger.debug("starttime: %s - endtime: %s => minutes: %s", self.start, self.end, diff_delta)
 
         return int(duration_min)
     
 
-    status = property(_status)
+    status = property(_status, _set_status)
     duration = property(_duration)
     
-    def get_status(self, start_date=datetime, end_date=datetime):
+    def get_status(self, start_date=datetime, end_date=datetime, as_of=None):
         """
         takes the start and end dates as parameters, compares them
-        with each other and the current date. It will return the 
-        one of the below statuses based on the comparison results.
+        with each other and the current date, or the as_of date if 
+        given. It will return the one of the below statuses based on
+        the comparison results.
         a- Scheduled if the start timestamp is in future.
         b- Running if the current time is between start time and end 
            time.
         c- Complete if the end time has passed.
         """
 
-        current_date = datetime.now(timezone.utc)
+        current_date = as_of if as_of is not None else datetime.now(timezone.utc)
 
-        logger.debug("get_status start_date: {} - end_date: {} - current_date: {}".format(start_date, end_date, current_date))
-        
-        if start_date > current_date:
-            return self.STATUS_TYPE[0]
-        elif end_date < current_date:
-            return self.STATUS_TYPE[2]
-        elif start_date < current_date and end_date > current_date:
-            return self.STATUS_TYPE[1]
+        hot_logger.debug("get_status start_date: %s - end_date: %s - current_date: %s", start_date, end_date, current_date)
+
+        return leaf_status(start_date, end_date, current_date)
         
     
     class Meta:
-        ordering = (('start'),)
+        ordering = ('start', 'id')
         verbose_name_plural = "Task"
+        indexes = [
+            models.Index(fields=['start', 'id'], name='task_start_id_idx'),
+            models.Index(fields=['span_level', 'start'], name='task_span_level_start_idx'),
+        ]
+
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        keep the parent task the object was loaded with, to refresh the
+        status of the old parent task when the task moves.
+        """
+
+        instance = super().from_db(db, field_names, values)
+        if 'parent_task_id' in field_names:
+            instance._loaded_parent_task_id = values[field_names.index('parent_task_id')]
+
+        return instance
 
 
     def __str__(self):
@@ -223,36 +533,126 @@ class Task(models.Model):
     def save(self, *args, **kwargs):
         """
         override the save function to update the start and end date of
-        the parent task. the start datetime of the parent should always
-        be before than the subtask start datetime. If not, update it.
-        the end datetime of the parent task is equal to the highest
-        end datetime of the subtask.
+        the parent tasks. the start datetime of a parent should always
+        be before than the subtask start datetime and its end datetime
+        after the subtask end datetime. all the parent tasks, on any
+        depth, are widened with one update statement in the same 
+        transaction as the save, without reading them first.
+        a new task, or a task moved to another parent task, gets its
+        path from its parent task, with its subtasks on any depth.
+        after saving, the stored status of the task and its parent
+        tasks is computed again. inside deferred_span_updates, or in a
+        transaction with the TASKS_DEFER_SPAN_UPDATES setting, both are
+        left to the flush of the saved tasks, see tasks.spans.
         """
 
-        if not self.parent_task:
-            # do only the save
-            logger.debug("it's not a sub task")
+        self.span_level = span_level(self.start, self.end)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'start', 'end'} & set(update_fields):
+            kwargs['update_fields'] = list(update_fields) + ['span_level']
+
+        span_changed = update_fields is None or bool({'start', 'end', 'parent_task', 'parent_task_id'} & set(update_fields))
+        parent_changed = (
+            self._state.adding or self.parent_task_id != getattr(self, '_loaded_parent_task_id', None)
+        ) and (update_fields is None or bool({'parent_task', 'parent_task_id'} & set(update_fields)))
+
+        # the path of a loaded task changes when a parent task moves, it's
+        # only written by move_path.
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'path' and field.attname not in deferred
+            ]
+
+        with transaction.atomic():
             models.Model.save(self, *args, **kwargs)
 
-        else:
-            # save the object and update the main task object.
-            logger.debug("it's a sub task")
-            try:
-                ''' save the sub task and update the start and end date of the parent_task '''
+            if parent_changed:
+                self.path = move_path(self.id, self.parent_task_id)
 
-                models.Model.save(self, *args, **kwargs)
+            deferred = span_changed and defer_span_update(self.id, self.status_parent_ids())
+            if self.parent_task_id is not None and span_changed:
+                if not deferred:
+                    hot_logger.debug("it's a sub task, widen the parent tasks")
+                    widen_parent_spans([self.id])
 
-                # set the start date of the parent task to be lower
-                # than the start date of the subtask. if not keep the
-                # date of the parent task. The same applies for the
-                # end date.
-                
-                self.parent_task.start = self.start if self.start < self.parent_task.start else self.parent_task.start
-                self.parent_task.end = self.end if self.end > self.parent_task.end else self.parent_task.end
-                self.parent_task.save(update_fields=['start', 'end'])
+                # keep the loaded parent task the same as the database.
+                if Task.parent_task.is_cached(self):
+                    self.parent_task.start = min(self.parent_task.start, self.start)
+                    self.parent_task.end = max(self.parent_task.end, self.end)
 
-                logger.debug("parent task start is updated")
+        if deferred:
+            self._loaded_parent_task_id = self.parent_task_id
+        elif self.pk is not None and span_changed:
+            self.refresh_status_after_save()
 
-            
-            except Exception as e:
-                logger.error("error saving: {}".format(e))
+
+    def get_descendants(self):
+        """
+        returns the subtasks of the task on any depth, with one query on
+        the path index, see subtree_q. a task without path, on or under a
+        cycle of parent tasks, gets them with a recursive query.
+        """
+
+        if self.path is None:
+            return Task.objects.filter(id__in=subtree_ids(self.id)).exclude(id=self.id)
+
+        return Task.objects.filter(subtree_q(self.path)).exclude(pk=self.pk)
+
+
+    def get_root(self):
+        """
+        returns the root task of the task, the task itself for a task
+        without parent task.
+        """
+
+        return Task.objects.get(pk=self.root_id)
+
+
+    @property
+    def root_id(self):
+        """
+        returns the id of the root task of the task from its path.
+        """
+
+        return path_root_id(self.path)
+
+
+    @property
+    def depth(self):
+        """
+        returns the number of parent tasks of the task from its path.
+        """
+
+        return path_depth(self.path)
+
+
+    def status_parent_ids(self):
+        """
+        returns the ids of the parent tasks whose status changes with
+        the task: the current one and the one it moved from.
+        """
+
+        loaded_parent_task_id = getattr(self, '_loaded_parent_task_id', None)
+        return {self.parent_task_id, loaded_parent_task_id} - {None}
+
+
+    def refresh_status_after_save(self):
+        """
+        compute the status of the task and its parent tasks again. if 
+        the task moved to another parent task, the old parent tasks are
+        computed again too.
+        """
+
+        loaded_parent_task_id = getattr(self, '_loaded_parent_task_id', None)
+        if loaded_parent_task_id is not None and loaded_parent_task_id != self.parent_task_id:
+            refresh_ancestor_statuses(loaded_parent_task_id)
+
+        now = datetime.now(timezone.utc)
+        windows = refresh_ancestor_statuses(self.id, now=now)
+        if self.id in windows:
+            self.rollup_status, self.status_valid_until = windows[self.id]
+            self.status_computed_at = now
+
+        self._loaded_parent_task_id = self.parent_task_id
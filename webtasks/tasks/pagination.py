@@ -0,0 +1,87 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+import binascii
+import logging
+
+logger = logging.getLogger("tasks")
+
+
+def encode_cursor(task):
+    """
+    returns the cursor of a task, its start datetime and id, which are
+    the ordering of the tasks, as an url safe string.
+    """
+
+    value = "{}|{}".format(task.start.isoformat(), task.id)
+    return urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    returns the start datetime and id of the cursor. raises Http404 if
+    the cursor is invalid, like the django paginator does for an
+    invalid page.
+    """
+
+    try:
+        start, task_id = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        start = parse_datetime(start)
+        task_id = int(task_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        start = None
+
+    if start is None:
+        raise Http404("Invalid cursor")
+
+    return start, task_id
+
+
+class KeysetPage:
+    """
+    a page of tasks ordered by (start, id), with the cursors of the
+    next and previous page. unlike an OFFSET, the cursor is looked up in
+    the (start, id) index so every page costs the same.
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @classmethod
+    def from_queryset(cls, queryset, page_size, after=None, before=None):
+        """
+        returns the page of page_size tasks after the after cursor, or
+        before the before cursor. without cursor it's the first page.
+        one more task is fetched to know if there is another page.
+        """
+
+        if before:
+            start, task_id = decode_cursor(before)
+            tasks = list(queryset.filter(
+                Q(start__lte=start) & (Q(start__lt=start) | Q(id__lt=task_id)),
+            ).order_by('-start', '-id')[:page_size + 1])
+            has_more = len(tasks) > page_size
+            tasks = tasks[:page_size][::-1]
+            has_previous, has_next = has_more, True
+
+        else:
+            if after:
+                start, task_id = decode_cursor(after)
+                queryset = queryset.filter(
+                    Q(start__gte=start) & (Q(start__gt=start) | Q(id__gt=task_id)),
+                )
+            tasks = list(queryset.order_by('start', 'id')[:page_size + 1])
+            has_more = len(tasks) > page_size
+            tasks = tasks[:page_size]
+            has_previous, has_next = bool(after), has_more
+
+        logger.debug("page of %s tasks, after: %s - before: %s", len(tasks), after, before)
+
+        return cls(
+            tasks,
+            next_cursor=encode_cursor(tasks[-1]) if tasks and has_next else None,
+            previous_cursor=encode_cursor(tasks[0]) if tasks and has_previous else None,
+        )
@@ -0,0 +1,180 @@
+from django.apps import apps
+from django.db import connection
+from django.db.models import CharField, Q, Value
+from django.db.models.functions import Concat, Substr
+import logging
+
+logger = logging.getLogger("task")
+
+# the paths are the ids of the task and its parent tasks from the root
+# task, each followed by the separator: '/1/5/12/' for task 12, subtask
+# of task 5, subtask of task 1. the paths of the subtasks of a task, on
+# any depth, start with its path, so sorted byte by byte they are a
+# range of the path index, from the path of the task to the path with
+# the last separator replaced by the next character. only sqlite sorts
+# text byte by byte, see subtree_q. the path has no length limit, but
+# on postgres an entry of a btree index is at most about 2700 bytes, so
+# a tree can be about 300 levels deep there.
+SEPARATOR = '/'
+AFTER_SEPARATOR = chr(ord(SEPARATOR) + 1)
+
+
+def task_path(task_id, parent_path=None):
+    """
+    returns the path of a task with the given id and parent path, None
+    for a task without parent task.
+    """
+
+    return '{}{}{}'.format(parent_path or SEPARATOR, task_id, SEPARATOR)
+
+
+def path_range(path):
+    """
+    returns the lowest and the highest excluded path of the subtree of
+    the task with the given path, the task itself included.
+    """
+
+    return path, path[:-1] + AFTER_SEPARATOR
+
+
+def subtree_q(path):
+    """
+    the tasks which path starts with the given path, the task with the
+    path and its subtasks on any depth. sqlite compares text byte by
+    byte, the path_range is read from the path index. other databases
+    sort it by its collation, where the separator and the next character
+    aren't always next to each other, they filter with LIKE 'path%'
+    instead, read from the text_pattern_ops index django creates for an
+    indexed text field on postgres, whatever the collation.
+    """
+
+    if connection.vendor == 'sqlite':
+        low, high = path_range(path)
+        return Q(path__gte=low, path__lt=high)
+
+    return Q(path__startswith=path)
+
+
+def path_depth(path):
+    """
+    returns the depth of the task with the given path, 0 for a root task.
+    """
+
+    return path.count(SEPARATOR) - 2
+
+
+def path_root_id(path):
+    """
+    returns the id of the root task of the task with the given path.
+    """
+
+    return int(path.split(SEPARATOR, 2)[1])
+
+
+def move_path(task_id, parent_task_id):
+    """
+    set the path of a task from the path of its parent task in the
+    database, and change the paths of its subtasks on any depth the
+    same way, with one update statement. nothing is written if the path
+    didn't change. raises ValueError if the parent task is the task
+    itself or one of its subtasks. returns the new path. if the parent
+    task has no path, like on a cycle of parent tasks, the task and its
+    subtasks are left without path, found by recursive queries, and
+    None is returned.
+    """
+
+    Task = apps.get_model('tasks', 'Task')
+
+    paths = dict(Task.objects.filter(pk__in=[task_id, parent_task_id]).values_list('id', 'path'))
+    old_path = paths.get(task_id)
+    parent_path = paths.get(parent_task_id) if parent_task_id is not None else None
+
+    if old_path and parent_path and parent_path.startswith(old_path):
+        raise ValueError("task {} can't be a subtask of its own subtask {}".format(task_id, parent_task_id))
+
+    if parent_task_id is not None and parent_path is None:
+        new_path = None
+    else:
+        new_path = task_path(task_id, parent_path)
+    if new_path == old_path:
+        return new_path
+
+    if old_path and new_path is None:
+        updated = Task.objects.filter(subtree_q(old_path)).update(path=None)
+        logger.warning("taskid: %s - parent task %s has no path, removed the path of %s tasks", task_id, parent_task_id, updated)
+        return None
+
+    if old_path:
+        updated = Task.objects.filter(subtree_q(old_path)).update(
+            path=Concat(Value(new_path), Substr('path', len(old_path) + 1), output_field=CharField()),
+        )
+    else:
+        updated = Task.objects.filter(pk=task_id).update(path=new_path)
+        # the subtasks of a task without path had none either, they get
+        # theirs from the task.
+        fill_paths()
+
+    logger.debug("taskid: %s - moved the path of %s tasks to %s", task_id, updated, new_path)
+
+    return new_path
+
+
+def fill_paths():
+    """
+    set the path of all the tasks without one, the tasks created
+    without save, with one statement. the paths are carried down from
+    the tasks with a path, or without parent task, by a recursive query,
+    so the subtasks inserted before their parent tasks get their path
+    with them. the tasks on a cycle of parent tasks are left without
+    path. returns the number of tasks left without path.
+    """
+
+    Task = apps.get_model('tasks', 'Task')
+    qn = connection.ops.quote_name
+    table = qn(Task._meta.db_table)
+
+    sql = (
+        "WITH RECURSIVE paths(task_id, path) AS ("
+        " SELECT t.{id}, COALESCE(p.{path}, %s) || t.{id} || %s FROM {table} t"
+        " LEFT JOIN {table} p ON p.{id} = t.{parent}"
+        " WHERE t.{path} IS NULL AND (t.{parent} IS NULL OR p.{path} IS NOT NULL)"
+        " UNION ALL"
+        " SELECT t.{id}, paths.path || t.{id} || %s FROM paths"
+        " INNER JOIN {table} t ON t.{parent} = paths.task_id WHERE t.{path} IS NULL"
+        ") UPDATE {table} SET {path} = paths.path FROM paths WHERE {table}.{id} = paths.task_id"
+    ).format(table=table, id=qn('id'), parent=qn('parent_task_id'), path=qn('path'))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [SEPARATOR, SEPARATOR, SEPARATOR])
+
+    # the row count of a statement starting with WITH is not reported by
+    # every driver.
+    missing = Task.objects.filter(path__isnull=True).count()
+    if missing:
+        logger.warning("%s tasks on a cycle of parent tasks have no path", missing)
+
+    return missing
+
+
+def subtree_ids(task_id):
+    """
+    returns the ids of a task and its subtasks on any depth, from a
+    recursive query. it's for the tasks without path, the recursive
+    query drops the rows it already produced, so it ends even on a
+    cycle of parent tasks.
+    """
+
+    Task = apps.get_model('tasks', 'Task')
+    qn = connection.ops.quote_name
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "WITH RECURSIVE subtree(id) AS ("
+            " SELECT %s"
+            " UNION"
+            " SELECT t.{id} FROM {table} t INNER JOIN subtree ON t.{parent} = subtree.id"
+            ") SELECT id FROM subtree".format(
+                table=qn(Task._meta.db_table), id=qn('id'), parent=qn('parent_task_id')),
+            [task_id],
+        )
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,105 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+import random
+import threading
+
+# the replica the queries of the current thread read from, chosen for
+# the request, and whether the thread wrote since.
+_local = threading.local()
+
+
+def replica_aliases():
+    """
+    the aliases of the read replicas of the TASKS_READ_REPLICAS setting,
+    copies of the primary database, the default alias.
+    """
+
+    return list(getattr(settings, 'TASKS_READ_REPLICAS', ()))
+
+
+def sticky_seconds():
+    """
+    the seconds a replica can lag behind the primary: after a write the
+    user reads from the primary for that long.
+    """
+
+    return getattr(settings, 'TASKS_REPLICA_STICKY_SECONDS', 10)
+
+
+def reads_from_replica(view):
+    """
+    mark a view reading only, its queries can be sent to a replica. a
+    class based view sets the reads_from_replica attribute instead.
+    """
+
+    view.reads_from_replica = True
+    return view
+
+
+def read_from_replica():
+    """
+    send the reads of the current thread to one of the replicas, chosen
+    at random so the reads are spread over all of them. does nothing
+    without replicas.
+    """
+
+    aliases = replica_aliases()
+    _local.replica = random.choice(aliases) if aliases else None
+    _local.written = False
+
+
+def read_from_primary():
+    """
+    send the reads of the current thread to the primary again.
+    """
+
+    _local.replica = None
+    _local.written = False
+
+
+def reading_from_replica():
+    """
+    returns True if the reads of the current thread go to a replica.
+    """
+
+    return getattr(_local, 'replica', None) is not None and not getattr(_local, 'written', False)
+
+
+def written():
+    """
+    returns True if the current thread wrote since its reads were sent
+    to a replica or to the primary.
+    """
+
+    return getattr(_local, 'written', False)
+
+
+class ReadReplicaRouter:
+    """
+    sends the reads of the views marked with reads_from_replica to the
+    replicas and everything else to the primary. once a request writes,
+    its next reads go to the primary too, so it reads what it wrote.
+    the writes always go to the primary, even the ones of objects read
+    from a replica. set in DATABASE_ROUTERS.
+    """
+
+    def db_for_read(self, model, **hints):
+        if reading_from_replica():
+            return _local.replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _local.written = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replicas are copies of the migrated primary.
+        if db in replica_aliases():
+            return False
+        return None
@@ -15,3 +15,14 @@ class TaskDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Task
         fields = ('task_priority', 'first_name', 'last_name')
+
+
+class TaskDetailListSerializer(TaskDetailSerializer):
+    """ 
+    the same fields as the TaskDetailSerializer with the id of the 
+    task, used by the api returning the details of many tasks.
+    """
+
+    class Meta:
+        model = Task
+        fields = ('id', 'task_priority', 'first_name', 'last_name')
@@ -0,0 +1,100 @@
+from django.contrib.auth.models import User
+from django.core.signals import request_finished
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .cache import (
+    invalidate_index_summary, invalidate_owner_details, invalidate_task_details,
+)
+from .live import notify_saved
+from .models import Task
+from .routers import read_from_primary
+from .status import refresh_ancestor_statuses
+from .timeline import remove_from_timeline, update_timeline
+import logging
+
+logger = logging.getLogger("task")
+
+
+@receiver(post_delete, sender=Task)
+def refresh_parent_task_status(sender, instance, **kwargs):
+    """
+    when a subtask is deleted, the status of its parent tasks changes.
+    compute it again.
+    """
+
+    if instance.parent_task_id is not None:
+        logger.debug("subtask %s deleted, refresh parent %s", instance.id, instance.parent_task_id)
+        refresh_ancestor_statuses(instance.parent_task_id)
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def invalidate_cached_task_details(sender, instance, **kwargs):
+    """
+    the cached details of a saved or deleted task and the cached summary
+    of the tasks are not valid anymore. both are removed once the change
+    is committed, removed before a request could cache the old rows
+    again until the next change.
+    """
+
+    task_id = instance.id
+    transaction.on_commit(lambda: invalidate_task_details(task_id))
+    transaction.on_commit(invalidate_index_summary)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_owner_details(sender, instance, **kwargs):
+    """
+    the cached details of all the tasks of a saved or deleted user are
+    not valid anymore, once the change is committed.
+    """
+
+    owner_id = instance.id
+    transaction.on_commit(lambda: invalidate_owner_details(owner_id))
+
+
+@receiver(post_save, sender=Task)
+def update_task_timeline(sender, instance, **kwargs):
+    """
+    update the timelines of the saved task and its parent tasks, the
+    open status streams push the change. both once the save is
+    committed, a rolled back save changes nothing.
+    """
+
+    task_id, parent_task_id, start, end = instance.id, instance.parent_task_id, instance.start, instance.end
+
+    def saved():
+        update_timeline(task_id, parent_task_id, start, end)
+        notify_saved(task_id)
+
+    transaction.on_commit(saved)
+
+
+@receiver(post_delete, sender=Task)
+def remove_task_timeline(sender, instance, **kwargs):
+    """
+    remove the timeline of the deleted task and update its parent tasks,
+    the open status streams push the change. both once the delete is
+    committed.
+    """
+
+    task_id = instance.id
+
+    def deleted():
+        remove_from_timeline(task_id)
+        notify_saved(task_id, 'delete')
+
+    transaction.on_commit(deleted)
+
+
+
+@receiver(request_finished)
+def reset_read_replica(sender, **kwargs):
+    """
+    the response is sent, the thread reads from the primary again until
+    its next request reading from a replica.
+    """
+
+    read_from_primary()
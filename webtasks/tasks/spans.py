@@ -0,0 +1,189 @@
+from contextlib import contextmanager
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from .status import MAX_IDS_PER_QUERY, refresh_ancestor_statuses, refresh_statuses
+import logging
+import threading
+
+logger = logging.getLogger("task")
+
+# the saved tasks waiting for the update of their parent tasks, per
+# thread, as the database connection: the buffers of the open
+# deferred_span_updates blocks and the one flushed on commit.
+_pending = threading.local()
+
+
+def widen_ancestor_spans(where, params=()):
+    """
+    widen the start and end of all the parent tasks, on any depth, of
+    the tasks matching the where clause, with one statement. the start
+    and end of every matching task is carried up its ancestors by a
+    recursive query, the earliest start and latest end per ancestor
+    are then set where they are wider than the current ones, in the
+    same statement, so no row is locked in between and concurrent
+    saves of sibling tasks can't undo each other. the span level and
+    the stored status of the widened tasks are cleared, they're
+    computed again later. the recursive query drops the rows it already
+    produced, so it ends even on a cycle of parent tasks. no signal is
+    sent for the widened tasks, their cached details and the cached
+    summary of the tasks are removed here once committed. returns the
+    number of updated tasks. UPDATE ... FROM and RETURNING need sqlite
+    3.35 or later, or postgres.
+    """
+
+    from .cache import invalidate_index_summary, invalidate_many_task_details
+
+    Task = apps.get_model('tasks', 'Task')
+    qn = connection.ops.quote_name
+    table = qn(Task._meta.db_table)
+
+    sql = (
+        "WITH RECURSIVE spans(task_id, start, end_) AS ("
+        " SELECT {parent}, {start}, {end} FROM {table} WHERE {parent} IS NOT NULL AND ({where})"
+        " UNION"
+        " SELECT t.{parent}, spans.start, spans.end_ FROM spans"
+        " INNER JOIN {table} t ON t.{id} = spans.task_id WHERE t.{parent} IS NOT NULL"
+        ") UPDATE {table} SET"
+        " {start} = CASE WHEN widened.start < {table}.{start} THEN widened.start ELSE {table}.{start} END,"
+        " {end} = CASE WHEN widened.end_ > {table}.{end} THEN widened.end_ ELSE {table}.{end} END,"
+        " {span_level} = NULL, {rollup_status} = NULL, {status_valid_until} = NULL"
+        " FROM (SELECT task_id, MIN(start) AS start, MAX(end_) AS end_ FROM spans GROUP BY task_id) AS widened"
+        " WHERE {table}.{id} = widened.task_id"
+        " AND (widened.start < {table}.{start} OR widened.end_ > {table}.{end})"
+        " RETURNING {table}.{id}"
+    ).format(
+        table=table, where=where, id=qn('id'), parent=qn('parent_task_id'),
+        start=qn('start'), end=qn('end'), span_level=qn('span_level'),
+        rollup_status=qn('rollup_status'), status_valid_until=qn('status_valid_until'),
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        # the row count of a statement starting with WITH is not reported
+        # by every driver, the ids of the updated tasks are returned.
+        widened_ids = [row[0] for row in cursor.fetchall()]
+
+    for i in range(0, len(widened_ids), MAX_IDS_PER_QUERY):
+        Task.objects.filter(id__in=widened_ids[i:i + MAX_IDS_PER_QUERY]).update_span_levels()
+    logger.debug("widened the span of %s parent tasks", len(widened_ids))
+
+    if widened_ids:
+        def widened():
+            invalidate_many_task_details(widened_ids)
+            invalidate_index_summary()
+
+        transaction.on_commit(widened)
+
+    return len(widened_ids)
+
+
+def widen_parent_spans(task_ids):
+    """
+    widen the spans of all the parent tasks of the given tasks.
+    returns the number of updated tasks.
+    """
+
+    task_ids = list(task_ids)
+    updated = 0
+    for i in range(0, len(task_ids), MAX_IDS_PER_QUERY):
+        chunk = task_ids[i:i + MAX_IDS_PER_QUERY]
+        updated += widen_ancestor_spans(
+            "{} IN ({})".format(connection.ops.quote_name('id'), ", ".join(["%s"] * len(chunk))),
+            chunk,
+        )
+
+    return updated
+
+
+class SpanUpdates:
+    """
+    the tasks saved since the last flush, and the parent tasks whose
+    status changed with them.
+    """
+
+    def __init__(self):
+        self.task_ids = set()
+        self.parent_ids = set()
+
+    def add(self, task_ids, parent_ids=()):
+        self.task_ids.update(task_ids)
+        self.parent_ids.update(parent_ids)
+
+    def flush(self):
+        """
+        widen the spans of the parent tasks of all the saved tasks with
+        one statement, then compute the status of the saved tasks and
+        of their parent tasks once. the update reads the saved tasks
+        from the database, so the ones rolled back after being added
+        are harmless. returns the number of widened tasks.
+        """
+
+        task_ids, parent_ids = self.task_ids, self.parent_ids
+        self.task_ids, self.parent_ids = set(), set()
+        if not task_ids:
+            return 0
+
+        widened = widen_parent_spans(task_ids)
+        refresh_statuses(task_ids)
+        for parent_id in parent_ids:
+            refresh_ancestor_statuses(parent_id)
+
+        logger.debug("flushed the span updates of %s tasks", len(task_ids))
+
+        return widened
+
+
+@contextmanager
+def deferred_span_updates():
+    """
+    defer the update of the parent tasks of the tasks saved in the
+    block to its end, so each parent task is updated once with the
+    final spans of its subtasks. meant for jobs saving many subtasks.
+    nothing is flushed when the block raises, its transaction is
+    expected to be rolled back. a nested block is flushed with the
+    outer one.
+    """
+
+    updates = SpanUpdates()
+    batches = _pending.__dict__.setdefault('batches', [])
+    batches.append(updates)
+    try:
+        yield updates
+    finally:
+        batches.pop()
+
+    if batches:
+        batches[-1].add(updates.task_ids, updates.parent_ids)
+    else:
+        updates.flush()
+
+
+def defer_span_update(task_id, parent_ids):
+    """
+    add a saved task to the span updates of the current
+    deferred_span_updates block, or, with the TASKS_DEFER_SPAN_UPDATES
+    setting, of the current transaction, flushed on commit. returns
+    False if the update is not deferred and should be done now.
+    """
+
+    batches = getattr(_pending, 'batches', None)
+    if batches:
+        batches[-1].add([task_id], parent_ids)
+        return True
+
+    if not getattr(settings, 'TASKS_DEFER_SPAN_UPDATES', False) or not connection.in_atomic_block:
+        return False
+
+    updates = getattr(_pending, 'committed', None)
+    if updates is None:
+        updates = _pending.committed = SpanUpdates()
+    updates.add([task_id], parent_ids)
+
+    # the callbacks of a rolled back transaction are dropped with it, so
+    # the flush is registered on every save, the tasks left over from a
+    # rollback are flushed with the next commit. the first callback of a
+    # commit flushes all the tasks, the others find none.
+    transaction.on_commit(updates.flush)
+
+    return True
@@ -0,0 +1,576 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from django.apps import apps
+from django.db import connection, connections, router
+from django.db.models import (
+    Case, CharField, Exists, ExpressionWrapper, F, Func, IntegerField, OuterRef, Q,
+    Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Cast, Coalesce, Least, Substr
+from django.utils.dateparse import parse_datetime
+from .routers import reading_from_replica
+import logging
+
+logger = logging.getLogger("task")
+
+# the statuses a task can have. the order is the same as the
+# Task.STATUS_TYPE list.
+SCHEDULED = 'Scheduled'
+RUNNING = 'Running'
+COMPLETE = 'Complete'
+MULTI_RUNS = 'Multi-Runs'
+IDLE = 'Idle'
+
+STATUS_TYPE = [
+    SCHEDULED,
+    RUNNING,
+    COMPLETE,
+    MULTI_RUNS,
+    IDLE,
+]
+
+# the max number of ids sent in one IN (...) clause. sqlite limits the
+# number of query parameters.
+MAX_IDS_PER_QUERY = 500
+
+# the number of subtask levels with an expired stored status rolled up
+# by status_expression. every level nests the query deeper, sqlite
+# fails to parse deeper queries once they're wrapped, like by count().
+STATUS_SQL_DEPTH = 2
+
+
+def leaf_status(start, end, now):
+    """
+    returns the status of a task without subtasks based on its start
+    and end datetime compared with now.
+    a- Scheduled if the start timestamp is in future.
+    b- Running if now is between start time and end time.
+    c- Complete if the end time has passed.
+    exactly on the start or end time there is no status (None).
+    """
+
+    if start > now:
+        return SCHEDULED
+    elif end < now:
+        return COMPLETE
+    elif start < now and end > now:
+        return RUNNING
+
+
+def rollup_status(status_counts):
+    """
+    takes a dict with the statuses of the subtasks as keys and the
+    number of subtasks having that status as value, example:
+    {'Complete': 2, 'Running': 5, 'Scheduled': 3}, and returns the
+    status of the parent task.
+    if Running > 1 then the status will be Multi-Runs.
+    if Completed >= 1 and Scheduled >= 1 and Running == 0 then the
+    status will be Idle
+    if the dict contains one key, the status will be that key.
+    otherwise the status is Scheduled.
+    """
+
+    if status_counts.get(RUNNING, 0) > 1:
+        return MULTI_RUNS
+
+    elif status_counts.get(COMPLETE, 0) > 0 and status_counts.get(SCHEDULED, 0) > 0 and status_counts.get(RUNNING, 0) == 0:
+        return IDLE
+
+    elif len(status_counts.keys()) == 1:
+        return list(status_counts.keys())[0]
+
+    else:
+        return SCHEDULED
+
+
+def to_datetime(value):
+    """
+    the raw cursor returns the datetimes as strings on sqlite. convert
+    them to aware datetime objects in utc like the orm does.
+    """
+
+    if isinstance(value, str):
+        value = parse_datetime(value)
+
+    if value is not None and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+
+    return value
+
+
+def fetch_subtrees(task_ids=None):
+    """
+    fetch the tasks with all their subtasks, on any depth, with one
+    recursive query. if no task_ids are given, the trees of all the
+    root tasks are fetched. returns a list of
+    (id, parent_task_id, start, end) tuples. the recursive query drops
+    the rows it already produced, so it ends even on a cycle of parent
+    tasks.
+    """
+
+    Task = apps.get_model('tasks', 'Task')
+    # only reads, from a replica in the views reading from replicas.
+    db = connections[router.db_for_read(Task)]
+    qn = db.ops.quote_name
+    table = qn(Task._meta.db_table)
+    columns = "{id}, {parent}, {start}, {end}".format(
+        id=qn('id'), parent=qn('parent_task_id'), start=qn('start'), end=qn('end'))
+
+    if task_ids is None:
+        anchors = [("{parent} IS NULL".format(parent=qn('parent_task_id')), [])]
+    else:
+        task_ids = list(task_ids)
+        anchors = []
+        for i in range(0, len(task_ids), MAX_IDS_PER_QUERY):
+            chunk = task_ids[i:i + MAX_IDS_PER_QUERY]
+            anchors.append(("{id} IN ({params})".format(
+                id=qn('id'), params=", ".join(["%s"] * len(chunk))), chunk))
+
+    rows = []
+    with db.cursor() as cursor:
+        for anchor, params in anchors:
+            cursor.execute(
+                "WITH RECURSIVE subtree(id, parent_task_id, start, end_) AS ("
+                " SELECT {columns} FROM {table} WHERE {anchor}"
+                " UNION"
+                " SELECT t.{id}, t.{parent}, t.{start}, t.{end} FROM {table} t"
+                " INNER JOIN subtree ON t.{parent} = subtree.id"
+                ") SELECT id, parent_task_id, start, end_ FROM subtree".format(
+                    columns=columns, table=table, anchor=anchor,
+                    id=qn('id'), parent=qn('parent_task_id'),
+                    start=qn('start'), end=qn('end')),
+                params,
+            )
+            rows.extend(
+                (task_id, parent_id, to_datetime(start), to_datetime(end))
+                for task_id, parent_id, start, end in cursor.fetchall()
+            )
+
+    logger.debug("fetched %s tasks for %s anchor queries", len(rows), len(anchors))
+    return rows
+
+
+def subtasks_first(parents, children):
+    """
+    takes a dict with the parent task id of every task and a dict with
+    the subtask ids of every task, returns the ids of all the tasks in
+    an order where every task comes after its subtasks. the tasks are
+    walked depth first without recursion. on a cycle of parent tasks
+    the subtask closing the cycle comes after its parent task, the
+    cycle has no first task.
+    """
+
+    done = {}
+    order = []
+    tops = [task_id for task_id, parent_id in parents.items() if parent_id not in parents]
+    # the tasks not under a top are on a cycle or under one.
+    for first in tops + list(parents):
+        if first in done:
+            continue
+        done[first] = False
+        stack = [(first, iter(children.get(first, ())))]
+        while stack:
+            task_id, subtasks = stack[-1]
+            for sub in subtasks:
+                if sub not in done:
+                    done[sub] = False
+                    stack.append((sub, iter(children.get(sub, ()))))
+                    break
+            else:
+                stack.pop()
+                done[task_id] = True
+                order.append(task_id)
+
+    return order
+
+
+def leaf_window(start, end, now):
+    """
+    returns the status of a task without subtasks and the time until
+    that status is valid, the next start or end time. if the status
+    never changes anymore the time is None.
+    """
+
+    boundaries = [boundary for boundary in (start, end) if boundary >= now]
+    return leaf_status(start, end, now), min(boundaries) if boundaries else None
+
+
+def rollup_window(windows):
+    """
+    takes the (status, valid_until) of the subtasks and returns the 
+    status of the parent task and the time until it's valid, which is
+    the first time one of the subtask statuses changes.
+    """
+
+    windows = list(windows)
+    valid_until = [until for _, until in windows if until is not None]
+    status = rollup_status(Counter(status for status, _ in windows))
+
+    return status, min(valid_until) if valid_until else None
+
+
+def compute_status_windows(rows, now=None):
+    """
+    takes the (id, parent_task_id, start, end) tuples of complete
+    subtrees and returns a dict with the task id as key and a tuple of
+    its status and the time until that status is valid as value. the
+    tasks are walked bottom-up without recursion, so the depth of a tree
+    is not limited by the python recursion limit. on a cycle of parent
+    tasks, the subtask closing the cycle isn't rolled up.
+    """
+
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    tasks = {}
+    parents = {}
+    children = defaultdict(list)
+    for task_id, parent_id, start, end in rows:
+        if task_id in tasks:
+            # the same subtree can be fetched more than once when both a
+            # task and one of its ancestors are requested.
+            continue
+        tasks[task_id] = (start, end)
+        parents[task_id] = parent_id
+        children[parent_id].append(task_id)
+
+    windows = {}
+    for task_id in subtasks_first(parents, children):
+        subtasks = [sub for sub in children.get(task_id, ()) if sub in windows]
+        if subtasks:
+            windows[task_id] = rollup_window(windows[sub] for sub in subtasks)
+        else:
+            start, end = tasks[task_id]
+            windows[task_id] = leaf_window(start, end, now)
+
+    return windows
+
+
+def compute_statuses(rows, now=None):
+    """
+    same as compute_status_windows but returns only the status of each
+    task.
+    """
+
+    return {task_id: status for task_id, (status, _) in compute_status_windows(rows, now=now).items()}
+
+
+def subtree_statuses(task_ids=None, now=None):
+    """
+    returns a dict with the status of the given tasks, and all their
+    subtasks, computed from one recursive query. if no task_ids are
+    given the status of every task is returned.
+    """
+
+    return compute_statuses(fetch_subtrees(task_ids), now=now)
+
+
+def fetch_ancestors(task_id):
+    """
+    fetch the task and all its parent tasks up to the root task with
+    one recursive query. returns a list of (id, parent_task_id) tuples.
+    the recursive query drops the rows it already produced, so it ends
+    even on a cycle of parent tasks.
+    """
+
+    Task = apps.get_model('tasks', 'Task')
+    qn = connection.ops.quote_name
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "WITH RECURSIVE ancestors(id, parent_task_id) AS ("
+            " SELECT {id}, {parent} FROM {table} WHERE {id} = %s"
+            " UNION"
+            " SELECT t.{id}, t.{parent} FROM {table} t"
+            " INNER JOIN ancestors ON t.{id} = ancestors.parent_task_id"
+            ") SELECT id, parent_task_id FROM ancestors".format(
+                table=qn(Task._meta.db_table), id=qn('id'), parent=qn('parent_task_id')),
+            [task_id],
+        )
+        return cursor.fetchall()
+
+
+def store_status_windows(windows, now):
+    """
+    store the (status, valid_until) of the tasks computed at now in the
+    rollup_status, status_valid_until and status_computed_at columns.
+    """
+
+    Task = apps.get_model('tasks', 'Task')
+    Task.objects.bulk_update(
+        [
+            Task(id=task_id, rollup_status=status, status_valid_until=valid_until, status_computed_at=now)
+            for task_id, (status, valid_until) in windows.items()
+        ],
+        ['rollup_status', 'status_valid_until', 'status_computed_at'],
+        batch_size=MAX_IDS_PER_QUERY,
+    )
+
+
+def refresh_statuses(task_ids, now=None):
+    """
+    compute the status of the given tasks from their whole subtrees and
+    store it. returns the computed windows of the given tasks. the
+    statuses read from a replica are not stored, the replica could be
+    behind the primary.
+    """
+
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    task_ids = set(task_ids)
+    windows = {
+        task_id: window
+        for task_id, window in compute_status_windows(fetch_subtrees(task_ids), now=now).items()
+        if task_id in task_ids
+    }
+    if not reading_from_replica():
+        store_status_windows(windows, now)
+
+    return windows
+
+
+def refresh_ancestor_statuses(task_id, now=None):
+    """
+    a change of a task changes its own status and the status of all its
+    parent tasks, but not the status of any other task. compute the
+    status of the task and its parent tasks again, using the stored
+    status of the other subtasks when still valid, and store them.
+    """
+
+    Task = apps.get_model('tasks', 'Task')
+
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    parents = dict(fetch_ancestors(task_id))
+    if not parents:
+        return {}
+
+    rows = Task.objects.filter(
+        Q(id=task_id) | Q(parent_task_id__in=parents.keys()),
+    ).order_by().values_list(
+        'id', 'parent_task_id', 'start', 'end', 'rollup_status', 'status_valid_until', 'status_computed_at')
+
+    spans = {}
+    children = defaultdict(list)
+    windows = {}
+    stale = []
+    for sub_id, parent_id, start, end, status, valid_until, computed_at in rows:
+        spans[sub_id] = (start, end)
+        children[parent_id].append(sub_id)
+        if sub_id in parents:
+            continue
+        if status is not None and computed_at is not None and computed_at <= now and (
+                valid_until is None or valid_until > now):
+            windows[sub_id] = (status, valid_until)
+        else:
+            stale.append(sub_id)
+
+    if stale:
+        windows.update(refresh_statuses(stale, now=now))
+
+    # walk from the task up to the root task, or once around a cycle of
+    # parent tasks, without the subtask closing it.
+    changed = {}
+    current = task_id
+    while current is not None and current not in changed:
+        subtasks = [sub for sub in children.get(current, ()) if sub in windows]
+        if subtasks:
+            changed[current] = rollup_window(windows[sub] for sub in subtasks)
+        else:
+            start, end = spans[current]
+            changed[current] = leaf_window(start, end, now)
+        windows[current] = changed[current]
+        current = parents[current]
+
+    store_status_windows(changed, now)
+    logger.debug("taskid: %s - refreshed status of %s tasks", task_id, len(changed))
+
+    return changed
+
+
+def prime_statuses(tasks, now=None, store=True):
+    """
+    make sure the stored status of the given task objects is valid, so
+    reading task.status doesn't run any query. the tasks with an expired
+    status are computed at once and, unless store is False or they're
+    read from a replica, stored.
+    """
+
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    tasks = list(tasks)
+    expired = [task for task in tasks if not task.status_is_valid(now)]
+    if expired:
+        expired_ids = {task.id for task in expired}
+        windows = compute_status_windows(fetch_subtrees(expired_ids), now=now)
+        if store and not reading_from_replica():
+            store_status_windows({task_id: windows[task_id] for task_id in expired_ids}, now)
+        for task in expired:
+            task.rollup_status, task.status_valid_until = windows[task.id]
+            task.status_computed_at = now
+
+    return tasks
+
+
+def valid_status_q(now):
+    """
+    the tasks with a stored status valid at now, see
+    Task.status_is_valid.
+    """
+
+    return (
+        Q(rollup_status__isnull=False)
+        & Q(status_computed_at__lte=now)
+        & (Q(status_valid_until__isnull=True) | Q(status_valid_until__gt=now))
+    )
+
+
+class SimpleCase(Func):
+    """
+    CASE expression WHEN value THEN result ... ELSE default END. unlike
+    Case(When(...)) the expression is in the sql only once, so nesting
+    it doesn't double the size of the query.
+    """
+
+    def __init__(self, expression, mapping, default=None, **extra):
+        super().__init__(expression, **extra)
+        self.mapping = mapping
+        self.default = default
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        params = list(params)
+        whens = []
+        for value, result in self.mapping.items():
+            whens.append("WHEN %s THEN %s")
+            params.extend([value, result])
+        params.append(self.default)
+
+        return "CASE {} {} ELSE %s END".format(sql, " ".join(whens)), params
+
+
+class DistinctSum(Sum):
+    """ SUM(DISTINCT ...), the Sum aggregate doesn't allow distinct. """
+
+    allow_distinct = True
+
+
+# in sql the statuses are computed as codes, the index of the status
+# in STATUS_CODES. a missing status, exactly on a start or end time,
+# has its own code. UNKNOWN_CODE is the code of a task with subtasks
+# deeper than STATUS_SQL_DEPTH and an expired stored status.
+STATUS_CODES = STATUS_TYPE + [None]
+UNKNOWN_CODE = len(STATUS_CODES)
+
+
+def rollup_code_table():
+    """
+    the rolled up status code of every combination of the aggregated
+    subtask codes, as a string with one digit per combination. the
+    combination is the number of Running subtasks, capped at 2, times
+    128 plus the sum of the distinct subtask status bits (1 << code).
+    the digits are computed with rollup_status, so sql and python give
+    the same status. a task with an unknown subtask is unknown too.
+    """
+
+    table = []
+    for combination in range(3 * 128):
+        running, bits = divmod(combination, 128)
+        if bits & (1 << UNKNOWN_CODE):
+            table.append(str(UNKNOWN_CODE))
+            continue
+
+        status_counts = {}
+        for code, status in enumerate(STATUS_CODES):
+            if bits & (1 << code):
+                status_counts[status] = running if status == RUNNING else 1
+
+        table.append(str(STATUS_CODES.index(rollup_status(status_counts))))
+
+    return "".join(table)
+
+
+ROLLUP_CODE_TABLE = rollup_code_table()
+
+
+def leaf_status_expression(now):
+    """
+    the sql version of leaf_status, a CASE on the start and end of a
+    task compared with now, returning the status code.
+    """
+
+    return Case(
+        When(start__gt=now, then=Value(STATUS_CODES.index(SCHEDULED))),
+        When(end__lt=now, then=Value(STATUS_CODES.index(COMPLETE))),
+        When(start__lt=now, end__gt=now, then=Value(STATUS_CODES.index(RUNNING))),
+        default=Value(STATUS_CODES.index(None)),
+        output_field=IntegerField(),
+    )
+
+
+def status_expression(now, depth=STATUS_SQL_DEPTH):
+    """
+    the status of the tasks at now as sql expression, to be used as
+    annotation on a Task queryset. it runs no query by itself. a task
+    with a stored status valid at now gets it, it's rolled up from the
+    whole subtree on any depth. the others get the status rolled up
+    from the aggregated status codes of their subtasks, which use their
+    own valid stored status the same way, or the leaf_status_expression
+    for the tasks without subtasks. the aggregates are the number of
+    Running subtasks and the sum of the distinct status bits, looked up
+    in ROLLUP_CODE_TABLE. every level nests one subquery, the tasks with
+    subtasks and an expired status below the given depth are unknown,
+    so the status of their parent tasks is None instead of a wrong one.
+    a status stored after now is never valid at now, so now can be in
+    the past too.
+    """
+
+    Task = apps.get_model('tasks', 'Task')
+    bits = {code: 1 << code for code in range(UNKNOWN_CODE + 1)}
+    stored_code = SimpleCase(
+        F('rollup_status'),
+        {status: code for code, status in enumerate(STATUS_TYPE)},
+        default=UNKNOWN_CODE,
+    )
+
+    expression = None
+    for _ in range(depth):
+        subtasks = Task.objects.filter(parent_task=OuterRef('pk')).order_by()
+        if expression is None:
+            # the deepest level rolled up, its subtasks with subtasks of
+            # their own and an expired status are unknown.
+            subtasks = subtasks.annotate(
+                has_subtasks=Exists(Task.objects.filter(parent_task=OuterRef('pk'))),
+            )
+            expression = Case(
+                When(valid_status_q(now), then=stored_code),
+                When(has_subtasks=True, then=Value(UNKNOWN_CODE)),
+                default=leaf_status_expression(now),
+                output_field=IntegerField(),
+            )
+
+        subtasks = subtasks.annotate(
+            sub_code=expression,
+        ).values('parent_task').annotate(
+            combination=ExpressionWrapper(
+                Least(Sum(SimpleCase(F('sub_code'), {STATUS_CODES.index(RUNNING): 1}, default=0)), Value(2)) * 128
+                + DistinctSum(SimpleCase(F('sub_code'), bits, default=0), distinct=True),
+                output_field=IntegerField(),
+            ),
+        ).annotate(
+            code=Cast(Substr(Value(ROLLUP_CODE_TABLE), F('combination') + 1, 1), IntegerField()),
+        ).values('code')
+
+        expression = Case(
+            When(valid_status_q(now), then=stored_code),
+            default=Coalesce(
+                Subquery(subtasks, output_field=IntegerField()),
+                leaf_status_expression(now),
+            ),
+            output_field=IntegerField(),
+        )
+
+    return SimpleCase(expression, dict(enumerate(STATUS_TYPE)), output_field=CharField())
@@ -0,0 +1,230 @@
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from django.apps import apps
+from django.db import connection
+from .paths import task_path
+import random
+
+# the shape of the generated task trees: the depth of the deepest
+# subtasks, the fewest and most subtasks of a task and the most tasks
+# of a tree. the size of every tree is drawn up to the most tasks.
+TreeShape = namedtuple('TreeShape', ['depth', 'min_subtasks', 'max_subtasks', 'max_tree_size'])
+
+SHAPES = {
+    'flat': TreeShape(0, 0, 0, 1),
+    'wide': TreeShape(2, 10, 200, 2000),
+    'deep': TreeShape(40, 1, 2, 400),
+    'mixed': TreeShape(6, 0, 6, 300),
+}
+
+# the columns of the generated rows, in order. the start and end are
+# seconds from the epoch, converted by insert_tasks.
+COLUMNS = ('id', 'name', 'owner_id', 'priority', 'start', 'end', 'parent_task_id', 'span_level', 'path')
+
+PRIORITIES = ('L', 'M', 'H')
+
+# the columns of the generated users, in order. the date joined is in
+# seconds from the epoch.
+USER_COLUMNS = (
+    'username', 'password', 'first_name', 'last_name', 'email',
+    'is_superuser', 'is_staff', 'is_active', 'date_joined',
+)
+USERNAME_PREFIX = 'seed'
+USERNAME = USERNAME_PREFIX + '{:07d}'
+USERNAME_PATTERN = '^' + USERNAME_PREFIX + '[0-9]{7}$'
+UNUSABLE_PASSWORD = '!'
+FIRST_NAMES = ('Ada', 'Alan', 'Barbara', 'Dennis', 'Edsger', 'Grace', 'John', 'Ken', 'Linus', 'Margaret')
+LAST_NAMES = ('Hopper', 'Knuth', 'Lamport', 'Liskov', 'Lovelace', 'Ritchie', 'Thompson', 'Turing')
+
+# the root tasks start up to HORIZON before or after the origin, so the
+# tasks are past, running or scheduled, and last up to MAX_DURATION.
+HORIZON = timedelta(days=90)
+MAX_DURATION = timedelta(days=30)
+
+
+def default_origin():
+    """
+    returns the start of the current day, the default origin of the
+    generated tasks, so the datasets of the same day are the same.
+    """
+
+    return datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def tree_random(seed, root_id):
+    """
+    returns the random generator of the tree with the given root task,
+    every tree has its own so a dataset can be generated again from any
+    of its root tasks.
+    """
+
+    return random.Random('{}:{}'.format(seed, root_id))
+
+
+def generate_tasks(total, owner_ids, shape='mixed', seed=0, origin=None, first_id=1):
+    """
+    yield the rows of total tasks, tuples of the COLUMNS, with the ids
+    from first_id, a tree at a time. the same arguments always generate
+    the same rows. the parent tasks come before their subtasks, which
+    start and end inside their parent task, so the spans of the parent
+    tasks don't need to be widened. the generation can be resumed from
+    the root task of any tree with first_id and the remaining total.
+    """
+
+    shape = SHAPES[shape]
+    owner_ids = list(owner_ids)
+    if origin is None:
+        origin = default_origin()
+
+    origin = int(origin.timestamp())
+    horizon = int(HORIZON.total_seconds())
+    max_duration = int(MAX_DURATION.total_seconds())
+    end_id = first_id + total
+    root_id = first_id
+
+    while root_id < end_id:
+        rng = tree_random(seed, root_id)
+        random_float = rng.random
+        budget = min(int(random_float() * shape.max_tree_size) + 1, end_id - root_id) - 1
+
+        start = origin + int(random_float() * (2 * horizon + 1)) - horizon
+        end = start + int(random_float() * (max_duration + 1))
+        pending = deque([(root_id, None, None, start, end, 0)])
+        next_id = root_id + 1
+
+        while pending:
+            task_id, parent_id, parent_path, start, end, depth = pending.popleft()
+            path = task_path(task_id, parent_path)
+            yield (
+                task_id, 'task {}'.format(task_id),
+                owner_ids[int(random_float() * len(owner_ids))], PRIORITIES[int(random_float() * 3)],
+                start, end, parent_id, (end - start).bit_length(), path,
+            )
+
+            if depth == shape.depth or not budget:
+                continue
+
+            subtasks = min(shape.min_subtasks + int(random_float() * (shape.max_subtasks - shape.min_subtasks + 1)), budget)
+            budget -= subtasks
+            for _ in range(subtasks):
+                sub_start = start + int(random_float() * (end - start + 1))
+                sub_end = sub_start + int(random_float() * (end - sub_start + 1))
+                pending.append((next_id, task_id, path, sub_start, sub_end, depth + 1))
+                next_id += 1
+
+        root_id = next_id
+
+
+def generate_users(total, first=0):
+    """
+    yield the rows of total users, tuples of the USER_COLUMNS, numbered
+    from first. the users can't log in, their password is unusable.
+    """
+
+    joined = int(default_origin().timestamp())
+    for i in range(first, first + total):
+        first_name = FIRST_NAMES[i % len(FIRST_NAMES)]
+        last_name = LAST_NAMES[i // len(FIRST_NAMES) % len(LAST_NAMES)]
+        username = USERNAME.format(i)
+        yield (
+            username, UNUSABLE_PASSWORD, first_name, last_name, '{}@example.com'.format(username),
+            False, False, True, joined,
+        )
+
+
+def insert_rows(model, columns, rows, datetime_columns=(), batch_size=10000):
+    """
+    insert rows of the given columns of a model with plain insert
+    statements, many rows per call, without model objects. the datetime
+    columns are given in seconds from the epoch. returns the number of
+    inserted rows.
+    """
+
+    qn = connection.ops.quote_name
+    placeholders = ["%s"] * len(columns)
+    positions = [columns.index(column) for column in datetime_columns]
+
+    if connection.vendor == 'sqlite' and connection.timezone_name == 'UTC':
+        # sqlite stores the datetimes as utc text, the seconds are
+        # converted by the insert, much faster than one at a time here.
+        for position in positions:
+            placeholders[position] = "datetime(%s, 'unixepoch')"
+        positions = []
+
+    def adapt(row):
+        row = list(row)
+        for position in positions:
+            row[position] = connection.ops.adapt_datetimefield_value(datetime.fromtimestamp(row[position], timezone.utc))
+        return row
+
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+        qn(model._meta.db_table),
+        ", ".join(qn(model._meta.get_field(column).column) for column in columns),
+        ", ".join(placeholders),
+    )
+
+    total = 0
+    batch = []
+    with connection.cursor() as cursor:
+        for row in rows:
+            batch.append(adapt(row) if positions else row)
+            if len(batch) == batch_size:
+                cursor.executemany(sql, batch)
+                total += len(batch)
+                batch = []
+
+        if batch:
+            cursor.executemany(sql, batch)
+            total += len(batch)
+
+    return total
+
+
+def insert_tasks(rows, batch_size=10000):
+    """
+    insert generated task rows. the status of the tasks is computed
+    when it's first needed. returns the number of inserted tasks.
+    """
+
+    Task = apps.get_model('tasks', 'Task')
+    return insert_rows(Task, COLUMNS, rows, datetime_columns=('start', 'end'), batch_size=batch_size)
+
+
+def insert_users(rows, batch_size=10000):
+    """
+    insert generated user rows. returns the number of inserted users.
+    """
+
+    User = apps.get_model('auth', 'User')
+    return insert_rows(User, USER_COLUMNS, rows, datetime_columns=('date_joined',), batch_size=batch_size)
+
+
+@contextmanager
+def indexes_dropped(model):
+    """
+    drop the indexes of the table of a model on sqlite and create them
+    again at the end, a bulk insert is many times faster without
+    updating them. meant to be used in a transaction, sqlite drops and
+    creates indexes in the transaction, so they're back if it fails.
+    other databases keep their indexes.
+    """
+
+    if connection.vendor != 'sqlite':
+        yield
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+            [model._meta.db_table],
+        )
+        indexes = cursor.fetchall()
+        for name, _ in indexes:
+            cursor.execute("DROP INDEX {}".format(connection.ops.quote_name(name)))
+
+    yield
+
+    with connection.cursor() as cursor:
+        for _, sql in indexes:
+            cursor.execute(sql)
@@ -0,0 +1,505 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, defaultdict
+from datetime import timezone
+from django.conf import settings
+from django.utils import timezone as django_timezone
+from django.utils.dateparse import parse_datetime
+from .status import COMPLETE, RUNNING, SCHEDULED, fetch_subtrees, rollup_status, subtasks_first
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger("task")
+
+# the index is built in every process and updated by the signals of the
+# tasks saved by that process. it's built again from the database when
+# it's older than this number of seconds, to get the changes made by
+# other processes. None keeps it forever.
+TIMELINE_MAX_AGE = getattr(settings, 'TASKS_TIMELINE_MAX_AGE', 5 * 60)
+
+
+# a timeline is a tuple (boundaries, statuses). boundaries is the sorted
+# list of the times the status can change and statuses the status of
+# every region between and on them: the open interval before the first
+# boundary, the first boundary itself, the open interval after it up to
+# the next boundary and so on, 2 * len(boundaries) + 1 statuses.
+
+def region(boundaries, as_of):
+    """
+    returns the index of the region of a timeline containing as_of.
+    """
+
+    i = bisect_left(boundaries, as_of)
+    if i < len(boundaries) and boundaries[i] == as_of:
+        return 2 * i + 1
+
+    return 2 * i
+
+
+def interval_status(start, end, lower, upper):
+    """
+    the status of a task without subtasks at any time strictly between
+    lower and upper, two consecutive boundaries of its timeline. None is
+    the start or the end of time. the same as leaf_status for any time
+    of the interval.
+    """
+
+    if upper is not None and start >= upper:
+        return SCHEDULED
+    elif lower is not None and end <= lower:
+        return COMPLETE
+    elif lower is not None and upper is not None and start <= lower and end >= upper:
+        return RUNNING
+
+
+def compact(boundaries, statuses):
+    """
+    remove the boundaries where the status doesn't change.
+    """
+
+    kept_boundaries = []
+    kept_statuses = [statuses[0]]
+    for i, boundary in enumerate(boundaries):
+        at, after = statuses[2 * i + 1], statuses[2 * i + 2]
+        if at == after == kept_statuses[-1]:
+            continue
+        kept_boundaries.append(boundary)
+        kept_statuses.extend((at, after))
+
+    return kept_boundaries, kept_statuses
+
+
+def leaf_timeline(start, end):
+    """
+    the timeline of a task without subtasks.
+    """
+
+    boundaries = sorted({start, end})
+    lowers = [None] + boundaries
+    uppers = boundaries + [None]
+
+    statuses = []
+    for lower, upper in zip(lowers, uppers):
+        statuses.append(interval_status(start, end, lower, upper))
+        if upper is not None:
+            # exactly on the start or end time there is no status.
+            statuses.append(None)
+
+    return compact(boundaries, statuses)
+
+
+def rollup_timeline(timelines):
+    """
+    takes the timelines of the subtasks and returns the timeline of the
+    parent task. the boundaries of the subtasks are swept in order while
+    the number of subtasks per status is updated, the status of every
+    region is rolled up from these numbers.
+    """
+
+    counts = Counter(statuses[0] for _, statuses in timelines)
+    changes = defaultdict(list)
+    for boundaries, statuses in timelines:
+        for i, boundary in enumerate(boundaries):
+            changes[boundary].append(statuses[2 * i:2 * i + 3])
+
+    boundaries = sorted(changes)
+    statuses = [rollup_status(+counts)]
+    for boundary in boundaries:
+        for before, at, _ in changes[boundary]:
+            counts[before] -= 1
+            counts[at] += 1
+        statuses.append(rollup_status(+counts))
+
+        for _, at, after in changes[boundary]:
+            counts[at] -= 1
+            counts[after] += 1
+        statuses.append(rollup_status(+counts))
+
+    return compact(boundaries, statuses)
+
+
+def parse_as_of(value, name='as_of'):
+    """
+    parse the as_of parameter of a request, or any other parameter with
+    the given name, an iso 8601 datetime. a datetime without timezone is
+    in the current timezone. raises ValueError if the value is not a 
+    datetime.
+    """
+
+    value = value.strip() if value else ''
+    # a + of the timezone offset is decoded as a space in a query string.
+    as_of = parse_datetime(value) or parse_datetime('+'.join(value.rsplit(' ', 1)))
+    if as_of is None:
+        raise ValueError("{} should be an iso 8601 datetime: {}".format(name, value))
+
+    if django_timezone.is_naive(as_of):
+        as_of = django_timezone.make_aware(as_of)
+
+    return as_of.astimezone(timezone.utc)
+
+
+class ChangeSums(object):
+    """
+    the sums of the changes of the number of tasks per status up to any
+    key, in the order of the keys. the keys known when it's built have a
+    position in a fenwick tree per status, so a change and a sum are
+    O(log n). the keys added later are kept in a sorted list and summed
+    one by one, it's built again once they're too many.
+    """
+
+    def __init__(self, changes):
+        """
+        build the trees from a dict with the changes, a Counter of the
+        change per status, by key, in O(n).
+        """
+
+        self.keys = sorted(changes)
+        self.positions = {key: i + 1 for i, key in enumerate(self.keys)}
+        self.pending = []
+        self.trees = {}
+
+        size = len(self.keys) + 1
+        for i, key in enumerate(self.keys, 1):
+            for status, change in changes[key].items():
+                self.trees.setdefault(status, [0] * size)[i] += change
+
+        for tree in self.trees.values():
+            for i in range(1, size):
+                parent = i + (i & -i)
+                if parent < size:
+                    tree[parent] += tree[i]
+
+    def is_full(self):
+        """
+        returns True if the keys added since the trees were built are
+        more than the square root of the keys in the trees.
+        """
+
+        return len(self.pending) > max(64, int(math.sqrt(len(self.keys))))
+
+    def add(self, key, status, change):
+        """
+        add a change of the number of tasks with the status at the key.
+        the change of a key added since the trees were built is read
+        from the changes of the index instead.
+        """
+
+        i = self.positions.get(key)
+        if i is None:
+            j = bisect_left(self.pending, key)
+            if j == len(self.pending) or self.pending[j] != key:
+                self.pending.insert(j, key)
+            return
+
+        tree = self.trees.setdefault(status, [0] * (len(self.keys) + 1))
+        while i < len(tree):
+            tree[i] += change
+            i += i & -i
+
+    def sum_to(self, key, changes):
+        """
+        returns a Counter of the sum of the changes per status of all
+        the keys up to the given one, included.
+        """
+
+        totals = Counter()
+        n = bisect_right(self.keys, key)
+        for status, tree in self.trees.items():
+            i, total = n, 0
+            while i > 0:
+                total += tree[i]
+                i -= i & -i
+            totals[status] += total
+
+        for pending in self.pending[:bisect_right(self.pending, key)]:
+            totals.update(changes.get(pending, ()))
+
+        return totals
+
+
+class TaskTimeline(object):
+    """
+    an in memory index of the status of every task at any time. every
+    task has its timeline, the ones of the tasks with subtasks rolled
+    up from the ones of their subtasks. the number of tasks per status
+    at any time is kept as the changes of these numbers at every
+    boundary, summed up by ChangeSums, updated with every change of a
+    timeline. both queries are O(log n).
+    """
+
+    def __init__(self, rows=()):
+        """
+        build the index from (id, parent_task_id, start, end) tuples of
+        complete trees.
+        """
+
+        self.lock = threading.RLock()
+        self.built_at = time.monotonic()
+        self.tasks = {}
+        self.children = defaultdict(set)
+        self.timelines = {}
+        self.base = Counter()
+        self.changes = defaultdict(Counter)
+        self.sums = None
+        # the ids of the tasks whose timeline changed since the index
+        # was built, taken by the live status stream.
+        self.changed_ids = None
+
+        for task_id, parent_id, start, end in rows:
+            self.tasks[task_id] = (parent_id, start, end)
+            self.children[parent_id].add(task_id)
+
+        parents = {task_id: parent_id for task_id, (parent_id, _, _) in self.tasks.items()}
+        for task_id in subtasks_first(parents, self.children):
+            self.set_timeline(task_id, self.compute_timeline(task_id))
+        self.changed_ids = set()
+
+        logger.debug("timeline of %s tasks built", len(self.tasks))
+
+    @classmethod
+    def from_database(cls):
+        """
+        build the index of all the tasks, read with one query.
+        """
+
+        return cls(fetch_subtrees())
+
+    def is_expired(self):
+        """
+        returns True if the index is older than TIMELINE_MAX_AGE.
+        """
+
+        return TIMELINE_MAX_AGE is not None and time.monotonic() - self.built_at > TIMELINE_MAX_AGE
+
+    def compute_timeline(self, task_id):
+        """
+        compute the timeline of a task from its own start and end or
+        from the timelines of its subtasks. on a cycle of parent tasks,
+        the subtask closing the cycle may not have a timeline yet.
+        """
+
+        subtasks = [sub for sub in self.children.get(task_id, ()) if sub in self.timelines]
+        if subtasks:
+            return rollup_timeline([self.timelines[sub] for sub in subtasks])
+
+        _, start, end = self.tasks[task_id]
+        return leaf_timeline(start, end)
+
+    def count_timeline(self, timeline, sign):
+        """
+        add (sign 1) or remove (sign -1) a task timeline to the changes
+        of the number of tasks per status. every boundary has two keys,
+        (boundary, 0) for the change on the boundary and (boundary, 1)
+        for the change after it.
+        """
+
+        boundaries, statuses = timeline
+        self.base[statuses[0]] += sign
+        for i, boundary in enumerate(boundaries):
+            before, at, after = statuses[2 * i:2 * i + 3]
+            for key, old, new in (((boundary, 0), before, at), ((boundary, 1), at, after)):
+                change = self.changes[key]
+                change[old] -= sign
+                change[new] += sign
+                if not any(change.values()):
+                    del self.changes[key]
+                if self.sums is not None:
+                    self.sums.add(key, old, -sign)
+                    self.sums.add(key, new, sign)
+
+        if self.sums is not None and self.sums.is_full():
+            # built again by the next count.
+            self.sums = None
+
+    def set_timeline(self, task_id, timeline):
+        """
+        replace the timeline of a task and its counts. returns False if
+        the timeline is unchanged.
+        """
+
+        old = self.timelines.get(task_id)
+        if old == timeline:
+            return False
+
+        if old is not None:
+            self.count_timeline(old, -1)
+        if timeline is None:
+            del self.timelines[task_id]
+        else:
+            self.timelines[task_id] = timeline
+            self.count_timeline(timeline, 1)
+
+        if self.changed_ids is not None:
+            self.changed_ids.add(task_id)
+
+        return True
+
+    def refresh_ancestors(self, task_id):
+        """
+        compute the timelines of the task and its parent tasks again,
+        until one of them doesn't change, or once around a cycle of
+        parent tasks.
+        """
+
+        seen = set()
+        while task_id in self.tasks and task_id not in seen:
+            seen.add(task_id)
+            if not self.set_timeline(task_id, self.compute_timeline(task_id)):
+                break
+            task_id = self.tasks[task_id][0]
+
+    def update_task(self, task_id, parent_id, start, end):
+        """
+        add or change a task. only the timelines of the task and of its
+        old and new parent tasks are computed again.
+        """
+
+        with self.lock:
+            old_parent_id = self.tasks[task_id][0] if task_id in self.tasks else None
+            if old_parent_id != parent_id:
+                self.children[old_parent_id].discard(task_id)
+            self.children[parent_id].add(task_id)
+            self.tasks[task_id] = (parent_id, start, end)
+
+            self.refresh_ancestors(task_id)
+            if old_parent_id != parent_id:
+                # the timeline of a moved task can be the same, its new
+                # and old parent tasks change anyway.
+                self.refresh_ancestors(parent_id)
+                self.refresh_ancestors(old_parent_id)
+
+    def remove_task(self, task_id):
+        """
+        remove a task, its parent tasks are computed again.
+        """
+
+        with self.lock:
+            if task_id not in self.tasks:
+                return
+
+            parent_id = self.tasks.pop(task_id)[0]
+            self.children[parent_id].discard(task_id)
+            self.set_timeline(task_id, None)
+            self.refresh_ancestors(parent_id)
+
+    def status_at(self, task_id, as_of):
+        """
+        returns the status of a task at the given time, or None if the
+        task is unknown.
+        """
+
+        with self.lock:
+            timeline = self.timelines.get(task_id)
+
+        if timeline is None:
+            return None
+
+        boundaries, statuses = timeline
+        return statuses[region(boundaries, as_of)]
+
+    def next_change(self, task_id, as_of):
+        """
+        returns the status of a task right after the given time and the
+        next boundary of its timeline after that time, when the status
+        changes again, or None. (None, None) if the task is unknown.
+        """
+
+        with self.lock:
+            timeline = self.timelines.get(task_id)
+        if timeline is None:
+            return None, None
+        boundaries, statuses = timeline
+        i = bisect_right(boundaries, as_of)
+        return statuses[2 * i], boundaries[i] if i < len(boundaries) else None
+
+    def take_changed_ids(self):
+        """
+        returns the ids of the tasks whose timeline changed since the
+        last call and forgets them.
+        """
+
+        with self.lock:
+            changed_ids, self.changed_ids = self.changed_ids, set()
+        return changed_ids
+
+    def counts_at(self, as_of):
+        """
+        returns a dict with the number of tasks per status at the given
+        time, like the total_status of the tasks summary.
+        """
+
+        with self.lock:
+            if self.sums is None:
+                self.sums = ChangeSums(self.changes)
+
+            # the changes on as_of and before, not the ones after it,
+            # the regions are the same as the ones of a timeline.
+            counts = Counter(self.base)
+            counts.update(self.sums.sum_to((as_of, 0), self.changes))
+
+        return dict(+counts)
+
+
+_timeline = None
+_timeline_lock = threading.Lock()
+
+
+def get_timeline():
+    """
+    returns the timeline index of this process, built from the database
+    the first time and when it's expired.
+    """
+
+    global _timeline
+
+    with _timeline_lock:
+        if _timeline is None or _timeline.is_expired():
+            _timeline = TaskTimeline.from_database()
+
+        return _timeline
+
+
+def reset_timeline():
+    """
+    drop the timeline index, it's built again when it's needed.
+    """
+
+    global _timeline
+
+    with _timeline_lock:
+        _timeline = None
+
+
+def update_timeline(task_id, parent_task_id, start, end):
+    """
+    update the timeline index, if it's built, after a task is saved.
+    """
+
+    if _timeline is not None:
+        _timeline.update_task(task_id, parent_task_id, start, end)
+
+
+def remove_from_timeline(task_id):
+    """
+    update the timeline index, if it's built, after a task is deleted.
+    """
+
+    if _timeline is not None:
+        _timeline.remove_task(task_id)
+
+
+def status_at(task_id, as_of):
+    """
+    returns the status of a task at the given time.
+    """
+
+    return get_timeline().status_at(task_id, as_of)
+
+
+def counts_at(as_of):
+    """
+    returns the number of tasks per status at the given time.
+    """
+
+    return get_timeline().counts_at(as_of)
@@ -0,0 +1,118 @@
+from contextlib import ExitStack, contextmanager
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+import threading
+import time
+
+# the timings of the request handled by the current thread.
+_local = threading.local()
+
+
+class RequestTimings:
+    """
+    the number of queries and the seconds spent in the database and in
+    rendering templates while handling a request.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.rendering = 0
+
+    def record_query(self, execute, sql, params, many, context):
+        """
+        execute wrapper of the database connections, counts and times
+        every query.
+        """
+
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def view(self):
+        """
+        the seconds spent in the python code, without the database and
+        the templates.
+        """
+
+        return max(self.total - self.db - self.template, 0.0)
+
+
+def current_timings():
+    """
+    returns the timings of the request of the current thread, None
+    outside of record_timings.
+    """
+
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def record_timings():
+    """
+    record the queries of all the database connections and the template
+    rendering of the current thread in the block.
+    """
+
+    timings = RequestTimings()
+    previous = current_timings()
+    _local.timings = timings
+
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timings.record_query))
+            yield timings
+    finally:
+        _local.timings = previous
+
+
+class TimedTemplate:
+    """
+    a template of the django backend adding its rendering time to the
+    timings of the current request. the templates rendered by another
+    template aren't added twice.
+    """
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        timings = current_timings()
+        if timings is None:
+            return self.template.render(context, request)
+
+        started = time.perf_counter()
+        timings.rendering += 1
+        try:
+            return self.template.render(context, request)
+        finally:
+            timings.rendering -= 1
+            if not timings.rendering:
+                timings.template += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    the django template backend with timed templates, set as BACKEND of
+    the TEMPLATES setting.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
@@ -6,4 +6,8 @@ urlpatterns = [
     path('', views.index, name='index'), 
     path('alltasks/', views.TasksListView.as_view(), name='tasks'),
     url(r'^task/(?P<pk>[0-9]+)/$', views.TaskDetailsView.as_view(), name=views.TaskDetailsView.name),
+    url(r'^task/$', views.TaskDetailsListView.as_view(), name=views.TaskDetailsListView.name),
+    path('api/tasks/', views.task_list_api, name='task-list-api'),
+    path('api/tasks/active/', views.active_task_list_api, name='task-list-active-api'),
+    path('api/tasks/events/', views.task_status_events, name='task-status-events'),
 ]
@@ -1,59 +1,353 @@
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.template import loader
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET
+from .cache import get_index_summary, get_task_details, render_task_rows, set_task_details
+from .encoders import stream_json_array
+from .live import status_events
+from .metrics import render_metrics
 from .models import Task
-from .serializers import TaskDetailSerializer
+from .serializers import TaskDetailListSerializer, TaskDetailSerializer
+from .pagination import KeysetPage
+from .routers import reads_from_replica
+from .status import MAX_IDS_PER_QUERY, prime_statuses
+from .timeline import counts_at, get_timeline, parse_as_of, status_at
 from django.views import generic
 from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 import logging
 
 logger = logging.getLogger('tasks')
 
+# the number of tasks read and encoded at once by the task list api.
+TASK_LIST_CHUNK_SIZE = 2000
+
+# the keys of the tasks returned by the task list api.
+TASK_LIST_FIELDS = ('id', 'name', 'priority', 'start', 'end', 'parent_task', 'first_name', 'last_name')
+
+@reads_from_replica
 def index(request):
     """ 
     render the index page which can contain any info needed. In this 
     case I added a summary of the tasks stored to the context to be
-    rendered in the index.html page.
+    rendered in the index.html page. the summary is computed only with
+    aggregates in the database, no task is loaded, and cached until the
+    next start or end of a task. with ?as_of=<iso datetime> the statuses
+    are counted at that time, past or future, from the timeline index.
     """
 
     logger.debug("index view started")
-    total_tasks = Task.objects.count()
-    total_subtasks = Task.objects.filter(parent_task__isnull=True).count()
-    tasks = Task.objects.all()
-    task_status = [task.status for task in tasks]
-    total_status = {k:task_status.count(k) for k in task_status}
-    task_durations = sorted([task.duration for task in tasks])
-    
-    context = {
-        'total_tasks' : total_tasks,
-        'total_subtasks': total_subtasks,
-        'total_status': total_status,
-        'durations': task_durations,
-    }
+    context = get_index_summary()
+
+    if request.GET.get('as_of'):
+        try:
+            as_of = parse_as_of(request.GET['as_of'])
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+
+        context = dict(context, total_status=counts_at(as_of), as_of=as_of)
 
     return render(request, 'index.html', context=context)
 
 
+def metrics(request):
+    """
+    the metrics of the requests, the caches and the tasks in the
+    prometheus text format, to be scraped.
+    """
+
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def task_rows(queryset):
+    """
+    returns the tasks of the queryset with their owner's first and last
+    name as dicts. the rows are read as tuples from one query joined 
+    with the users, a chunk at a time, without model objects.
+    """
+
+    rows = queryset.values_list(
+        'id', 'name', 'priority', 'start', 'end', 'parent_task_id',
+        'owner__first_name', 'owner__last_name',
+    ).iterator(chunk_size=TASK_LIST_CHUNK_SIZE)
+
+    return (dict(zip(TASK_LIST_FIELDS, row)) for row in rows)
+
+
+def task_list_response(tasks):
+    """
+    stream the task dicts as a json array.
+    """
+
+    return StreamingHttpResponse(
+        stream_json_array(tasks, chunk_size=TASK_LIST_CHUNK_SIZE),
+        content_type='application/json',
+    )
+
+
+@reads_from_replica
+@require_GET
+def task_list_api(request):
+    """
+    returns all the tasks with their owner's first and last name as a
+    json array. the tasks are encoded without serializer objects, so 
+    the encoding doesn't dominate the response time. with 
+    ?as_of=<iso datetime> every task has its status at that time.
+    """
+
+    tasks = task_rows(Task.objects.order_by('id'))
+
+    if request.GET.get('as_of'):
+        try:
+            as_of = parse_as_of(request.GET['as_of'])
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e), content_type='text/plain')
+
+        timeline = get_timeline()
+        tasks = (dict(task, status=timeline.status_at(task['id'], as_of)) for task in tasks)
+
+    logger.debug("task list api requested")
+
+    return task_list_response(tasks)
+
+
+@reads_from_replica
+@require_GET
+def active_task_list_api(request):
+    """
+    returns the tasks active at any time of a window, the tasks which
+    start before its end and end after its start, as a json array like
+    the task list api, ordered by start. the window is given as
+    ?start=<iso datetime>&end=<iso datetime> .
+    """
+
+    try:
+        start = parse_as_of(request.GET.get('start'), name='start')
+        end = parse_as_of(request.GET.get('end'), name='end')
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e), content_type='text/plain')
+
+    if end < start:
+        return HttpResponseBadRequest("the end of the window is before its start", content_type='text/plain')
+
+    logger.debug("tasks active between %s and %s requested", start, end)
+
+    return task_list_response(task_rows(Task.objects.active_between(start, end).order_by('start', 'id')))
+
+
+@require_GET
+def task_status_events(request):
+    """
+    a server-sent events stream pushing the changes of the status of the
+    tasks when they happen, the starts and ends of the tasks, the rolled
+    up changes of their parent tasks and the saved tasks. to follow some
+    tasks only, give their ids: ?ids=1,2,3 . open it in the browser with
+    new EventSource('/tasks/api/tasks/events/').
+    """
+
+    task_ids = None
+    if request.GET.get('ids'):
+        try:
+            task_ids = {int(task_id) for task_id in request.GET['ids'].split(',') if task_id}
+        except ValueError:
+            return HttpResponseBadRequest("the ids should be a comma separated list of numbers", content_type='text/plain')
+
+    logger.debug("status events requested")
+
+    response = StreamingHttpResponse(
+        status_events(request.META.get('HTTP_LAST_EVENT_ID'), task_ids),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # nginx would buffer the events.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 class TaskDetailsView(generics.RetrieveAPIView):
     """ 
     use the RetrieveAPIView to allow only the get request. it will
-    use a custom serializer to get only the values needed.
+    use a custom serializer to get only the values needed. the
+    serialized details are cached until the task or its owner change,
+    and are sent with an etag and a last modified date, so the clients
+    polling a task get back 304 not modified without a query. with
+    ?as_of=<iso datetime> the status of the task at that time is added,
+    these responses are not conditional.
     """
 
     logger.debug("view request")
-    queryset = Task.objects.all()
+    queryset = Task.objects.select_related('owner')
     serializer_class = TaskDetailSerializer
+    reads_from_replica = True
 
     name = 'task-details'
 
+    def retrieve(self, request, *args, **kwargs):
+        """
+        return the cached details of the task, fetch and cache them if
+        they are not cached. answer the conditional requests.
+        """
+
+        task_id = int(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        details = get_task_details(task_id)
+        if details is None:
+            task = self.get_object()
+            details = set_task_details(task, self.get_serializer(task).data)
+            logger.debug("details of task %s cached", task.id)
+
+        if request.query_params.get('as_of'):
+            try:
+                as_of = parse_as_of(request.query_params['as_of'])
+            except ValueError as e:
+                raise ValidationError({'as_of': str(e)})
+
+            return Response(dict(details['data'], status=status_at(task_id, as_of)))
+
+        response = get_conditional_response(
+            request,
+            etag=details['etag'],
+            last_modified=details['last_modified'],
+        )
+        if response is None:
+            response = Response(details['data'])
+
+        response['ETag'] = details['etag']
+        response['Last-Modified'] = http_date(details['last_modified'])
+
+        return response
+
+
+class TaskDetailsListView(generics.ListAPIView):
+    """ 
+    returns the details of many tasks at once, the ids are given as
+    comma separated list: /tasks/task/?ids=1,2,3 . the tasks and their
+    owners are fetched with one query.
+    """
+
+    queryset = Task.objects.select_related('owner')
+    serializer_class = TaskDetailListSerializer
+    max_ids = MAX_IDS_PER_QUERY
+    reads_from_replica = True
+
+    name = 'task-details-list'
+
+    def get_queryset(self):
+        """
+        filter the tasks on the requested ids.
+        """
+
+        try:
+            ids = {int(task_id) for task_id in self.request.query_params.get('ids', '').split(',') if task_id}
+        except ValueError:
+            raise ValidationError({'ids': 'the ids should be a comma separated list of numbers'})
+
+        if not ids:
+            raise ValidationError({'ids': 'no ids given'})
+
+        if len(ids) > self.max_ids:
+            raise ValidationError({'ids': 'at most {} ids are allowed'.format(self.max_ids)})
+
+        logger.debug("details of %s tasks requested", len(ids))
+        return super().get_queryset().filter(id__in=ids)
+
 
 class TasksListView(generic.ListView):
     """ 
     using the generics ListView which supports only GET requests.
-    list all the tasks. 
+    list the tasks a page at a time, ordered by start and id. the 
+    pages are requested with the after or before cursor of the 
+    next or previous page. with ?stream=1 all the tasks are streamed
+    on one page.
     """
 
     model = Task
     context_object_name = 'tasks_list'
     queryset = Task.objects.all()
     template_name = 'tasks.html'
+    rows_template_name = 'task_rows.html'
+    row_template_name = 'task_row.html'
+    page_size = 50
+    stream_chunk_size = 500
+    reads_from_replica = True
+
+    def get(self, request, *args, **kwargs):
+        """
+        stream all the tasks if requested, otherwise render a page.
+        """
+
+        if request.GET.get('stream'):
+            response = StreamingHttpResponse(self.stream_tasks())
+            response['Content-Type'] = 'text/html; charset=utf-8'
+            return response
+
+        return super().get(request, *args, **kwargs)
+
+    def stream_tasks(self):
+        """
+        render the page around the rows first, then the rows a chunk of 
+        tasks at a time, read with a server side cursor. only one chunk
+        of tasks is kept in memory. the statuses of the chunk are 
+        computed at once but not stored, a streamed page doesn't write.
+        the unchanged rows are read from the cache.
+        """
+
+        placeholder = '<!-- rows -->'
+        page = loader.render_to_string(
+            self.template_name,
+            {'streaming': True, 'rows_placeholder': placeholder},
+            request=self.request,
+        )
+        head, tail = page.split(placeholder, 1)
+        yield head
+
+        rows_template = loader.get_template(self.rows_template_name)
+        chunk = []
+        for task in self.queryset.order_by('start', 'id').iterator(chunk_size=self.stream_chunk_size):
+            chunk.append(task)
+            if len(chunk) == self.stream_chunk_size:
+                yield rows_template.render({'task_rows': self.render_rows(prime_statuses(chunk, store=False))})
+                chunk = []
+
+        if chunk:
+            yield rows_template.render({'task_rows': self.render_rows(prime_statuses(chunk, store=False))})
+
+        yield tail
+
+    def render_rows(self, tasks):
+        """
+        returns the html rows of the tasks with primed statuses.
+        """
+
+        return render_task_rows(tasks, template_name=self.row_template_name)
+
+    def get_queryset(self):
+        """
+        fetch only the tasks of the requested page.
+        """
+
+        self.page = KeysetPage.from_queryset(
+            super().get_queryset(),
+            self.page_size,
+            after=self.request.GET.get('after'),
+            before=self.request.GET.get('before'),
+        )
+
+        return self.page.object_list
+
+    def get_context_data(self, **kwargs):
+        """
+        make sure the stored status of all the listed tasks is valid,
+        the expired ones are computed at once, so the template doesn't
+        query per task. add the rows of the tasks, the unchanged ones
+        from the cache, and the cursors of the next and previous page.
+        """
+
+        context = super().get_context_data(**kwargs)
+        context['task_rows'] = self.render_rows(prime_statuses(context['tasks_list']))
+        context['next_cursor'] = self.page.next_cursor
+        context['previous_cursor'] = self.page.previous_cursor
 
+        return context
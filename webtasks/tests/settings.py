@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tasks.middleware.ServerTimingMiddleware',
+    'tasks.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -49,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'tasks.middleware.ReadReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'webtasks.urls'
@@ -62,10 +65,18 @@ LOGGING = {
             'datefmt': "%d/%b/%Y %H:%M:%S"
         },
     },
+    'filters': {
+        'sampled': {
+            '()': 'tasks.log.SampledFilter',
+            'rate': 1.0,
+        },
+    },
     'handlers': {
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.handlers.RotatingFileHandler',
+            # written from a thread of its own, see tasks/log.py.
+            '()': 'tasks.log.QueuedHandler',
+            'handler_class': 'logging.handlers.RotatingFileHandler',
             'filename': os.path.join(BASE_DIR,'logs/test.log'),
             'formatter': 'standard',
         },
@@ -81,6 +92,12 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        # the debug records of the code run for every task, sampled.
+        'task.hot': {
+            'filters': ['sampled'],
+            'level': 'DEBUG',
+            'propagate': True,
+        },
         'views': {
             'handlers': ['file'],
             'level': 'DEBUG',
@@ -103,7 +120,7 @@ LOGGING = {
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'tasks.timing.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -127,6 +144,29 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'tasks.sqlite3'),
+    },
+    # the same database, set as replica by the tests of the routing.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'tasks.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['tasks.routers.ReadReplicaRouter']
+TASKS_READ_REPLICAS = []
+
+
+# Cache
+# the cached task details are invalidated by signals of the process
+# saving the tasks, with more than one process the cache must be
+# shared between them, memcached for example.
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'webtasks',
     }
 }
 
@@ -0,0 +1,172 @@
+from django.test import SimpleTestCase
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.test.utils import override_settings
+from tasks.assets import CompressedManifestStaticFilesStorage
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger("views")
+STATIC_PATH = 'http://127.0.0.1:8001/static/'
+STORAGE = 'tasks.assets.CompressedManifestStaticFilesStorage'
+
+
+class StaticAssetsTest(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        collect the static files to a temporary directory, hashed and
+        compressed.
+        """
+
+        logger.debug("setup {} started".format(cls.__name__))
+
+        cls.static_root = tempfile.mkdtemp()
+        with override_settings(STATIC_ROOT=cls.static_root, STATICFILES_STORAGE=STORAGE):
+            call_command('collectstatic', interactive=False, verbosity=0, stdout=io.StringIO())
+
+        with open(os.path.join(cls.static_root, 'staticfiles.json')) as f:
+            cls.hashed_name = json.load(f)['paths']['css/simple-sidebar.css']
+        with open(os.path.join(cls.static_root, 'css', 'simple-sidebar.css'), 'rb') as f:
+            cls.content = f.read()
+
+
+    def setUp(self):
+        overridden = self.settings(STATIC_ROOT=self.static_root, STATICFILES_STORAGE=STORAGE)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+
+    def get(self, name, **headers):
+        response = self.client.get(STATIC_PATH + name, **headers)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, content
+
+
+    def test_collected_files_compressed(self):
+        """
+        expect the hashed file of the manifest and its gzip copy with the
+        same content.
+        """
+
+        self.assertRegex(self.hashed_name, r'^css/simple-sidebar\.[0-9a-f]{12}\.css$')
+        self.assertEquals(staticfiles_storage.url('css/simple-sidebar.css'), '/static/' + self.hashed_name)
+
+        with open(os.path.join(self.static_root, self.hashed_name + '.gz'), 'rb') as f:
+            self.assertEquals(gzip.decompress(f.read()), self.content)
+
+
+    def test_plain_names_without_manifest(self):
+        """
+        expect the plain names of the files, served, before collectstatic
+        has written the manifest.
+        """
+
+        with self.settings(DEBUG=False, STATIC_ROOT=os.path.join(os.path.dirname(self.static_root), 'missing')):
+            storage = CompressedManifestStaticFilesStorage()
+            self.assertEquals(storage.url('css/simple-sidebar.css'), '/static/css/simple-sidebar.css')
+
+        response, content = self.get('css/simple-sidebar.css')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(content, self.content)
+
+
+    def test_serve_hashed_file_compressed(self):
+        """
+        request a hashed file accepting gzip and expect its compressed
+        copy, cached for a year without asking again.
+        """
+
+        response, content = self.get(self.hashed_name, HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Content-Type'], 'text/css')
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+        self.assertEquals(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEquals(response['Vary'], 'Accept-Encoding')
+        self.assertEquals(int(response['Content-Length']), len(content))
+        self.assertEquals(gzip.decompress(content), self.content)
+
+        response, content = self.get(self.hashed_name, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEquals(content, self.content)
+
+
+    def test_serve_file_not_hashed(self):
+        """
+        request a file by its name without hash and expect it to be
+        revalidated soon, then not modified with its etag.
+        """
+
+        response, content = self.get('css/simple-sidebar.css')
+
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Cache-Control'], 'public, max-age=60')
+        self.assertEquals(content, self.content)
+
+        response, content = self.get('css/simple-sidebar.css', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(content, b'')
+
+
+    def test_serve_range(self):
+        """
+        request parts of a file and expect only these bytes, a range
+        outside the file is not satisfiable.
+        """
+
+        response, content = self.get(self.hashed_name, HTTP_RANGE='bytes=10-19', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEquals(response.status_code, 206)
+        self.assertEquals(response['Content-Range'], 'bytes 10-19/{}'.format(len(self.content)))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEquals(content, self.content[10:20])
+
+        response, content = self.get(self.hashed_name, HTTP_RANGE='bytes=-5')
+        self.assertEquals(response.status_code, 206)
+        self.assertEquals(content, self.content[-5:])
+
+        response, content = self.get(self.hashed_name, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"other"')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(content, self.content)
+
+        response, _ = self.get(self.hashed_name, HTTP_RANGE='bytes={}-'.format(len(self.content)))
+        self.assertEquals(response.status_code, 416)
+        self.assertEquals(response['Content-Range'], 'bytes */{}'.format(len(self.content)))
+
+
+    def test_serve_accel_redirect(self):
+        """
+        with an internal nginx location expect the file sent by nginx.
+        """
+
+        with self.settings(TASKS_STATIC_ACCEL_REDIRECT='/internal-static/'):
+            response, content = self.get(self.hashed_name, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEquals(response['X-Accel-Redirect'], '/internal-static/' + self.hashed_name + '.gz')
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+        self.assertEquals(content, b'')
+
+
+    def test_serve_outside_404(self):
+        """
+        request files outside of the static files and expect not found.
+        """
+
+        self.assertEquals(self.get('../settings.py')[0].status_code, 404)
+        self.assertEquals(self.get('css/missing.css')[0].status_code, 404)
+
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        remove the collected static files.
+        """
+
+        logger.debug("tearDownClass {}".format(cls.__name__))
+        shutil.rmtree(cls.static_root)
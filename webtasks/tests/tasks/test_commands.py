@@ -0,0 +1,189 @@
+from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from tasks.management.commands.benchmark_tasks import Command as BenchmarkCommand
+from django.contrib.auth.models import User
+from tasks.models import Task, span_level
+from tasks.status import subtree_statuses
+from collections import Counter
+from datetime import datetime, timezone
+from io import StringIO
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger("task")
+
+
+class ImportTasksTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        create the owner of the imported tasks and a directory for the
+        files to import.
+        """
+
+        logger.debug("setup {} started".format(cls.__name__))
+
+        User.objects.create_user(
+            first_name="foo1",
+            last_name="bar1",
+            email="foobar@bla.com",
+            username="fooobaar1234")
+
+        cls.directory = tempfile.TemporaryDirectory()
+
+
+    def write_file(self, name, content):
+        """ write a file to import and return its path """
+
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+
+        return path
+
+
+    def test_import_csv_and_jsonl(self):
+        """
+        import a csv and a jsonl file where subtasks come before and
+        after their parent task, and expect the spans of all the parent
+        tasks to be widened to the spans of their subtasks.
+        """
+
+        csv_path = self.write_file('tasks.csv', "\n".join([
+            "id,name,owner,priority,start,end,parent",
+            "b,task b,fooobaar1234,H,2019-07-02T00:00:00Z,2019-07-03T00:00:00Z,a",
+            "a,task a,fooobaar1234,L,2019-07-02T00:00:00Z,2019-07-02T12:00:00Z,",
+        ]))
+        jsonl_path = self.write_file('tasks.jsonl', "\n".join(json.dumps(row) for row in [
+            {'id': 'c', 'name': 'task c', 'owner': 'fooobaar1234', 'start': '2019-07-01T00:00:00Z', 'end': '2019-07-02T06:00:00Z', 'parent': 'b'},
+            {'name': 'task d', 'owner': 'fooobaar1234', 'start': '2019-07-05T00:00:00Z', 'end': '2019-07-06T00:00:00Z', 'parent': 'c'},
+        ]))
+
+        out = StringIO()
+        call_command('import_tasks', csv_path, jsonl_path, batch_size=1, stdout=out)
+        logger.debug("import output: {}".format(out.getvalue()))
+
+        tasks = {task.name: task for task in Task.objects.all()}
+        self.assertEquals(len(tasks), 4)
+        self.assertEquals(tasks['task b'].parent_task_id, tasks['task a'].id)
+        self.assertEquals(tasks['task d'].parent_task_id, tasks['task c'].id)
+
+        for name in ('task a', 'task b', 'task c'):
+            self.assertEquals(tasks[name].start, datetime(2019, 7, 1, tzinfo=timezone.utc))
+            self.assertEquals(tasks[name].end, datetime(2019, 7, 6, tzinfo=timezone.utc))
+
+        for task in tasks.values():
+            self.assertEquals(task.span_level, span_level(task.start, task.end))
+        self.assertEquals(tasks['task a'].status, 'Complete')
+
+        # the statuses are stored by the import, the summary counts them.
+        self.assertFalse(Task.objects.filter(rollup_status__isnull=True).exists())
+        self.assertEquals(Task.objects.summary()['total_status'], dict(Counter(subtree_statuses().values())))
+
+
+    def test_import_invalid_rows(self):
+        """
+        import files with an unknown owner, a missing parent and a cycle
+        of parents, expect an error and no task imported.
+        """
+
+        header = "id,name,owner,priority,start,end,parent\n"
+        files = [
+            header + "a,task a,nobody,L,2019-07-01T00:00:00Z,2019-07-02T00:00:00Z,\n",
+            header + "a,task a,fooobaar1234,L,2019-07-01T00:00:00Z,2019-07-02T00:00:00Z,z\n",
+            header + "a,task a,fooobaar1234,L,2019-07-01T00:00:00Z,2019-07-02T00:00:00Z,b\n"
+                     "b,task b,fooobaar1234,L,2019-07-01T00:00:00Z,2019-07-02T00:00:00Z,a\n",
+        ]
+
+        for content in files:
+            with self.assertRaises(CommandError):
+                call_command('import_tasks', self.write_file('invalid.csv', content), stdout=StringIO())
+
+        self.assertEquals(Task.objects.count(), 0)
+
+
+    @classmethod
+    def tearDownClass(cls):
+        """ delete all objects created """
+
+        cls.directory.cleanup()
+        Task.objects.all().delete()
+        User.objects.all().delete()
+        logger.debug("tearDownClass {}".format(cls.__name__))
+
+
+class BenchmarkTasksTest(TestCase):
+
+    def test_run_dataset(self):
+        """
+        measure a small generated dataset and expect the results of all
+        the targets.
+        """
+
+        result = BenchmarkCommand(stdout=StringIO(), stderr=StringIO()).run_dataset(200, 'wide', seed=1, repeat=3)
+
+        self.assertEquals(result['size'], 200)
+        self.assertEquals(Task.objects.filter(name__startswith='task ').count(), 200)
+        self.assertEquals([target['target'] for target in result['targets']], ['index', 'task_list', 'task_details', 'task_save'])
+        for target in result['targets']:
+            self.assertTrue(0 < target['p50_ms'] <= target['p90_ms'] <= target['max_ms'])
+            self.assertTrue(target['max_queries'] >= 1)
+
+
+    def test_repeat_zero(self):
+        """
+        run the benchmark without any measured call and expect an error
+        before any dataset is generated.
+        """
+
+        with self.assertRaises(CommandError):
+            call_command('benchmark_tasks', repeat=0, stdout=StringIO())
+
+
+
+class SeedTasksTest(TestCase):
+
+    def seed(self, **options):
+        """ run the seed_tasks command with a fixed origin """
+
+        call_command('seed_tasks', tasks=300, users=5, origin='2019-08-01T00:00:00Z', seed=2,
+            stdout=StringIO(), stderr=StringIO(), **options)
+
+        return list(Task.objects.order_by('id').values_list('id', 'name', 'owner__username', 'priority', 'start', 'end', 'parent_task_id', 'path'))
+
+
+    def test_seed_and_resume(self):
+        """
+        seed the tasks in small transactions, delete the last ones like
+        an interrupted run and seed again, expect the same tasks.
+        """
+
+        tasks = self.seed(commit_every=100)
+
+        self.assertEquals(len(tasks), 300)
+        self.assertEquals(User.objects.filter(username__startswith='seed').count(), 5)
+        self.assertEquals({task[3] for task in tasks}, {'L', 'M', 'H'})
+        self.assertEquals(Task.objects.filter(span_level__isnull=True).count(), 0)
+        self.assertEquals(Task.objects.filter(rollup_status__isnull=True).count(), 0)
+        self.assertEquals(Task.objects.summary()['total_status'], dict(Counter(subtree_statuses().values())))
+
+        Task.objects.filter(id__gt=250).delete()
+        self.assertEquals(self.seed(), tasks)
+        self.assertEquals(User.objects.count(), 5)
+
+
+    def test_seed_over_other_tasks(self):
+        """
+        seed tasks where a task not seeded has the first id and expect
+        an error.
+        """
+
+        owner = User.objects.create_user(username="fooobaar1234")
+        Task.objects.create(id=1, name="task a", owner=owner, start=datetime(2019, 7, 1, tzinfo=timezone.utc), end=datetime(2019, 7, 2, tzinfo=timezone.utc))
+
+        with self.assertRaises(CommandError):
+            self.seed()
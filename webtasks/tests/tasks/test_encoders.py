@@ -0,0 +1,48 @@
+from django.test import SimpleTestCase
+from tasks import encoders
+from datetime import datetime, timezone
+from unittest import mock
+import json
+import logging
+
+logger = logging.getLogger("views")
+
+
+class StreamJsonArrayTest(SimpleTestCase):
+
+    def test_stream_json_array_chunks(self):
+        """ 
+        encode more items than the chunk size and expect one valid json
+        array with all the items.
+        """
+
+        items = [{'id': i, 'start': datetime(2019, 7, 24, i, tzinfo=timezone.utc)} for i in range(5)]
+        chunks = list(encoders.stream_json_array(items, chunk_size=2))
+        content = json.loads(b''.join(chunks))
+
+        logger.debug("chunks: {}".format(chunks))
+
+        self.assertEquals(len(chunks), 5)
+        self.assertEquals([item['id'] for item in content], [0, 1, 2, 3, 4])
+        self.assertEquals(content[1]['start'], '2019-07-24T01:00:00Z')
+
+
+    def test_stream_json_array_without_orjson(self):
+        """ 
+        without orjson the standard json module encodes the same json.
+        """
+
+        items = [{'id': 1, 'start': datetime(2019, 7, 24, 1, tzinfo=timezone.utc)}]
+
+        with mock.patch.object(encoders, 'orjson', None):
+            content = b''.join(encoders.stream_json_array(items))
+
+        self.assertEquals(content, b'[{"id":1,"start":"2019-07-24T01:00:00Z"}]')
+
+
+    def test_stream_json_array_empty(self):
+        """ 
+        no items is an empty json array.
+        """
+
+        self.assertEquals(b''.join(encoders.stream_json_array([])), b'[]')
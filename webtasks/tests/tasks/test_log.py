@@ -0,0 +1,85 @@
+from django.test import SimpleTestCase
+from tasks.log import QueuedHandler, SampledFilter
+import io
+import logging
+import threading
+
+
+class QueuedHandlerTest(SimpleTestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = QueuedHandler('logging.StreamHandler', queue_size=2, stream=self.stream)
+        self.handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        self.addCleanup(self.handler.close)
+
+        self.logger = logging.Logger("test.queued")
+        self.logger.addHandler(self.handler)
+
+
+    def test_records_written_by_another_thread(self):
+        """
+        log a record with a list argument changed right after, expect it
+        written with the list as it was and from the thread of the queue.
+        """
+
+        threads = []
+        self.handler.handler.addFilter(lambda record: threads.append(threading.current_thread()) or True)
+
+        items = [1]
+        self.logger.warning("items: %s", items)
+        items.append(2)
+        self.handler.flush()
+
+        self.assertEquals(self.stream.getvalue(), "WARNING items: [1]\n")
+        self.assertEquals(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.current_thread())
+
+
+    def test_records_dropped_when_full(self):
+        """
+        fill the queue while the writing handler is stuck on a slow disk
+        and expect the next records dropped, then their number logged.
+        """
+
+        writing, disk = threading.Event(), threading.Event()
+        self.handler.handler.addFilter(lambda record: writing.set() or disk.wait(5))
+
+        self.logger.warning("record 0")
+        self.assertTrue(writing.wait(5))
+        for i in range(1, 5):
+            self.logger.warning("record %s", i)
+        self.assertEquals(self.handler.dropped, 2)
+
+        disk.set()
+        self.handler.flush()
+        self.logger.warning("record 5")
+        self.handler.flush()
+
+        self.assertEquals(self.stream.getvalue().splitlines(), [
+            "WARNING record 0",
+            "WARNING record 1",
+            "WARNING record 2",
+            "WARNING 2 log records dropped, the log queue was full",
+            "WARNING record 5",
+        ])
+
+
+class SampledFilterTest(SimpleTestCase):
+
+    def test_sampled_debug_records(self):
+        """
+        expect the debug records kept at the rate of the filter and the
+        records of a higher level all kept.
+        """
+
+        debug = logging.makeLogRecord({'levelno': logging.DEBUG})
+        info = logging.makeLogRecord({'levelno': logging.INFO})
+
+        self.assertFalse(SampledFilter(rate=0).filter(debug))
+        self.assertTrue(SampledFilter(rate=0).filter(info))
+        self.assertTrue(SampledFilter(rate=1).filter(debug))
+        self.assertFalse(SampledFilter(rate=0, level='INFO').filter(info))
+
+        kept = sum(SampledFilter(rate=0.5).filter(debug) for _ in range(1000))
+        self.assertTrue(350 < kept < 650)
@@ -1,9 +1,20 @@
 from django.test import TestCase
-from tasks.models import Task
+from tasks.models import Task, span_level
+from tasks.cache import get_index_summary, get_task_details, invalidate_index_summary, set_task_details
+from tasks.spans import deferred_span_updates, widen_parent_spans
+from tasks.status import fetch_subtrees, refresh_ancestor_statuses, subtree_statuses
+from tasks.timeline import TaskTimeline, get_timeline, reset_timeline
+from tests.tasks.utils import run_commit_hooks
 from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from collections import Counter
 from datetime import datetime, timedelta, timezone
 from django.utils.timezone import utc
+from unittest import mock
 import logging
+import sys
 
 
 logger = logging.getLogger("task")
@@ -312,7 +323,664 @@ class TaskTest(TestCase):
         
         self.assertEquals(task_f.start, subtasks_f[0].start)
         self.assertEquals(task_f.end, subtasks_f[1].end)
-        
+
+
+    def test_save_widens_all_parent_tasks(self):
+        """
+        save a subtask of a subtask ending later than all the tasks and
+        expect its parent task and the parent of its parent task to end
+        at the same time, the start of the parents doesn't change.
+        """
+
+        task_e = Task.objects.get(pk=5)
+        subtask_e = Task.objects.filter(parent_task=task_e).order_by('end').last()
+        end = task_e.end + timedelta(days=30)
+
+        Task(name="subtask e.x.1", owner=task_e.owner, start=task_e.end, end=end, parent_task=subtask_e).save()
+
+        for task in Task.objects.filter(id__in=[task_e.id, subtask_e.id]):
+            self.assertEquals(task.end, end)
+            self.assertEquals(task.span_level, span_level(task.start, task.end))
+        self.assertEquals(Task.objects.get(pk=5).start, task_e.start)
+
+
+    def test_paths(self):
+        """
+        expect the path of every task to hold the ids of its parent
+        tasks, and the descendants, the depth and the root of a task to
+        match the ones found by walking the parent tasks.
+        """
+
+        parents = dict(Task.objects.values_list('id', 'parent_task_id'))
+
+        def ancestors(task_id):
+            while task_id is not None:
+                yield task_id
+                task_id = parents[task_id]
+
+        for task in Task.objects.all():
+            chain = list(ancestors(task.id))[::-1]
+            self.assertEquals(task.path, '/{}/'.format('/'.join(str(i) for i in chain)))
+            self.assertEquals(task.depth, len(chain) - 1)
+            self.assertEquals(task.root_id, chain[0])
+            self.assertEquals(
+                set(task.get_descendants().values_list('id', flat=True)),
+                {i for i in parents if i != task.id and task.id in ancestors(i)},
+            )
+
+        subtask = Task.objects.filter(parent_task_id=5).first()
+        with self.assertNumQueries(1):
+            self.assertEquals(subtask.get_root().id, 5)
+
+
+    def test_move_task_paths(self):
+        """
+        move a task with subtasks under another task and expect the path
+        of the subtasks to move with it, then expect an error moving the
+        task under its own subtask.
+        """
+
+        task_e = Task.objects.get(pk=5)
+        subtask_e = Task.objects.filter(parent_task=task_e).first()
+        Task(name="subtask e.x.1", owner=task_e.owner, start=task_e.start, end=task_e.end, parent_task=subtask_e).save()
+
+        subtask_e.parent_task_id = 1
+        subtask_e.save()
+
+        self.assertEquals(subtask_e.path, '/1/{}/'.format(subtask_e.id))
+        subtask = Task.objects.get(name="subtask e.x.1")
+        self.assertEquals(subtask.path, '/1/{}/{}/'.format(subtask_e.id, subtask.id))
+        self.assertEquals(subtask.root_id, 1)
+        self.assertEquals(list(Task.objects.get(pk=1).get_descendants()), [subtask_e, subtask])
+
+        task = Task.objects.get(pk=1)
+        task.parent_task = subtask
+        with self.assertRaises(ValueError):
+            task.save()
+
+
+    def test_bulk_create_paths(self):
+        """
+        create a subtask of a subtask without save and expect both to
+        get their path.
+        """
+
+        task = Task.objects.get(pk=1)
+        Task.objects.bulk_create([
+            Task(id=1001, name="bulk 1", owner=task.owner, start=task.start, end=task.end, parent_task=task),
+            Task(id=1002, name="bulk 2", owner=task.owner, start=task.start, end=task.end, parent_task_id=1001),
+        ])
+
+        self.assertEquals(Task.objects.get(pk=1002).path, '/1/1001/1002/')
+
+
+    def test_descendants_without_path(self):
+        """
+        create tasks on a cycle of parent tasks, left without path, and
+        expect their subtasks found anyway.
+        """
+
+        task = Task.objects.get(pk=1)
+        with self.assertLogs('task', level='WARNING'):
+            Task.objects.bulk_create([
+                Task(id=3001, name="cycle 1", owner=task.owner, start=task.start, end=task.end, parent_task_id=3002),
+                Task(id=3002, name="cycle 2", owner=task.owner, start=task.start, end=task.end, parent_task_id=3001),
+                Task(id=3003, name="cycle 3", owner=task.owner, start=task.start, end=task.end, parent_task_id=3002),
+            ])
+
+        cycle = Task.objects.get(pk=3001)
+        self.assertIsNone(cycle.path)
+        self.assertEquals(set(cycle.get_descendants().values_list('id', flat=True)), {3002, 3003})
+
+
+    def test_move_under_task_without_path(self):
+        """
+        move a task with a subtask under a task on a cycle of parent
+        tasks, without path, and expect both left without path, their
+        subtasks found anyway. moved back under a task with a path they
+        get their paths again.
+        """
+
+        task = Task.objects.get(pk=1)
+        with self.assertLogs('task', level='WARNING'):
+            Task.objects.bulk_create([
+                Task(id=3001, name="cycle 1", owner=task.owner, start=task.start, end=task.end, parent_task_id=3002),
+                Task(id=3002, name="cycle 2", owner=task.owner, start=task.start, end=task.end, parent_task_id=3001),
+            ])
+        subtask_e = Task.objects.filter(parent_task_id=5).first()
+        Task(name="subtask e.x.1", owner=task.owner, start=subtask_e.start, end=subtask_e.end, parent_task=subtask_e).save()
+
+        subtask_e.parent_task_id = 3002
+        with self.assertLogs('task', level='WARNING'):
+            subtask_e.save()
+
+        subtask = Task.objects.get(name="subtask e.x.1")
+        self.assertIsNone(subtask_e.path)
+        self.assertIsNone(subtask.path)
+        self.assertEquals(list(subtask_e.get_descendants()), [subtask])
+        self.assertNotIn(subtask_e, Task.objects.get(pk=5).get_descendants())
+
+        subtask_e.parent_task_id = 1
+        subtask_e.save()
+
+        self.assertEquals(subtask_e.path, '/1/{}/'.format(subtask_e.id))
+        self.assertEquals(Task.objects.get(name="subtask e.x.1").path, '/1/{}/{}/'.format(subtask_e.id, subtask.id))
+
+
+    def test_descendants_with_like(self):
+        """
+        find the subtasks of a task with LIKE, as on the databases
+        sorting the paths by their collation, and expect the same as
+        with the range of the path index.
+        """
+
+        task = Task.objects.get(pk=1)
+        expected = set(task.get_descendants())
+
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            descendants = task.get_descendants()
+            self.assertIn('LIKE', str(descendants.query))
+            self.assertEquals(set(descendants), expected)
+
+
+    def test_widen_parent_spans_only_widened(self):
+        """
+        move the start of a subtask before its parent task, widen the
+        parent tasks and expect only them counted and given a span
+        level, not another task without span level.
+        """
+
+        subtask = Task.objects.filter(parent_task_id=6).order_by('start').first()
+        parent = Task.objects.get(pk=6)
+        ancestors = Task.objects.filter(id__in=[int(i) for i in parent.path.strip('/').split('/')])
+        Task.objects.filter(pk=subtask.pk).update(start=parent.start - timedelta(days=30))
+        Task.objects.filter(pk=1).update(span_level=None)
+
+        self.assertEquals(widen_parent_spans([subtask.id]), ancestors.count())
+        self.assertIsNone(Task.objects.get(pk=1).span_level)
+        for task in ancestors:
+            self.assertEquals(task.span_level, span_level(task.start, task.end))
+
+
+    def test_statuses_on_cycle(self):
+        """
+        create tasks on a cycle of parent tasks, with a subtask, and
+        expect their statuses computed, by the status engine and by the
+        timeline index, instead of a query that never ends.
+        """
+
+        task = Task.objects.get(pk=1)
+        Task.objects.bulk_create([
+            Task(id=3001, name="cycle 1", owner=task.owner, start=task.start, end=task.end, parent_task_id=3002),
+            Task(id=3002, name="cycle 2", owner=task.owner, start=task.start, end=task.end, parent_task_id=3001),
+            Task(id=3003, name="cycle 3", owner=task.owner, start=task.start, end=task.end, parent_task_id=3002),
+        ])
+
+        statuses = subtree_statuses([3001])
+        self.assertEquals(set(statuses), {3001, 3002, 3003})
+        self.assertEquals(Task.objects.get(pk=3002).status, statuses[3002])
+
+        timeline = TaskTimeline(fetch_subtrees([3001]))
+        now = datetime.now(timezone.utc)
+        self.assertEquals({task_id: timeline.status_at(task_id, now) for task_id in statuses}, statuses)
+
+
+    def test_save_under_cycle(self):
+        """
+        save and delete a subtask of a cycle of parent tasks and expect
+        the statuses of its parent tasks refreshed.
+        """
+
+        task = Task.objects.get(pk=1)
+        Task.objects.bulk_create([
+            Task(id=3001, name="cycle 1", owner=task.owner, start=task.start, end=task.end, parent_task_id=3002),
+            Task(id=3002, name="cycle 2", owner=task.owner, start=task.start, end=task.end, parent_task_id=3001),
+        ])
+        subtask = Task.objects.create(name="cycle 3", owner=task.owner, start=task.end + timedelta(days=1),
+            end=task.end + timedelta(days=2), parent_task_id=3002)
+
+        self.assertEquals(refresh_ancestor_statuses(subtask.id).keys(), {subtask.id, 3001, 3002})
+        subtask.delete()
+        self.assertIsNotNone(Task.objects.get(pk=3002).rollup_status)
+
+
+    def test_deferred_span_updates(self):
+        """
+        save many subtasks of the same task in a deferred_span_updates
+        block, expect the parent task unchanged until the end of the
+        block, then widened with one statement.
+        """
+
+        task_e = Task.objects.get(pk=5)
+        start, end = task_e.start - timedelta(days=20), task_e.end
+
+        with CaptureQueriesContext(connection) as queries:
+            with deferred_span_updates():
+                for day in range(20):
+                    Task(name="subtask e.{}".format(day), owner=task_e.owner, parent_task_id=5,
+                        start=start + timedelta(days=day), end=end + timedelta(days=day)).save()
+                self.assertEquals(Task.objects.get(pk=5).start, task_e.start)
+
+        widen_queries = [query for query in queries if query['sql'].startswith('WITH RECURSIVE spans')]
+        self.assertEquals(len(widen_queries), 1)
+
+        task = Task.objects.get(pk=5)
+        self.assertEquals(task.start, start)
+        self.assertEquals(task.end, end + timedelta(days=19))
+        self.assertEquals(task.span_level, span_level(task.start, task.end))
+        self.assertEquals(task.status, subtree_statuses([5])[5])
+
+
+    def test_deferred_span_updates_invalidate_cache(self):
+        """
+        widen a parent task by a deferred_span_updates block and expect
+        its cached details removed once committed, no signal is sent
+        for the parent task.
+        """
+
+        task_e = Task.objects.get(pk=5)
+        set_task_details(task_e, {'task_priority': task_e.priority})
+
+        with deferred_span_updates():
+            Task(name="subtask e.wide", owner=task_e.owner, parent_task_id=5,
+                start=task_e.start - timedelta(days=30), end=task_e.end).save()
+        run_commit_hooks()
+
+        self.assertGreater(Task.objects.get(pk=5).duration, task_e.duration)
+        self.assertIsNone(get_task_details(5))
+
+
+    def test_span_updates_deferred_to_commit(self):
+        """
+        with the TASKS_DEFER_SPAN_UPDATES setting, the parent tasks of
+        the subtasks saved in a transaction are widened on commit.
+        """
+
+        task_e = Task.objects.get(pk=5)
+        end = task_e.end + timedelta(days=10)
+        callbacks = []
+
+        with self.settings(TASKS_DEFER_SPAN_UPDATES=True), \
+                mock.patch('tasks.spans.transaction.on_commit', callbacks.append):
+            for name in ("subtask e.y", "subtask e.z"):
+                Task(name=name, owner=task_e.owner, start=task_e.start, end=end, parent_task_id=5).save()
+
+        self.assertEquals(Task.objects.get(pk=5).end, task_e.end)
+        for callback in callbacks:
+            callback()
+        self.assertEquals(Task.objects.get(pk=5).end, end)
+        self.assertEquals(Task.objects.get(pk=5).rollup_status, subtree_statuses([5])[5])
+
+
+    def test_status_stored_without_query(self):
+        """ 
+        saving the subtasks stored the status of the parent task, so
+        reading it doesn't run any query.
+        """
+
+        task = Task.objects.get(pk=6)
+
+        with self.assertNumQueries(0):
+            self.assertEquals(task.status, 'Idle')
+
+        self.assertEquals(task.rollup_status, 'Idle')
+        self.assertEquals(task.status_valid_until, Task.objects.get(name="task f.2 scheduled").start)
+
+
+    def test_status_expired_is_refreshed(self):
+        """ 
+        a stored status which valid until time has passed is computed
+        again and stored.
+        """
+
+        task = Task.objects.get(pk=2)
+        Task.objects.filter(pk=2).update(
+            rollup_status='Complete',
+            status_valid_until=datetime.now(timezone.utc) - timedelta(minutes=1),
+        )
+        task.refresh_from_db()
+
+        self.assertEquals(task.status, 'Scheduled')
+        self.assertEquals(Task.objects.get(pk=2).rollup_status, 'Scheduled')
+        self.assertEquals(Task.objects.get(pk=2).status_valid_until, task.start)
+
+
+    def test_refresh_expired_statuses(self):
+        """ 
+        the sweep computes only the tasks which status expired or was
+        never computed and stores them.
+        """
+
+        Task.objects.filter(pk=5).update(
+            rollup_status='Complete',
+            status_valid_until=datetime.now(timezone.utc) - timedelta(minutes=1),
+        )
+        expired = Task.objects.filter(rollup_status__isnull=True).count() + 1
+
+        self.assertEquals(Task.objects.refresh_expired_statuses(), expired)
+        self.assertEquals(Task.objects.get(pk=5).rollup_status, 'Multi-Runs')
+        self.assertEquals(Task.objects.refresh_expired_statuses(), 0)
+
+
+    def test_delete_subtask_refreshes_parent_status(self):
+        """ 
+        deleting the scheduled subtask of the Idle task leaves only the
+        completed subtask, so the parent task becomes Complete.
+        """
+
+        Task.objects.filter(name="task f.2 scheduled").delete()
+
+        self.assertEquals(Task.objects.get(pk=6).rollup_status, 'Complete')
+
+
+    def test_subtree_statuses_all_tasks(self):
+        """ 
+        compute the status of all the tasks at once and expect the same
+        statuses as reading the status property of each task.
+        """
+
+        statuses = subtree_statuses()
+        tasks = Task.objects.all()
+
+        self.assertEquals(len(statuses), tasks.count())
+        for task in tasks:
+            self.assertEquals(statuses[task.id], task.status)
+
+
+    def test_with_status_same_as_status_property(self):
+        """ 
+        annotate the tasks with the status computed by the database and
+        expect the same statuses as the status property.
+        """
+
+        with self.assertNumQueries(1):
+            statuses = {task.id: task.status for task in Task.objects.with_status()}
+
+        for task in Task.objects.all():
+            self.assertEquals(statuses[task.id], task.status)
+
+
+    def test_with_status_filter_and_count(self):
+        """ 
+        filter and group the tasks by the status computed by the 
+        database, each with one query.
+        """
+
+        with self.assertNumQueries(1):
+            running = Task.objects.with_status().filter(status='Running').count()
+
+        with self.assertNumQueries(1):
+            total_status = {
+                row['status']: row['total']
+                for row in Task.objects.with_status().values('status').annotate(total=Count('id')).order_by('status')
+            }
+
+        self.assertEquals(running, 4)
+        self.assertEquals(total_status, {
+            'Scheduled': 2,
+            'Complete': 6,
+            'Running': 4,
+            'Multi-Runs': 1,
+            'Idle': 1,
+        })
+
+
+    def test_with_status_in_past(self):
+        """
+        annotate the tasks with their status in the past, computed after
+        the stored statuses, and expect the statuses of the status 
+        engine at that time. nothing is stored.
+        """
+
+        current_date = datetime.now(timezone.utc)
+        stored = list(Task.objects.order_by('id').values_list('rollup_status', 'status_valid_until', 'status_computed_at'))
+
+        for days in (1, 3, 8, 30):
+            past = current_date - timedelta(days=days)
+            with self.assertNumQueries(1):
+                statuses = dict(Task.objects.with_status(now=past).values_list('id', 'status'))
+            self.assertEquals(statuses, subtree_statuses(now=past))
+
+        self.assertEquals(
+            list(Task.objects.order_by('id').values_list('rollup_status', 'status_valid_until', 'status_computed_at')),
+            stored,
+        )
+
+
+    def test_summary_only_aggregates(self):
+        """ 
+        the summary of the tasks is computed with three aggregate 
+        queries, without loading any task.
+        """
+
+        with self.assertNumQueries(3):
+            summary = Task.objects.summary()
+
+        self.assertEquals(summary['total_tasks'], 14)
+        self.assertEquals(summary['total_subtasks'], 7)
+        self.assertEquals(summary['total_status'], {
+            'Scheduled': 2,
+            'Complete': 6,
+            'Running': 4,
+            'Multi-Runs': 1,
+            'Idle': 1,
+        })
+        self.assertEquals(summary['durations']['shortest'], 24 * 60)
+        self.assertEquals(sum(total for _, total in summary['duration_buckets']), 14)
+        self.assertEquals(dict(summary['duration_buckets'])['< 1 week'], 4)
+
+
+    def test_index_summary_cached_until_next_boundary(self):
+        """
+        the summary of the index is cached until the next start or end
+        of a task, then computed again. saving a task removes it from
+        the cache once committed.
+        """
+
+        now = datetime.now(timezone.utc)
+        boundaries = [date for task in Task.objects.all() for date in (task.start, task.end) if date >= now]
+        invalidate_index_summary()
+
+        summary = get_index_summary(now=now)
+        self.assertEquals(summary['valid_until'], min(boundaries))
+
+        with self.assertNumQueries(0):
+            self.assertEquals(get_index_summary(now=now), summary)
+
+        with self.assertNumQueries(3):
+            get_index_summary(now=summary['valid_until'] + timedelta(seconds=1))
+
+        Task.objects.get(id=1).save()
+        # not committed yet, the cached summary is still read.
+        with self.assertNumQueries(0):
+            get_index_summary(now=now)
+
+        run_commit_hooks()
+        with self.assertNumQueries(3):
+            get_index_summary(now=now)
+
+
+    def test_index_summary_removed_without_save(self):
+        """
+        create and change tasks without save and expect the cached
+        summary of the index removed once committed.
+        """
+
+        task = Task.objects.get(pk=1)
+        total = get_index_summary()['total_tasks']
+
+        Task.objects.bulk_create([
+            Task(name="bulk summary", owner=task.owner, start=task.start, end=task.end),
+        ])
+        run_commit_hooks()
+
+        self.assertEquals(get_index_summary()['total_tasks'], total + 1)
+
+        Task.objects.filter(name="bulk summary").update(end=task.start + timedelta(days=2000))
+        run_commit_hooks()
+
+        self.assertEquals(get_index_summary()['durations']['longest'], 2000 * 24 * 60)
+
+
+    def test_timeline_same_as_subtree_statuses(self):
+        """
+        the status of every task and the number of tasks per status of
+        the timeline index are the same as the ones computed by the
+        status engine, at any time: before, on and after every start
+        and end of the tasks.
+        """
+
+        timeline = TaskTimeline.from_database()
+        dates = {date for task in Task.objects.all() for date in (task.start, task.end)}
+        times = sorted(dates | {date + delta for date in dates for delta in (timedelta(hours=-1), timedelta(hours=1))})
+
+        for as_of in times:
+            statuses = subtree_statuses(now=as_of)
+            self.assertEquals({task_id: timeline.status_at(task_id, as_of) for task_id in statuses}, statuses)
+            self.assertEquals(timeline.counts_at(as_of), dict(Counter(statuses.values())))
+
+
+    def test_timeline_updated_on_save(self):
+        """
+        change and delete subtasks, the timeline index updated by the
+        signals is the same as a new one built from the database.
+        """
+
+        reset_timeline()
+        timeline = get_timeline()
+        as_of = datetime.now(timezone.utc) + timedelta(days=3)
+
+        subtask = Task.objects.filter(parent_task_id=6).order_by('start').first()
+        subtask.end = as_of + timedelta(days=1)
+        subtask.save()
+        run_commit_hooks()
+        self.assertEquals(Task.objects.get(id=6).status_at(as_of), subtree_statuses([6], now=as_of)[6])
+
+        Task.objects.filter(parent_task_id=5).order_by('start').last().delete()
+        run_commit_hooks()
+
+        expected = TaskTimeline.from_database()
+        self.assertEquals(timeline.timelines, expected.timelines)
+        self.assertEquals(timeline.counts_at(as_of), expected.counts_at(as_of))
+
+
+    def test_timeline_counts_updated_in_place(self):
+        """
+        change tasks of the timeline index, with new and removed 
+        boundaries, and expect the number of tasks per status the same
+        as the one of a new index, counted without building the sums of
+        the changes again.
+        """
+
+        rows = fetch_subtrees()
+        timeline = TaskTimeline(rows)
+        start = min(row[2] for row in rows)
+        timeline.counts_at(start)
+        sums = timeline.sums
+
+        for i, (task_id, parent_id, task_start, task_end) in enumerate(rows):
+            if i % 2:
+                timeline.update_task(task_id, parent_id, task_start + timedelta(hours=i), task_end + timedelta(hours=i))
+        timeline.remove_task(rows[-1][0])
+        expected = TaskTimeline([
+            (task_id, parent_id, task_start + timedelta(hours=i), task_end + timedelta(hours=i)) if i % 2 else (task_id, parent_id, task_start, task_end)
+            for i, (task_id, parent_id, task_start, task_end) in enumerate(rows[:-1])
+        ])
+
+        dates = sorted({boundary for key in expected.changes for boundary in key[:1]})
+        for as_of in [start - timedelta(days=1)] + dates + [date + timedelta(minutes=30) for date in dates]:
+            self.assertEquals(timeline.counts_at(as_of), expected.counts_at(as_of))
+        self.assertIs(timeline.sums, sums)
+
+
+    def test_timeline_unchanged_on_rollback(self):
+        """
+        save a subtask in a transaction rolled back and expect the
+        timeline index and the status streams unchanged.
+        """
+
+        reset_timeline()
+        timeline = get_timeline()
+
+        with mock.patch('tasks.signals.notify_saved') as notify_saved:
+            try:
+                with transaction.atomic():
+                    subtask = Task.objects.filter(parent_task_id=6).order_by('start').first()
+                    subtask.end = subtask.end + timedelta(days=30)
+                    subtask.save()
+                    raise RuntimeError("rolled back")
+            except RuntimeError:
+                pass
+            run_commit_hooks()
+
+        self.assertFalse(notify_saved.called)
+        self.assertEquals(timeline.timelines, TaskTimeline.from_database().timelines)
+        reset_timeline()
+
+
+    def test_active_between_same_as_overlap(self):
+        """
+        the tasks active in a window found with the span levels are the
+        same as the ones found by comparing the start and end of every
+        task, for windows before, around, on and after the tasks.
+        """
+
+        tasks = list(Task.objects.all())
+        self.assertTrue(all(task.span_level == span_level(task.start, task.end) for task in tasks))
+
+        dates = sorted({date for task in tasks for date in (task.start, task.end)})
+        dates = [dates[0] - timedelta(days=1)] + dates + [dates[-1] + timedelta(days=1)]
+
+        for i, start in enumerate(dates):
+            for end in dates[i:i + 3]:
+                expected = sorted(task.id for task in tasks if task.start <= end and task.end >= start)
+                found = sorted(Task.objects.active_between(start, end).values_list('id', flat=True))
+                self.assertEquals(found, expected)
+
+
+    def test_span_level_updated_on_save(self):
+        """
+        the span level of a task and its parent task is updated when the
+        end of the subtask changes.
+        """
+
+        subtask = Task.objects.filter(parent_task_id=6).order_by('end').last()
+        subtask.end = subtask.end + timedelta(days=400)
+        subtask.save()
+
+        for task in Task.objects.filter(id__in=[6, subtask.id]):
+            self.assertEquals(task.span_level, span_level(task.start, task.end))
+
+
+    def test_status_deep_tree(self):
+        """ 
+        create a chain of subtasks deeper than the recursion limit and
+        expect the root to get the status of the last subtask.
+        """
+
+        current_date = datetime.now(timezone.utc)
+        owner = User.objects.get(username="fooobaar1234")
+        depth = sys.getrecursionlimit() + 100
+
+        Task.objects.bulk_create(
+            [
+                Task(id=1000 + i,
+                     name="deep {}".format(i),
+                     owner=owner,
+                     start=current_date - timedelta(days=2),
+                     end=current_date - timedelta(days=1),
+                     parent_task_id=1000 + i - 1 if i else None,
+                )
+                for i in range(depth)
+            ]
+        )
+
+        self.assertEquals(Task.objects.get(pk=1000).status, 'Complete')
+
+        # the paths are longer than the limit of a CharField would be.
+        self.assertGreater(len(Task.objects.get(pk=1000 + depth - 1).path), 1000)
+        self.assertEquals(Task.objects.get(pk=1000).get_descendants().count(), depth - 1)
+
         
     @classmethod
     def tearDownClass(cls):
@@ -322,3 +990,105 @@ class TaskTest(TestCase):
         User.objects.all().delete()
         logger.debug("tearDownClass {}".format(cls.__name__))
         
+
+
+class DeepTreeStatusTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        create a tree of four levels: root -> a -> b -> a complete and
+        a scheduled task, b is Idle and so are a and root.
+        """
+
+        logger.debug("setup {} started".format(cls.__name__))
+
+        owner = User.objects.create_user(username="deeptree", email="deep@bla.com")
+        current_date = datetime.now(timezone.utc)
+
+        root = Task.objects.create(name="root", owner=owner, start=current_date - timedelta(days=5), end=current_date + timedelta(days=5))
+        a = Task.objects.create(name="a", owner=owner, parent_task=root, start=current_date - timedelta(days=4), end=current_date + timedelta(days=4))
+        b = Task.objects.create(name="b", owner=owner, parent_task=a, start=current_date - timedelta(days=3), end=current_date + timedelta(days=3))
+        Task.objects.create(name="complete", owner=owner, parent_task=b, start=current_date - timedelta(days=3), end=current_date - timedelta(days=2))
+        Task.objects.create(name="scheduled", owner=owner, parent_task=b, start=current_date + timedelta(days=2), end=current_date + timedelta(days=3))
+
+
+    def test_with_status_any_depth(self):
+        """
+        annotate the tasks with their status and expect the statuses of
+        the status engine, root Idle. the stored statuses are rolled up
+        from any depth. without them the subtasks deeper than the sql
+        rollup make the root unknown, None, never a wrong status.
+        """
+
+        expected = subtree_statuses()
+        self.assertEquals(expected[Task.objects.get(name="root").id], 'Idle')
+
+        statuses = {task.id: task.status for task in Task.objects.with_status()}
+        self.assertEquals(statuses, expected)
+        self.assertEquals(
+            set(Task.objects.with_status().filter(status='Idle').values_list('name', flat=True)),
+            {"root", "a", "b"},
+        )
+
+        Task.objects.update(rollup_status=None, status_valid_until=None, status_computed_at=None)
+        statuses = dict(Task.objects.with_status().values_list('name', 'status'))
+        self.assertEquals(statuses, {'root': None, 'a': 'Idle', 'b': 'Idle', 'complete': 'Complete', 'scheduled': 'Scheduled'})
+        self.assertFalse(Task.objects.filter(rollup_status__isnull=False).exists())
+
+
+    def test_summary_any_depth(self):
+        """
+        expect the number of tasks per status of the summary counted
+        with the statuses of the status engine.
+        """
+
+        expected = dict(Counter(subtree_statuses().values()))
+        self.assertEquals(expected, {'Idle': 3, 'Complete': 1, 'Scheduled': 1})
+
+        self.assertEquals(Task.objects.summary()['total_status'], expected)
+
+
+    def test_with_status_in_past(self):
+        """
+        annotate the tasks with their status two days and a half ago,
+        when the complete task was running and b Scheduled. the stored
+        statuses were computed later, so they're not used: the statuses
+        are the ones of the status engine or unknown, None.
+        """
+
+        past = datetime.now(timezone.utc) - timedelta(days=2, hours=12)
+        expected = {Task.objects.get(id=task_id).name: status for task_id, status in subtree_statuses(now=past).items()}
+
+        statuses = dict(Task.objects.with_status(now=past).values_list('name', 'status'))
+
+        self.assertEquals(statuses['complete'], 'Running')
+        self.assertEquals(statuses['b'], 'Scheduled')
+        for name, status in statuses.items():
+            self.assertIn(status, (None, expected[name]))
+
+
+    def test_with_status_in_future_not_stored(self):
+        """
+        annotate the tasks with their status in a week, when all are
+        complete, and expect the stored statuses unchanged. the root is
+        unknown, its subtasks are too deep.
+        """
+
+        stored = list(Task.objects.order_by('id').values_list('rollup_status', 'status_valid_until'))
+        later = datetime.now(timezone.utc) + timedelta(days=7)
+
+        statuses = dict(Task.objects.with_status(now=later).values_list('name', 'status'))
+
+        self.assertEquals(statuses.pop('root'), None)
+        self.assertEquals(set(statuses.values()), {'Complete'})
+        self.assertEquals(list(Task.objects.order_by('id').values_list('rollup_status', 'status_valid_until')), stored)
+
+
+    @classmethod
+    def tearDownClass(cls):
+        """ delete all objects created """
+
+        Task.objects.all().delete()
+        User.objects.all().delete()
+        logger.debug("tearDownClass {}".format(cls.__name__))
@@ -0,0 +1,160 @@
+from django.test import Client, TestCase
+from tasks.cache import get_task_details, invalidate_task_details, set_task_details
+from tasks.middleware import PRIMARY_COOKIE
+from tasks.models import Task
+from tasks.routers import ReadReplicaRouter, read_from_primary, read_from_replica
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from datetime import datetime, timedelta, timezone
+import logging
+
+logger = logging.getLogger("views")
+API_PATH = 'http://127.0.0.1:8001/tasks/'
+ADMIN_PATH = 'http://127.0.0.1:8001/admin/'
+
+
+class ReadReplicaTest(TestCase):
+
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        create an admin user and two tasks, read from the replica, the
+        same test database.
+        """
+
+        logger.debug("setup {} started".format(cls.__name__))
+
+        admin = User.objects.create_superuser(username="replicaadmin", email="admin@bla.com", password="test1234")
+        current_date = datetime.now(timezone.utc)
+
+        Task.objects.bulk_create([
+            Task(name="task a", owner=admin, start=current_date - timedelta(days=2), end=current_date + timedelta(days=2)),
+            Task(name="task b", owner=admin, start=current_date + timedelta(days=1), end=current_date + timedelta(days=3)),
+        ])
+
+
+    def setUp(self):
+        """
+        the replica is the same in memory database, shared with the
+        primary. without this its reads would lock the tables written by
+        the primary.
+        """
+
+        with connections['replica'].cursor() as cursor:
+            cursor.execute("PRAGMA read_uncommitted = 1")
+        self.addCleanup(read_from_primary)
+        self.addCleanup(cache.clear)
+
+
+    def test_read_only_views_read_from_replica(self):
+        """
+        request the tasks page and the details of a task and expect them
+        read from the replica, the admin from the primary.
+        """
+
+        task = Task.objects.get(name="task a")
+        client = Client()
+
+        with self.settings(TASKS_READ_REPLICAS=['replica']):
+            for path in (API_PATH + 'alltasks/', API_PATH + 'task/{}/'.format(task.id)):
+                with CaptureQueriesContext(connections['replica']) as replica_queries:
+                    response = client.get(path)
+                self.assertEquals(response.status_code, 200)
+                self.assertGreater(len(replica_queries), 0)
+
+            with CaptureQueriesContext(connections['replica']) as replica_queries:
+                client.get(ADMIN_PATH + 'login/')
+            self.assertEquals(len(replica_queries), 0)
+
+
+    def test_sticky_primary_after_write(self):
+        """
+        log in the admin, a write, and expect the next requests of the
+        user read from the primary.
+        """
+
+        client = Client()
+
+        with self.settings(TASKS_READ_REPLICAS=['replica'], TASKS_REPLICA_STICKY_SECONDS=30):
+            response = client.post(ADMIN_PATH + 'login/', {'username': 'replicaadmin', 'password': 'test1234'})
+            self.assertEquals(response.status_code, 302)
+            self.assertEquals(response.cookies[PRIMARY_COOKIE]['max-age'], 30)
+
+            with CaptureQueriesContext(connections['replica']) as replica_queries:
+                response = client.get(API_PATH + 'alltasks/')
+
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(len(replica_queries), 0)
+
+
+    def test_router(self):
+        """
+        expect the reads sent to the replica until a write, the writes to
+        the primary.
+        """
+
+        router = ReadReplicaRouter()
+
+        with self.settings(TASKS_READ_REPLICAS=['replica']):
+            self.assertEquals(router.db_for_read(Task), 'default')
+            read_from_replica()
+            self.assertEquals(router.db_for_read(Task), 'replica')
+            self.assertEquals(router.db_for_write(Task), 'default')
+            self.assertEquals(router.db_for_read(Task), 'default')
+            self.assertFalse(router.allow_migrate('replica', 'tasks'))
+
+
+    def test_cache_not_refilled_from_replica(self):
+        """
+        invalidate the cached details of a task and expect them not
+        cached again from a replica until it has the change, but from the
+        primary.
+        """
+
+        task = Task.objects.get(name="task a")
+
+        with self.settings(TASKS_READ_REPLICAS=['replica']):
+            invalidate_task_details(task.id)
+
+            read_from_replica()
+            set_task_details(task, {'id': task.id})
+            self.assertIsNone(get_task_details(task.id))
+
+            read_from_primary()
+            set_task_details(task, {'id': task.id})
+            self.assertEquals(get_task_details(task.id)['data'], {'id': task.id})
+
+
+    def test_statuses_from_replica_not_stored(self):
+        """
+        request the tasks page with expired statuses, read from the
+        replica, and expect them shown but not stored in the primary.
+        """
+
+        Task.objects.update(rollup_status=None, status_valid_until=None)
+
+        with self.settings(TASKS_READ_REPLICAS=['replica']):
+            response = Client().get(API_PATH + 'alltasks/')
+            self.assertContains(response, 'Running')
+
+            read_from_replica()
+            task = Task.objects.get(name="task b")
+            self.assertEquals(task.status, 'Scheduled')
+            read_from_primary()
+
+        self.assertFalse(Task.objects.filter(rollup_status__isnull=False).exists())
+
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        delete all the objects created by the test class.
+        """
+
+        logger.debug("tearDownClass {}".format(cls.__name__))
+        Task.objects.all().delete()
+        User.objects.all().delete()
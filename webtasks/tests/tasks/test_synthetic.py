@@ -0,0 +1,70 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from tasks.models import Task, span_level
+from tasks.synthetic import SHAPES, generate_tasks, insert_tasks
+from datetime import datetime, timezone
+import logging
+
+logger = logging.getLogger("task")
+
+ORIGIN = datetime(2019, 8, 1, tzinfo=timezone.utc)
+
+
+class GenerateTasksTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ create the owners of the generated tasks """
+
+        logger.debug("setup {} started".format(cls.__name__))
+
+        User.objects.bulk_create(User(username='synthetic{}'.format(i)) for i in range(3))
+        cls.owner_ids = sorted(User.objects.values_list('id', flat=True))
+
+
+    def test_same_seed_same_tasks(self):
+        """
+        generate the same dataset twice and expect the same rows, then
+        generate it again from the root task of a tree and expect the
+        same rows from that tree on.
+        """
+
+        for shape in SHAPES:
+            rows = list(generate_tasks(500, self.owner_ids, shape=shape, seed=7, origin=ORIGIN))
+            self.assertEquals(len(rows), 500)
+            self.assertEquals(rows, list(generate_tasks(500, self.owner_ids, shape=shape, seed=7, origin=ORIGIN)))
+
+            root_id = [row[0] for row in rows if row[6] is None][-1]
+            resumed = list(generate_tasks(501 - root_id, self.owner_ids, shape=shape, seed=7, origin=ORIGIN, first_id=root_id))
+            self.assertEquals(resumed, rows[root_id - 1:])
+
+
+    def test_subtasks_inside_parent_tasks(self):
+        """
+        insert a generated dataset and expect every subtask inside its
+        parent task, the path and span level of every task set.
+        """
+
+        total = insert_tasks(generate_tasks(300, self.owner_ids, shape='mixed', seed=3, origin=ORIGIN), batch_size=100)
+        self.assertEquals(total, 300)
+
+        tasks = {task.id: task for task in Task.objects.select_related('parent_task')}
+        self.assertEquals(len(tasks), 300)
+        self.assertTrue(any(task.parent_task_id is not None for task in tasks.values()))
+
+        for task in tasks.values():
+            self.assertEquals(task.span_level, span_level(task.start, task.end))
+            if task.parent_task_id is None:
+                self.assertEquals(task.path, '/{}/'.format(task.id))
+            else:
+                self.assertEquals(task.path, '{}{}/'.format(task.parent_task.path, task.id))
+                self.assertTrue(task.parent_task.start <= task.start <= task.end <= task.parent_task.end)
+
+
+    @classmethod
+    def tearDownClass(cls):
+        """ delete all objects created """
+
+        Task.objects.all().delete()
+        User.objects.all().delete()
+        logger.debug("tearDownClass {}".format(cls.__name__))
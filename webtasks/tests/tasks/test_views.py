@@ -1,13 +1,31 @@
 from django.test import TestCase
 from rest_framework.test import APIClient
+from tasks import metrics
+from tasks.cache import render_task_rows
 from tasks.models import Task
+from tasks.status import prime_statuses
+from tasks.timeline import reset_timeline
+from tasks.views import TasksListView
+from tests.tasks.utils import run_commit_hooks
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.template.backends.django import Template as DjangoTemplate
+from django.test.utils import CaptureQueriesContext
 from datetime import datetime, timedelta, timezone
 from django.utils.timezone import utc
+from unittest import mock
+import gc
+import json
 import logging
+import os
+import re
+import tempfile
+import threading
 
 logger = logging.getLogger("views")
 API_PATH = 'http://127.0.0.1:8001/tasks/'
+METRICS_PATH = 'http://127.0.0.1:8001/metrics'
 
 
 class TasksDetailsListViewTest(TestCase):
@@ -127,6 +145,188 @@ class TasksDetailsListViewTest(TestCase):
         self.assertEquals(status_code, 404)
         self.assertTrue(content)
 
+    def test_get_task_details_not_modified_304(self):
+        """
+        make a get request to the task api, then the same request with
+        the etag or last modified date received. expect to get back
+        http status 304 without any query, the details are cached.
+        """
+
+        api = API_PATH + 'task/1/'
+        response = self.api_client.get(api)
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(etag.startswith('"'))
+
+        with self.assertNumQueries(0):
+            response = self.api_client.get(api, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response['ETag'], etag)
+
+        with self.assertNumQueries(0):
+            response = self.api_client.get(api, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEquals(response.status_code, 304)
+
+        response = self.api_client.get(api, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json()['task_priority'], 'L')
+
+    def test_get_task_details_invalidated(self):
+        """
+        make a get request to the task api, change the task and its
+        owner and expect to get back the new details with a new etag.
+        """
+
+        api = API_PATH + 'task/1/'
+        etag = self.api_client.get(api)['ETag']
+
+        task = Task.objects.get(id=1)
+        task.priority = 'M'
+        task.save()
+        run_commit_hooks()
+
+        response = self.api_client.get(api, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json()['task_priority'], 'M')
+        self.assertNotEquals(response['ETag'], etag)
+        etag = response['ETag']
+
+        task.owner.first_name = 'changed'
+        task.owner.save()
+        run_commit_hooks()
+
+        response = self.api_client.get(api, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json()['first_name'], 'changed')
+
+        # the task and the user are restored by the rollback of the
+        # test, without any signal.
+        Task.objects.get(id=1).delete()
+        run_commit_hooks()
+
+    def test_get_task_details_cached_before_commit(self):
+        """
+        change a task, get its details from another request before the
+        change is committed, which caches the old row, and expect the
+        new details once committed.
+        """
+
+        api = API_PATH + 'task/1/'
+        self.api_client.get(api)
+
+        task = Task.objects.get(id=1)
+        task.priority = 'M'
+        task.save()
+        # the change isn't committed, the cached details are still read.
+        self.assertEquals(self.api_client.get(api).json()['task_priority'], 'L')
+
+        run_commit_hooks()
+        self.assertEquals(self.api_client.get(api).json()['task_priority'], 'M')
+
+        # the task is restored by the rollback of the test, without any
+        # signal.
+        Task.objects.get(id=1).delete()
+        run_commit_hooks()
+
+    def test_get_task_details_as_of(self):
+        """
+        make a get request to the task api and the task list api with a
+        time in the future and expect the status at that time.
+        """
+
+        reset_timeline()
+        as_of = datetime.now(timezone.utc) + timedelta(days=4, hours=12)
+
+        response = self.api_client.get(API_PATH + 'task/2/', {'as_of': as_of.isoformat()})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json()['status'], 'Running')
+
+        response = self.api_client.get(API_PATH + 'api/tasks/', {'as_of': as_of.isoformat()})
+        content = json.loads(b''.join(response.streaming_content))
+        self.assertEquals([task['status'] for task in content], ['Complete', 'Running'])
+
+        response = self.api_client.get(API_PATH + 'task/2/', {'as_of': 'tomorrow'})
+        self.assertEquals(response.status_code, 400)
+
+    def test_get_active_task_list_api(self):
+        """
+        make a get request to the active task list api with a window and
+        expect to get back the tasks overlapping it, ordered by start.
+        an invalid window returns http status 400.
+        """
+
+        api = API_PATH + 'api/tasks/active/'
+        now = datetime.now(timezone.utc)
+
+        response = self.api_client.get(api, {'start': (now - timedelta(days=5)).isoformat(), 'end': (now + timedelta(days=6)).isoformat()})
+        content = json.loads(b''.join(response.streaming_content))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([task['id'] for task in content], [1, 2])
+
+        response = self.api_client.get(api, {'start': now.isoformat(), 'end': (now + timedelta(days=1)).isoformat()})
+        self.assertEquals(json.loads(b''.join(response.streaming_content)), [])
+
+        self.assertEquals(self.api_client.get(api, {'start': now.isoformat()}).status_code, 400)
+        self.assertEquals(self.api_client.get(api, {'start': now.isoformat(), 'end': (now - timedelta(days=1)).isoformat()}).status_code, 400)
+
+    def test_get_many_task_details_one_query(self):
+        """ 
+        make a get request to the task api with many ids and expect to
+        get back the details of all the tasks, fetched with one query.
+        """
+
+        api = API_PATH + 'task/'
+
+        with self.assertNumQueries(1):
+            response = self.api_client.get(api, {'ids': '1,2,20'})
+
+        content = response.json()
+        logger.debug("response content: {}".format(content))
+
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(sorted(task['id'] for task in content), [1, 2])
+        details = {task['id']: task for task in content}
+        self.assertEquals(details[2], {'id': 2, 'task_priority': 'H', 'first_name': 'foo2', 'last_name': 'bar2'})
+
+
+    def test_get_many_task_details_invalid_ids_400(self):
+        """ 
+        make a get request to the task api with invalid or no ids and
+        expect to get back http status 400 bad request.
+        """
+
+        api = API_PATH + 'task/'
+
+        self.assertEquals(self.api_client.get(api, {'ids': '1,a'}).status_code, 400)
+        self.assertEquals(self.api_client.get(api).status_code, 400)
+
+
+    def test_get_task_list_api(self):
+        """ 
+        make a get request to the task list api and expect to get back 
+        a streamed json array of all the tasks, read with one query.
+        """
+
+        api = API_PATH + 'api/tasks/'
+
+        with self.assertNumQueries(1):
+            response = self.api_client.get(api)
+            content = json.loads(b''.join(response.streaming_content))
+
+        logger.debug("response content: {}".format(content))
+
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Content-Type'], 'application/json')
+        self.assertEquals([task['id'] for task in content], [1, 2])
+        self.assertEquals(content[1]['priority'], 'H')
+        self.assertEquals(content[1]['first_name'], 'foo2')
+        self.assertEquals(content[1]['last_name'], 'bar2')
+        self.assertIsNone(content[1]['parent_task'])
+        self.assertTrue(content[1]['start'].endswith('Z'))
+
+
     def test_get_page_not_found_404(self):
         """ 
         make a get request to the task api with a non existing api, 
@@ -239,6 +439,322 @@ class TasksListViewTest(TestCase):
         self.assertEquals(content_type, 'text/html; charset=utf-8')
         self.assertTrue(True)
 
+    def test_get_index_as_of(self):
+        """ 
+        make a get request to the index task view with a time in the 
+        future and expect the statuses counted at that time. an invalid
+        time returns http status 400.
+        """
+
+        reset_timeline()
+        as_of = datetime.now(timezone.utc) + timedelta(days=30)
+        response = self.api_client.get(API_PATH, {'as_of': as_of.isoformat()})
+
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.context['total_status'], {'Complete': Task.objects.count()})
+        self.assertEquals(self.api_client.get(API_PATH, {'as_of': 'tomorrow'}).status_code, 400)
+
+
+    def test_get_all_tasks_pages(self):
+        """ 
+        request the tasks two at a time with the next cursor and then 
+        back with the previous cursor, expect the tasks in the order of
+        their start date.
+        """
+
+        api = API_PATH + 'alltasks/'
+        ordered = list(Task.objects.values_list('id', flat=True))
+
+        with mock.patch.object(TasksListView, 'page_size', 2):
+            first = self.api_client.get(api)
+            second = self.api_client.get(api, {'after': first.context['next_cursor']})
+            back = self.api_client.get(api, {'before': second.context['previous_cursor']})
+
+        logger.debug("pages: {} - {}".format(first.context['tasks_list'], second.context['tasks_list']))
+
+        self.assertEquals([task.id for task in first.context['tasks_list']], ordered[:2])
+        self.assertEquals([task.id for task in second.context['tasks_list']], ordered[2:4])
+        self.assertEquals([task.id for task in back.context['tasks_list']], ordered[:2])
+        self.assertIsNone(first.context['previous_cursor'])
+        self.assertIsNone(second.context['next_cursor'])
+        self.assertIsNone(back.context['previous_cursor'])
+
+
+    def test_get_all_tasks_invalid_cursor_404(self):
+        """ 
+        make a get request to the task view with an invalid cursor and
+        expect to get back http status 404 not found.
+        """
+
+        api = API_PATH + 'alltasks/'
+        response = self.api_client.get(api, {'after': 'invalid'})
+
+        self.assertEquals(response.status_code, 404)
+
+
+    def test_get_all_tasks_streamed(self):
+        """ 
+        make a get request to the task view in stream mode and expect 
+        all the tasks, in chunks, in one streamed html page.
+        """
+
+        api = API_PATH + 'alltasks/'
+
+        with mock.patch.object(TasksListView, 'stream_chunk_size', 3):
+            response = self.api_client.get(api, {'stream': 1})
+            content = b''.join(response.streaming_content).decode()
+
+        logger.debug("streamed content length: {}".format(len(content)))
+
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Content-Type'], 'text/html; charset=utf-8')
+        for task in Task.objects.all():
+            self.assertIn('<tr id={} >'.format(task.id), content)
+        self.assertIn('</table>', content)
+        self.assertNotIn('<!-- rows -->', content)
+
+        # the details of all the tasks are not fetched with the page, the
+        # paged one fetches them.
+        self.assertNotIn("$.getJSON('/tasks/task/'", content)
+        self.assertIn("$.getJSON('/tasks/task/'", self.api_client.get(api).content.decode())
+
+
+    def test_server_timing(self):
+        """
+        request the tasks page and expect the number of queries and the
+        time spent in the database and the templates in the
+        Server-Timing header, then set a query budget of 0 for the page
+        and expect a warning.
+        """
+
+        api = API_PATH + 'alltasks/'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api_client.get(api)
+
+        timing = response['Server-Timing']
+        logger.debug("server timing: {}".format(timing))
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="{} queries"'.format(len(queries)), timing)
+        self.assertRegex(timing, r'tpl;dur=(?!0\.00)')
+        self.assertIn('total;dur=', timing)
+
+        with self.settings(TASKS_QUERY_BUDGETS={'tasks': 0}), \
+                self.assertLogs('task.timing', level='WARNING') as logs:
+            self.api_client.get(api)
+
+        self.assertIn('over its budget of 0', logs.output[0])
+
+
+    def test_cached_rows(self):
+        """
+        render the rows of the tasks twice and expect the second time
+        from the cache, then rename a task and widen the span of another
+        one and expect only their rows rendered again.
+        """
+
+        cache.clear()
+        api = API_PATH + 'alltasks/'
+        first = self.api_client.get(api).content.decode()
+
+        with mock.patch('tasks.cache.loader.get_template') as get_template:
+            second = self.api_client.get(api).content.decode()
+        self.assertEquals(second, first)
+        self.assertFalse(get_template.called)
+
+        renamed = Task.objects.get(name="task a")
+        renamed.name = "task a renamed"
+        renamed.save()
+        parent = Task.objects.get(name="task b ")
+        Task.objects.create(name="task b sub", owner=parent.owner, parent_task=parent,
+            start=parent.start - timedelta(days=1), end=parent.end)
+
+        tasks = prime_statuses(Task.objects.filter(parent_task__isnull=True).order_by('start', 'id'))
+        rendered = []
+        render = DjangoTemplate.render
+        def spy(template, context=None, request=None):
+            rendered.append(context['task'].name)
+            return render(template, context, request)
+
+        with mock.patch.object(DjangoTemplate, 'render', autospec=True, side_effect=spy):
+            rows = render_task_rows(tasks)
+
+        self.assertEquals(len(rows), len(tasks))
+        self.assertEquals(sorted(rendered), ["task a renamed", "task b "])
+        self.assertIn("task a renamed", self.api_client.get(api).content.decode())
+
+        Task.objects.filter(name="task b sub").delete()
+        Task.objects.filter(pk=parent.pk).update(start=parent.start)
+        renamed.name = "task a"
+        renamed.save()
+
+
+    def test_metrics(self):
+        """
+        request the index and the tasks pages, then the metrics, expect
+        the requests of both pages counted, the cache hit ratio and the
+        number of tasks per status.
+        """
+
+        self.api_client.get(API_PATH)
+        self.api_client.get(API_PATH)
+        self.api_client.get(API_PATH + 'alltasks/')
+        response = self.api_client.get(METRICS_PATH)
+        content = response.content.decode()
+        logger.debug("metrics: {}".format(content))
+
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE tasks_http_request_duration_seconds histogram', content)
+        self.assertRegex(content, r'tasks_http_request_duration_seconds_bucket{view="tasks",le="\+Inf"} [1-9]')
+        self.assertRegex(content, r'tasks_http_request_duration_seconds_count{view="index"} [1-9]')
+        self.assertRegex(content, r'tasks_db_queries_total{view="tasks"} [1-9]')
+        self.assertRegex(content, r'tasks_cache_hit_ratio{cache="index_summary"} 0\.[1-9]')
+
+        statuses = re.findall(r'^tasks_tasks{status="(\w+)"} (\d+)$', content, re.MULTILINE)
+        self.assertEquals(sum(int(total) for _, total in statuses), Task.objects.count())
+
+
+    def test_metrics_of_tasks_without_status(self):
+        """
+        expect the tasks without status, exactly on their start or end,
+        counted with the None status.
+        """
+
+        summary = {'total_status': {'Running': 2, None: 1, 'Complete': 3}}
+        with mock.patch('tasks.cache.get_index_summary', return_value=summary):
+            content = self.api_client.get(METRICS_PATH).content.decode()
+
+        self.assertEquals(
+            re.findall(r'^tasks_tasks{status="([\w-]+)"} (\d+)$', content, re.MULTILINE),
+            [('Complete', '3'), ('Running', '2'), ('None', '1')],
+        )
+
+
+    def test_metrics_of_other_processes(self):
+        """
+        flush the metrics to a directory with the metrics of another
+        process and expect the metrics of both.
+        """
+
+        with tempfile.TemporaryDirectory() as directory, self.settings(TASKS_METRICS_DIR=directory):
+            with open(os.path.join(directory, 'metrics-1.json'), 'w') as f:
+                json.dump([[['tasks_db_queries_total', 'other'], 7]], f)
+
+            self.api_client.get(API_PATH)
+            metrics.flush()
+            self.assertTrue(os.path.exists(metrics.metrics_path(os.getpid())))
+
+            content = self.api_client.get(METRICS_PATH).content.decode()
+
+        self.assertIn('tasks_db_queries_total{view="other"} 7', content)
+        self.assertRegex(content, r'tasks_db_queries_total{view="index"} [1-9]')
+
+
+    def test_metrics_of_finished_threads(self):
+        """
+        count requests from threads started one per request and expect
+        them counted once the threads ended, without their counters.
+        """
+
+        before = len(metrics._thread_counters)
+        totals = metrics.process_totals()
+
+        def request():
+            metrics.record_request('threaded', 0.01, 2)
+
+        for _ in range(5):
+            thread = threading.Thread(target=request)
+            thread.start()
+            thread.join()
+        gc.collect()
+
+        self.assertEquals(metrics.process_totals()[('tasks_db_queries_total', 'threaded')],
+                          totals[('tasks_db_queries_total', 'threaded')] + 10)
+        self.assertLessEqual(len(metrics._thread_counters), before)
+
+
+    def read_status_events(self, content, total):
+        """
+        read the stream until it sent the given number of status events,
+        returns their data.
+        """
+
+        events = []
+        for _ in range(50):
+            chunk = next(content).decode()
+            events.extend(json.loads(data) for data in re.findall(r'^event: status\ndata: (.*)$', chunk, re.MULTILINE))
+            if len(events) >= total:
+                break
+        return events
+
+
+    def test_status_events_of_saved_tasks(self):
+        """
+        open the status stream of a task, then save it to start later and
+        expect its new status pushed right away.
+        """
+
+        reset_timeline()
+        self.addCleanup(reset_timeline)
+        task = Task.objects.get(name="task d ")
+
+        with self.settings(TASKS_LIVE_KEEPALIVE=0.2):
+            response = self.api_client.get(API_PATH + 'api/tasks/events/', {'ids': task.id})
+            self.assertEquals(response.status_code, 200)
+            self.assertEquals(response['Content-Type'], 'text/event-stream')
+
+            content = iter(response.streaming_content)
+            self.assertEquals(next(content), b'retry: 3000\n\n')
+
+            task.start = datetime.now(timezone.utc) + timedelta(days=1)
+            task.save()
+            run_commit_hooks()
+            events = self.read_status_events(content, 1)
+
+        self.assertEquals(events[0]['id'], task.id)
+        self.assertEquals(events[0]['status'], 'Scheduled')
+        self.assertEquals(events[0]['previous'], 'Running')
+        self.assertEquals(events[0]['reason'], 'save')
+
+
+    def test_status_events_on_time(self):
+        """
+        save a task with a subtask starting in a moment, open the status
+        stream and expect the start of both pushed when it happens, the
+        parent task rolled up from its subtask.
+        """
+
+        reset_timeline()
+        self.addCleanup(reset_timeline)
+        now = datetime.now(timezone.utc)
+        owner = User.objects.get(username="fooobaar1234")
+        parent = Task.objects.create(name="parent", owner=owner, start=now, end=now + timedelta(days=1))
+        start = now + timedelta(seconds=0.5)
+        subtask = Task.objects.create(name="subtask", owner=owner, parent_task=parent, start=start, end=now + timedelta(hours=1))
+
+        with self.settings(TASKS_LIVE_KEEPALIVE=0.2):
+            response = self.api_client.get(API_PATH + 'api/tasks/events/', {'ids': '{},{}'.format(parent.id, subtask.id)})
+            content = iter(response.streaming_content)
+            next(content)
+            events = self.read_status_events(content, 2)
+
+        self.assertGreaterEqual(datetime.now(timezone.utc), start)
+        self.assertEquals(
+            sorted((event['id'], event['previous'], event['status'], event['reason']) for event in events),
+            [(parent.id, 'Scheduled', 'Running', 'time'), (subtask.id, 'Scheduled', 'Running', 'time')],
+        )
+        self.assertEquals({event['at'] for event in events}, {start.isoformat()})
+
+
+    def test_status_events_invalid_ids_400(self):
+        """
+        open the status stream with ids which aren't numbers and expect a
+        bad request.
+        """
+
+        response = self.api_client.get(API_PATH + 'api/tasks/events/', {'ids': '1,a'})
+        self.assertEquals(response.status_code, 400)
+
 
     def test_get_index_html_200(self):
         """ 
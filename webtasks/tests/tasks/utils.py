@@ -0,0 +1,12 @@
+from django.db import connection
+
+
+def run_commit_hooks():
+    """
+    run the on_commit callbacks of the test transaction, like its commit
+    would. TestCase never commits, the callbacks are only kept.
+    """
+
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tasks.middleware.ServerTimingMiddleware',
+    'tasks.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'tasks.middleware.ReadReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'webtasks.urls'
@@ -68,10 +71,18 @@ LOGGING = {
             'datefmt': "%d/%b/%Y %H:%M:%S"
         },
     },
+    'filters': {
+        'sampled': {
+            '()': 'tasks.log.SampledFilter',
+            'rate': 0.01,
+        },
+    },
     'handlers': {
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.handlers.RotatingFileHandler',
+            # written from a thread of its own, see tasks/log.py.
+            '()': 'tasks.log.QueuedHandler',
+            'handler_class': 'logging.handlers.RotatingFileHandler',
             'filename': os.path.join(BASE_DIR,'logs/debug.log'),
             'formatter': 'standard',
         },
@@ -87,12 +98,18 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        # the debug records of the code run for every task, sampled.
+        'task.hot': {
+            'filters': ['sampled'],
+            'level': 'DEBUG',
+            'propagate': True,
+        },
     },
 }
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'tasks.timing.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates'),],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -119,6 +136,39 @@ DATABASES = {
     }
 }
 
+# Read replicas
+# the views reading only send their reads to one of these aliases of
+# DATABASES, copies of the default database, the writes and the reads
+# following them go to the default one. see webtasks/settings_replicas.py.
+
+DATABASE_ROUTERS = ['tasks.routers.ReadReplicaRouter']
+TASKS_READ_REPLICAS = []
+TASKS_REPLICA_STICKY_SECONDS = 10
+
+
+# Cache
+# the cached task details are invalidated by signals of the process
+# saving the tasks, with more than one process the cache must be
+# shared between them, memcached for example.
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'webtasks',
+    }
+}
+
+
+# Metrics
+# every process writes its metrics to a file of this directory every
+# TASKS_METRICS_FLUSH_INTERVAL seconds, so the /metrics endpoint of any
+# process reports the requests of all of them. empty it before the
+# server starts.
+
+TASKS_METRICS_DIR = os.path.join(BASE_DIR, 'metrics')
+TASKS_METRICS_FLUSH_INTERVAL = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -157,3 +207,14 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# collectstatic writes the files with a hash of their content in their
+# name and their gzip and brotli copies, see tasks/assets.py. run it
+# on every release: python manage.py collectstatic --noinput
+# until it has run, the files are used with their plain names.
+STATICFILES_STORAGE = 'tasks.assets.CompressedManifestStaticFilesStorage'
+
+# the url prefix of the internal nginx location of STATIC_ROOT, nginx
+# sends the static files instead of the application. None sends them
+# from the application.
+TASKS_STATIC_ACCEL_REDIRECT = None
@@ -0,0 +1,32 @@
+"""
+the settings of the application reading from two replicas, run it with
+DJANGO_SETTINGS_MODULE=webtasks.settings_replicas . for testing the
+replicas are sqlite copies of the database, made with
+cp tasks.sqlite3 tasks-replica1.sqlite3 , they only get the writes when
+they're copied again. with postgres streaming replication every replica
+is an alias with the host of the standby server, like:
+'replica1': {
+    'ENGINE': 'django.db.backends.postgresql',
+    'NAME': 'webtasks',
+    'HOST': 'replica1.example.com',
+    'TEST': {'MIRROR': 'default'},
+}
+add replicas to read more, the reads are spread over all of them.
+"""
+
+from .settings import *
+
+DATABASES = dict(DATABASES, **{
+    alias: {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'tasks-{}.sqlite3'.format(alias)),
+        'TEST': {'MIRROR': 'default'},
+    }
+    for alias in ('replica1', 'replica2')
+})
+
+TASKS_READ_REPLICAS = ['replica1', 'replica2']
+
+# the longest lag of the replicas, the seconds a user reads from the
+# default database after a change.
+TASKS_REPLICA_STICKY_SECONDS = 10
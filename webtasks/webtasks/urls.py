@@ -2,13 +2,15 @@ from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView
 from django.conf import settings
-from django.views.static import serve
 from django.conf.urls import url
+from tasks import views as task_views
+from tasks.assets import serve
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('tasks/', include('tasks.urls')),
+    path('metrics', task_views.metrics, name='metrics'),
     path('', RedirectView.as_view(url='tasks/', permanent=True)),
     url(r'^static/(?P<path>.*)$', serve,{'document_root': settings.STATIC_ROOT}),
 ] 